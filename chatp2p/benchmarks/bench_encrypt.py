@@ -0,0 +1,49 @@
+"""Compara mensagens/s do modo legado (X25519 por mensagem) com o modo de sessão.
+
+Uso: python benchmarks/bench_encrypt.py [--messages N] [--size BYTES]
+"""
+import argparse, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.encrypt_utils import (
+    generate_ecc_keys,
+    generate_session_salt,
+    derive_session_key,
+    Session_cipher,
+    Public_key_cipher
+)
+
+def run(sender, receiver, message, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        receiver.decrypt(sender.encrypt(message))
+    elapsed = time.perf_counter() - start
+    return count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de criptografia por mensagem")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=64, help="Tamanho do conteúdo de cada mensagem")
+    args = parser.parse_args()
+
+    peer_private, peer_public = generate_ecc_keys()
+    tracker_private, tracker_public = generate_ecc_keys()
+    message = json.dumps({"cmd": "heartbeat", "content": "x" * args.size})
+
+    legacy_rate = run(Public_key_cipher(peer_private, tracker_public),
+                      Public_key_cipher(tracker_private, peer_public),
+                      message, args.messages)
+
+    salt = generate_session_salt()
+    session_rate = run(Session_cipher(derive_session_key(peer_private, tracker_public, salt), initiator=True),
+                       Session_cipher(derive_session_key(tracker_private, peer_public, salt), initiator=False),
+                       message, args.messages)
+
+    print(f"Mensagens: {args.messages} de {len(message)} bytes (cifrar + decifrar)")
+    print(f"Chave pública por mensagem: {legacy_rate:10.0f} msg/s")
+    print(f"Chave de sessão:            {session_rate:10.0f} msg/s")
+    print(f"Ganho:                      {session_rate / legacy_rate:10.1f}x")
+
+if __name__ == "__main__":
+    main()
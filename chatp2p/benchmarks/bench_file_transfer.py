@@ -0,0 +1,91 @@
+"""Mede a vazão de uma transferência de arquivo entre dois canais cifrados em loopback.
+
+Também reporta o pico de memória do processo, que não deve crescer com o tamanho do arquivo.
+Com --resume, metade do arquivo já está no .part do destino e só o restante é enviado.
+
+Uso: python benchmarks/bench_file_transfer.py [--size MB] [--chunk-size KB] [--window N] [--resume]
+"""
+import argparse, os, resource, shutil, socket, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.channel_utils import Secure_channel
+from utils.encrypt_utils import generate_ecc_keys, generate_session_salt, derive_session_key, Session_cipher
+from utils.envelope_utils import ENVELOPE_VERSION
+from peer_managers.file_transfer_manager import File_transfer_manager, FILE_CHUNK_SIZE, FILE_WINDOW, format_throughput
+
+def make_channels():
+    sender_private, sender_public = generate_ecc_keys()
+    receiver_private, receiver_public = generate_ecc_keys()
+    salt = generate_session_salt()
+    sender_sock, receiver_sock = socket.socketpair()
+    sender = Secure_channel(sender_sock, Session_cipher(derive_session_key(sender_private, receiver_public, salt), True), ENVELOPE_VERSION)
+    receiver = Secure_channel(receiver_sock, Session_cipher(derive_session_key(receiver_private, sender_public, salt), False), ENVELOPE_VERSION)
+    return sender, receiver
+
+def read_channel(channel, manager, peer_username):
+    while True:
+        try:
+            data = channel.recv_message()
+        except OSError:
+            return
+        if data is None:
+            return
+        manager.handle_message(channel, peer_username, data)
+
+def write_file(path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as file:
+        for _ in range(size // len(block)):
+            file.write(block)
+        file.write(block[:size % len(block)])
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de transferência de arquivos entre peers")
+    parser.add_argument("--size", type=int, default=256, help="Tamanho do arquivo em MB")
+    parser.add_argument("--chunk-size", type=int, default=FILE_CHUNK_SIZE // 1024, help="Tamanho de cada pedaço em KB")
+    parser.add_argument("--window", type=int, default=FILE_WINDOW, help="Pedaços enviados sem confirmação")
+    parser.add_argument("--resume", action="store_true", help="Começa com metade do arquivo já recebida")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_file_")
+    try:
+        size = args.size * 1024 * 1024
+        path = os.path.join(workdir, "arquivo.bin")
+        write_file(path, size)
+        rss_before = peak_rss_mb()
+
+        quiet = lambda text: None
+        chunk_size = args.chunk_size * 1024
+        sender_manager = File_transfer_manager(quiet, chunk_size, args.window, os.path.join(workdir, "enviados"))
+        receiver_manager = File_transfer_manager(quiet, chunk_size, args.window, os.path.join(workdir, "recebidos"))
+        if args.resume:
+            os.makedirs(receiver_manager.downloads_dir)
+            with open(path, "rb") as source, open(os.path.join(receiver_manager.downloads_dir, f".remetente.arquivo.bin.{size}.part"), "wb") as part:
+                shutil.copyfileobj(source, part, chunk_size)
+                part.truncate(size // 2)
+
+        sender, receiver = make_channels()
+        threading.Thread(target=read_channel, args=(receiver, receiver_manager, "remetente"), daemon=True).start()
+        threading.Thread(target=read_channel, args=(sender, sender_manager, "destino"), daemon=True).start()
+
+        start = time.monotonic()
+        sent, elapsed = sender_manager.send_file(sender, "destino", path)
+        total = time.monotonic() - start
+        received = os.path.join(receiver_manager.downloads_dir, "arquivo.bin")
+
+        print(f"Arquivo de {args.size} MB, pedaços de {args.chunk_size} KB, janela de {args.window}")
+        print(f"Enviados:        {format_throughput(sent, elapsed)}")
+        print(f"Total com oferta e verificação: {total:.2f} s")
+        print(f"Arquivo recebido íntegro: {'sim' if os.path.getsize(received) == size else 'não'}")
+        print(f"Pico de RSS: {peak_rss_mb():.1f} MB (antes da transferência {rss_before:.1f} MB)")
+        sender.close()
+        receiver.close()
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
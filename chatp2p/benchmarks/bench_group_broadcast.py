@@ -0,0 +1,54 @@
+"""Compara o custo de enviar uma mensagem para a sala cifrando por membro e com a chave de grupo.
+
+Uso: python benchmarks/bench_group_broadcast.py [--members N] [--messages N] [--size BYTES]
+"""
+import argparse, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.encrypt_utils import (
+    generate_ecc_keys,
+    generate_session_salt,
+    derive_session_key,
+    Session_cipher,
+    Group_sender_key
+)
+
+def per_member(ciphers, message, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        for cipher in ciphers:
+            cipher.encrypt(message)
+    return (time.perf_counter() - start) / count
+
+def group_key(sender_key, message, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        sender_key.seal(message, "bench", bytes(8))
+    return (time.perf_counter() - start) / count
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de envio de mensagens para a sala")
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=64, help="Tamanho do conteúdo de cada mensagem")
+    args = parser.parse_args()
+
+    private_key, _ = generate_ecc_keys()
+    ciphers = []
+    for _ in range(args.members):
+        _, member_public = generate_ecc_keys()
+        session_key = derive_session_key(private_key, member_public, generate_session_salt())
+        ciphers.append(Session_cipher(session_key, initiator=True))
+    message = json.dumps({"type": "group_message", "content": "x" * args.size})
+
+    pairwise = per_member(ciphers, message, args.messages)
+    group = group_key(Group_sender_key(1), message, args.messages)
+
+    print(f"Sala com {args.members} membros, {args.messages} mensagens de {len(message)} bytes")
+    print(f"Cifrando por membro: {pairwise * 1e6:10.1f} µs/mensagem")
+    print(f"Chave de grupo:      {group * 1e6:10.1f} µs/mensagem")
+    print(f"Ganho:               {pairwise / group:10.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Mede o histórico local: custo de anexar, "últimas N", rolagem para trás e busca por horário.
+
+As leituras usam o índice mapeado em memória, então o tempo não deve crescer com o total
+de mensagens, e a rotação mantém o disco abaixo de max-segments × segment-size.
+
+Uso: python benchmarks/bench_history.py [--messages N] [--size BYTES] [--segment-size KB] [--max-segments N]
+"""
+import argparse, os, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.history_utils import History_log, HISTORY_SEGMENT_SIZE, HISTORY_MAX_SEGMENTS
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do histórico de mensagens")
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--size", type=int, default=80, help="Tamanho do conteúdo de cada mensagem")
+    parser.add_argument("--segment-size", type=int, default=HISTORY_SEGMENT_SIZE // 1024, help="Tamanho de cada segmento em KB")
+    parser.add_argument("--max-segments", type=int, default=HISTORY_MAX_SEGMENTS)
+    parser.add_argument("--reads", type=int, default=200, help="Repetições de cada leitura")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_history_")
+    try:
+        history = History_log(workdir, args.segment_size * 1024, args.max_segments)
+        content = "x" * args.size
+        first_time = time.time() - args.messages # Uma mensagem por segundo até agora
+
+        start = time.perf_counter()
+        for number in range(args.messages):
+            history.append({"from": "bench", "content": content}, timestamp=first_time + number)
+        append = (time.perf_counter() - start) / args.messages
+
+        kept = history.next_sequence() - history.first_sequence()
+        middle = history.first_sequence() + kept // 2
+        middle_time = first_time + middle
+        last_50, _ = timed(lambda: history.last(50), args.reads)
+        scroll, _ = timed(lambda: history.last(50, before=middle), args.reads)
+        window, records = timed(lambda: history.between(middle_time, middle_time + 600), args.reads)
+
+        print(f"{args.messages} mensagens de {args.size} bytes, segmentos de {args.segment_size} KB (máx. {args.max_segments})")
+        print(f"Anexar:                  {append * 1e6:10.1f} µs/mensagem")
+        print(f"Últimas 50:              {last_50 * 1e6:10.1f} µs")
+        print(f"50 antes do meio:        {scroll * 1e6:10.1f} µs")
+        print(f"Intervalo de 10 minutos: {window * 1e6:10.1f} µs ({len(records)} mensagens)")
+        print(f"Mensagens mantidas:      {kept:10d} em {len(history.segments)} segmentos")
+        print(f"Uso de disco:            {history.disk_usage() / 1024:10.1f} KB")
+        history.close()
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Rajada de logins simultâneos contra o User_manager com senhas em argon2id.
+
+Compara o KDF calculado segurando users_lock (como era com o SHA-256) com o pool do
+Password_manager fora do lock: além da vazão e da latência dos logins, mede quanto uma
+operação barata que usa users_lock espera durante a rajada. Por fim mostra o limite por
+endereço recusando um atacante sem afetar os demais.
+
+Uso: python benchmarks/bench_login_storm.py [--users N] [--threads N] [--kdf-mem MiB] [--kdf-ops N] [--workers N]
+"""
+import argparse, os, shutil, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.encrypt_utils import verify_password, PASSWORD_OPSLIMIT, PASSWORD_MEMLIMIT
+from utils.scheduler_utils import Expiry_scheduler
+from tracker_managers.password_manager import Password_manager, PASSWORD_WORKERS, PASSWORD_RATE, PASSWORD_BURST
+from tracker_managers.user_manager import User_manager
+
+PASSWORD = "senha-do-benchmark"
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def login_with_lock(user_manager, user):
+    # Caminho antigo: o hash é verificado com users_lock adquirido
+    with user_manager.users_lock:
+        return verify_password(user_manager.users[user]["password"], PASSWORD)
+
+def login_with_pool(user_manager, user):
+    return user_manager.login(user, PASSWORD, ("127.0.0.1", 0), 0, "", None)["status"] == "ok"
+
+def run_storm(user_manager, users, threads, login):
+    latencies, probes = [], []
+    done = threading.Event()
+
+    def probe():
+        # Operação que só precisa de users_lock por um instante (como get-mailbox-key)
+        while not done.is_set():
+            start = time.perf_counter()
+            user_manager.get_mailbox_key(users[0])
+            probes.append(time.perf_counter() - start)
+            time.sleep(0.001)
+
+    def timed_login(user):
+        start = time.perf_counter()
+        if not login(user_manager, user):
+            raise RuntimeError(f"Login de {user} falhou")
+        latencies.append(time.perf_counter() - start)
+
+    probe_thread = threading.Thread(target=probe)
+    probe_thread.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(timed_login, users))
+    elapsed = time.perf_counter() - start
+    done.set()
+    probe_thread.join()
+    return elapsed, latencies, probes
+
+def print_storm(title, users, elapsed, latencies, probes):
+    print(f"{title}")
+    print(f"  {len(users) / elapsed:8.1f} logins/s | login p50 {percentile(latencies, 0.5) * 1000:7.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms")
+    print(f"  operação com users_lock durante a rajada: p99 {percentile(probes, 0.99) * 1000:7.2f} ms, "
+          f"máx {max(probes, default=0) * 1000:7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de rajada de logins com argon2id")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=32, help="Logins simultâneos")
+    parser.add_argument("--kdf-ops", type=int, default=PASSWORD_OPSLIMIT)
+    parser.add_argument("--kdf-mem", type=int, default=PASSWORD_MEMLIMIT // (1024 * 1024), help="MiB por hash")
+    parser.add_argument("--workers", type=int, default=PASSWORD_WORKERS, help="Threads do pool do KDF")
+    parser.add_argument("--attempts", type=int, default=100, help="Tentativas seguidas de um mesmo endereço")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_login_")
+    previous_dir = os.getcwd()
+    os.chdir(workdir) # O User_manager grava o diário em data_storage/
+    os.makedirs("data_storage")
+    try:
+        scheduler = Expiry_scheduler()
+        scheduler.start()
+        # Sem limite por endereço na rajada: todos os logins vêm do mesmo processo
+        password_manager = Password_manager(workers=args.workers, max_pending=args.threads, opslimit=args.kdf_ops,
+                                           memlimit=args.kdf_mem * 1024 * 1024, rate=0, burst=0)
+        user_manager = User_manager(scheduler, password_manager=password_manager)
+        password_hash = password_manager.hash(PASSWORD)
+        users = [f"usuario{number}" for number in range(args.users)]
+        for user in users:
+            user_manager.users[user] = {"password": password_hash, "mailbox-key": ""}
+
+        print(f"{args.users} logins, {args.threads} simultâneos, argon2id t={args.kdf_ops} m={args.kdf_mem} MiB, "
+              f"{args.workers} worker(s) no pool")
+        print_storm("KDF com users_lock adquirido:", users, *run_storm(user_manager, users, args.threads, login_with_lock))
+        print_storm("KDF no pool, fora do lock:", users, *run_storm(user_manager, users, args.threads, login_with_pool))
+
+        throttled = Password_manager(workers=1, rate=PASSWORD_RATE, burst=PASSWORD_BURST)
+        accepted = sum(throttled.allow("10.0.0.66") for _ in range(args.attempts))
+        print(f"Limite por endereço ({PASSWORD_BURST} seguidas, {PASSWORD_RATE}/s): atacante teve {accepted} de "
+              f"{args.attempts} tentativas aceitas; outro endereço aceito: {'sim' if throttled.allow('10.0.0.7') else 'não'}")
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
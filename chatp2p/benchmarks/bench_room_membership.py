@@ -0,0 +1,53 @@
+"""Mede o custo de join/leave e add/remove de membros em função do tamanho da sala.
+
+Uso: python benchmarks/bench_room_membership.py [--sizes 100,1000,10000] [--ops N]
+"""
+import argparse, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracker_managers.room_manager import Room_manager
+from utils.scheduler_utils import Expiry_scheduler
+
+def bench_room(room_manager, room_name, size, ops):
+    users = {f"user{i}": {} for i in range(size)}
+    room_manager.create_room(room_name, "moderator")
+    for user in users:
+        room_manager.add_member(room_name, user, "moderator", users)
+        room_manager.join_room(room_name, user)
+
+    probe = "user0"
+    start = time.perf_counter()
+    for _ in range(ops):
+        room_manager.leave_room(room_name, probe)
+        room_manager.join_room(room_name, probe)
+    join_leave = (time.perf_counter() - start) / (2 * ops)
+
+    users["probe"] = {}
+    start = time.perf_counter()
+    for _ in range(ops):
+        room_manager.add_member(room_name, "probe", "moderator", users)
+        room_manager.remove_member(room_name, "probe", "moderator")
+    add_remove = (time.perf_counter() - start) / (2 * ops)
+
+    return join_leave, add_remove
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de pertinência em salas")
+    parser.add_argument("--sizes", default="100,1000,10000,50000")
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    # O Room_manager persiste em data_storage/ relativo ao diretório atual
+    workdir = tempfile.mkdtemp(prefix="chatp2p-bench-")
+    os.makedirs(os.path.join(workdir, "data_storage"))
+    os.chdir(workdir)
+
+    room_manager = Room_manager(Expiry_scheduler())
+    print(f"{'membros':>10} {'join/leave (us)':>16} {'add/remove (us)':>16}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        join_leave, add_remove = bench_room(room_manager, f"sala-{size}", size, args.ops)
+        print(f"{size:>10} {join_leave * 1e6:>16.2f} {add_remove * 1e6:>16.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""Gerador de carga para o tracker: milhares de peers simulados falando o protocolo real.
+
+Cada peer simulado faz a troca de chaves, `register`, `login`, entra em uma sala
+(o primeiro peer de cada grupo faz `create-room` e `add-member` dos demais), consulta
+`get-room-members`, envia alguns heartbeats e termina com `logout`. Os heartbeats vão
+por UDP quando o tracker os oferece no login (ou como comando TCP com --tcp-heartbeat).
+As mensagens usam o envelope binário quando o tracker o anuncia; --envelope limita a versão
+para comparar o tráfego (0 = JSON cifrado em base64, 1 = binário, 2 = binário com compressão).
+
+Exemplos (a partir da pasta chatp2p):
+    python benchmarks/load_tracker.py --spawn --peers 2000
+    python benchmarks/load_tracker.py --spawn --peers 5000 --tracker-args="--async --backlog 4096"
+    python benchmarks/load_tracker.py --spawn --peers 5000 --tracker-args="--workers 4 --async --backlog 4096 --kdf-queue 1000"
+    python benchmarks/load_tracker.py --port 6000 --tracker-pid 12345
+
+Contra um tracker já em execução, suba-o com --backlog de pelo menos --connect-concurrency.
+Cada handshake, resposta e espera pelo grupo tem um limite (--timeout), e a execução inteira
+também (--run-timeout): peers travados aparecem como erros em vez de prender o benchmark.
+"""
+import argparse, asyncio, base64, json, os, resource, shlex, socket, subprocess, sys, tempfile, time, uuid
+
+CHATP2P_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CHATP2P_DIR)
+
+from utils.framing_utils import encode_frame, read_frame, read_frame_with_kind, FRAME_HEADER, FRAME_HANDSHAKE
+from utils.envelope_utils import ENVELOPE_VERSION, negotiate_envelope, encode_handshake, seal_message, open_message, new_compression_context
+from utils.heartbeat_utils import encode_heartbeat
+from utils.encrypt_utils import (
+    generate_ecc_keys,
+    serialize_public_key,
+    deserialize_public_key,
+    generate_session_salt,
+    derive_session_key,
+    Session_cipher,
+    Public_key_cipher
+)
+
+EVENTS_KEY = "(eventos)"
+
+class Simulated_peer:
+    def __init__(self, username, latencies, traffic, timeout=None):
+        self.username = username
+        self.timeout = timeout # Segundos para o handshake e para cada resposta; um peer travado vira erro
+        self.latencies = latencies
+        self.traffic = traffic
+        self.envelope = 0
+        self.compression = None
+        self.private_key, self.public_key = generate_ecc_keys()
+        self.public_key_str = serialize_public_key(self.public_key)
+        self.reader = None
+        self.writer = None
+        self.cipher = None
+        self.heartbeat_info = None
+        self.heartbeat_counter = 0
+
+    async def connect(self, host, port, max_envelope=ENVELOPE_VERSION):
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.timeout):
+                self.reader, self.writer = await asyncio.open_connection(host, port)
+                tracker_handshake = json.loads(await read_frame(self.reader))
+        except TimeoutError:
+            raise TimeoutError("tracker não enviou o handshake") from None
+        tracker_public_key = deserialize_public_key(tracker_handshake["public_key"])
+        self.envelope = min(max_envelope, negotiate_envelope(tracker_handshake.get("envelope")))
+        self.compression = new_compression_context(self.envelope)
+
+        if self.envelope:
+            session_salt = generate_session_salt(raw=True)
+            self.cipher = Session_cipher(derive_session_key(self.private_key, tracker_public_key, session_salt), initiator=True)
+            self.writer.write(encode_frame(encode_handshake(self.envelope, self.public_key, session_salt), FRAME_HANDSHAKE))
+        else:
+            handshake = {"public_key": self.public_key_str}
+            if tracker_handshake.get("session"):
+                handshake["session-salt"] = generate_session_salt()
+                session_key = derive_session_key(self.private_key, tracker_public_key, handshake["session-salt"])
+                self.cipher = Session_cipher(session_key, initiator=True)
+            else:
+                self.cipher = Public_key_cipher(self.private_key, tracker_public_key)
+            self.writer.write(encode_frame(json.dumps(handshake)))
+        await self.writer.drain()
+        self.latencies.setdefault("key-exchange", []).append(time.perf_counter() - start)
+
+    async def request(self, requisition):
+        start = time.perf_counter()
+        kind, payload = seal_message(self.cipher, requisition, self.envelope, self.compression)
+        frame = encode_frame(payload, kind)
+        self.traffic["sent"] += len(frame)
+        self.writer.write(frame)
+        try:
+            async with asyncio.timeout(self.timeout):
+                await self.writer.drain()
+                response = await self.read_response()
+        except TimeoutError:
+            raise TimeoutError(f"sem resposta para '{requisition['cmd']}'") from None
+        self.latencies.setdefault(requisition["cmd"], []).append(time.perf_counter() - start)
+        return response
+
+    async def read_response(self):
+        while True:
+            kind, encrypted_data = await read_frame_with_kind(self.reader)
+            if not encrypted_data:
+                raise ConnectionResetError("Tracker encerrou a conexão")
+            self.traffic["received"] += FRAME_HEADER.size + len(encrypted_data)
+            response = open_message(self.cipher, kind, encrypted_data, self.compression)
+            if "event" not in response:
+                return response
+            # Eventos de sala empurrados pelo tracker chegam intercalados com as respostas
+            self.latencies.setdefault(EVENTS_KEY, []).append(0.0)
+
+    def send_udp_heartbeat(self, host):
+        start = time.perf_counter()
+        self.heartbeat_counter += 1
+        datagram = encode_heartbeat(bytes.fromhex(self.heartbeat_info["session-id"]), self.heartbeat_counter,
+                                    base64.b64decode(self.heartbeat_info["key"]))
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+            udp_socket.sendto(datagram, (host, self.heartbeat_info["port"]))
+        self.latencies.setdefault("heartbeat (udp)", []).append(time.perf_counter() - start)
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+
+async def wait_group(event, timeout):
+    # Um peer travado não pode segurar o resto do grupo para sempre
+    try:
+        async with asyncio.timeout(timeout):
+            await event.wait()
+    except TimeoutError:
+        raise TimeoutError("outros peers do grupo não avançaram") from None
+
+async def run_peer(index, args, run_id, group_events, connect_limit, latencies, traffic, errors):
+    group, position = divmod(index, args.group_size)
+    username = f"load-{run_id}-{index}"
+    room_name = f"load-{run_id}-room-{group}"
+    peer = Simulated_peer(username, latencies, traffic, args.timeout)
+    try:
+        async with connect_limit:
+            await peer.connect(args.host, args.port, args.envelope)
+        response = await peer.request({"cmd": "register", "usr": username, "password": "load"})
+        if response.get("status") != "ok":
+            raise RuntimeError(f"cadastro falhou: {response}")
+        response = await peer.request({"cmd": "login", "usr": username, "password": "load", "peer-listen-port": 0})
+        if response.get("status") != "ok":
+            raise RuntimeError(f"login falhou: {response}")
+        if not args.tcp_heartbeat:
+            peer.heartbeat_info = response.get("heartbeat")
+
+        if position == 0:
+            await peer.request({"cmd": "create-room", "room-name": room_name})
+            group_size = min(args.group_size, args.peers - group * args.group_size)
+            # Espera os outros peers do grupo existirem antes de adicioná-los
+            await wait_group(group_events[group]["registered"], args.timeout)
+            for member in range(1, group_size):
+                await peer.request({"cmd": "add-member", "room-name": room_name,
+                                    "user": f"load-{run_id}-{group * args.group_size + member}"})
+            group_events[group]["room-ready"].set()
+        else:
+            group_events[group]["pending"] -= 1
+            if group_events[group]["pending"] == 0:
+                group_events[group]["registered"].set()
+            await wait_group(group_events[group]["room-ready"], args.timeout)
+
+        await peer.request({"cmd": "join-room", "room-to-join": room_name})
+        await peer.request({"cmd": "get-room-members", "room-name": room_name})
+        for _ in range(args.heartbeats):
+            await asyncio.sleep(args.heartbeat_interval)
+            if peer.heartbeat_info:
+                peer.send_udp_heartbeat(args.host)
+            else:
+                await peer.request({"cmd": "heartbeat"})
+        await peer.request({"cmd": "logout"})
+    except Exception as e:
+        errors.append(f"{username}: {type(e).__name__}: {e}")
+        group_events[group]["registered"].set()
+        group_events[group]["room-ready"].set()
+    finally:
+        await peer.close()
+
+class Process_monitor:
+    """Lê CPU e memória do processo do tracker em /proc (Linux), somando os workers de --workers."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.peak_rss_kb = 0
+        self.cpu_by_pid = {} # Último tempo de CPU lido de cada processo; workers que saíram continuam somando
+
+    def pids(self):
+        try:
+            with open(f"/proc/{self.pid}/task/{self.pid}/children") as f:
+                return [self.pid] + [int(child) for child in f.read().split()]
+        except OSError:
+            return [self.pid]
+
+    def cpu_seconds(self):
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            self.cpu_by_pid[pid] = (int(fields[11]) + int(fields[12])) / self.ticks
+        return sum(self.cpu_by_pid.values())
+
+    def rss_kb(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1])
+            except OSError:
+                continue
+        return total
+
+    async def sample(self, interval=0.2):
+        while True:
+            self.peak_rss_kb = max(self.peak_rss_kb, self.rss_kb())
+            await asyncio.sleep(interval)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+async def run_load(args, monitor):
+    run_id = uuid.uuid4().hex[:8]
+    latencies, errors = {}, []
+    traffic = {"sent": 0, "received": 0}
+    connect_limit = asyncio.Semaphore(args.connect_concurrency)
+    groups = (args.peers + args.group_size - 1) // args.group_size
+    group_events = [{
+        "pending": min(args.group_size, args.peers - g * args.group_size) - 1,
+        "registered": asyncio.Event(),
+        "room-ready": asyncio.Event()
+    } for g in range(groups)]
+    for events in group_events:
+        if events["pending"] == 0:
+            events["registered"].set()
+
+    sampler = asyncio.create_task(monitor.sample()) if monitor else None
+    cpu_before = monitor.cpu_seconds() if monitor else 0
+    start = time.perf_counter()
+    try:
+        # Os timeouts por passo já cobrem peers travados; este limita a execução inteira
+        async with asyncio.timeout(args.run_timeout):
+            await asyncio.gather(*(run_peer(i, args, run_id, group_events, connect_limit, latencies, traffic, errors)
+                                   for i in range(args.peers)))
+    except TimeoutError:
+        errors.append(f"execução interrompida após {args.run_timeout:.0f} s; resultados parciais")
+    elapsed = time.perf_counter() - start
+    cpu_used = monitor.cpu_seconds() - cpu_before if monitor else 0
+    if sampler:
+        sampler.cancel()
+
+    events = len(latencies.pop(EVENTS_KEY, []))
+    total = sum(len(values) for values in latencies.values())
+    print(f"Peers: {args.peers} | erros: {len(errors)} | duração: {elapsed:.2f} s")
+    print(f"Requisições: {total} | vazão: {total / elapsed:.0f} req/s | eventos recebidos: {events}")
+    print(f"Tráfego com o tracker: {traffic['sent'] / 1024:.1f} KiB enviados, {traffic['received'] / 1024:.1f} KiB recebidos")
+    print(f"{'comando':>18} {'n':>8} {'p50 (ms)':>10} {'p99 (ms)':>10} {'máx (ms)':>10}")
+    for cmd, values in sorted(latencies.items()):
+        print(f"{cmd:>18} {len(values):>8} {percentile(values, 0.5) * 1000:>10.2f} "
+              f"{percentile(values, 0.99) * 1000:>10.2f} {max(values) * 1000:>10.2f}")
+    if monitor:
+        print(f"Tracker: CPU {cpu_used:.2f} s ({cpu_used / elapsed * 100:.0f}% de um núcleo) | "
+              f"RSS final {monitor.rss_kb() / 1024:.1f} MB | pico {monitor.peak_rss_kb / 1024:.1f} MB")
+    for error in errors[:10]:
+        print(f"[ERRO] {error}")
+    return 1 if errors else 0
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def spawn_tracker(args):
+    workdir = tempfile.mkdtemp(prefix="chatp2p-load-")
+    os.makedirs(os.path.join(workdir, "data_storage"))
+    # Todos os peers simulados vêm do mesmo endereço: sem o limite de logins por endereço,
+    # a menos que --tracker-args defina outro. A fila de conexões também precisa caber os
+    # handshakes simultâneos: com o padrão do tracker (5) a fila transborda, o kernel responde
+    # com SYN cookies e descarta o ACK final, e o peer fica "conectado" esperando um handshake
+    # que o tracker só recebe quando o peer desiste
+    command = [sys.executable, os.path.join(CHATP2P_DIR, "tracker.py"), "--port", str(args.port), "--login-rate", "0",
+               "--backlog", str(max(128, args.connect_concurrency))]
+    command += shlex.split(args.tracker_args)
+    log_file = open(os.path.join(workdir, "tracker.log"), "w")
+    process = subprocess.Popen(command, cwd=workdir, stdout=log_file, stderr=subprocess.STDOUT)
+    print(f"Tracker iniciado (pid {process.pid}, log em {log_file.name}): {' '.join(command)}")
+    time.sleep(args.startup_wait)
+    return process
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador de carga para o tracker do Chatp2p")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6000)
+    parser.add_argument("--peers", type=int, default=1000, help="Quantidade de peers simulados")
+    parser.add_argument("--group-size", type=int, default=10, help="Peers por sala")
+    parser.add_argument("--heartbeats", type=int, default=3, help="Heartbeats por peer")
+    parser.add_argument("--heartbeat-interval", type=float, default=0.5)
+    parser.add_argument("--envelope", type=int, default=ENVELOPE_VERSION, help="Versão máxima do envelope a negociar (0 = formato antigo)")
+    parser.add_argument("--tcp-heartbeat", action="store_true", help="Envia heartbeats como comando TCP mesmo com UDP disponível")
+    parser.add_argument("--connect-concurrency", type=int, default=200,
+                        help="Máximo de handshakes simultâneos")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Segundos de espera por handshake, resposta ou pelo grupo antes de contar erro no peer")
+    parser.add_argument("--run-timeout", type=float, default=600.0, help="Duração máxima da execução inteira")
+    parser.add_argument("--spawn", action="store_true", help="Sobe um tracker local em um diretório temporário")
+    parser.add_argument("--tracker-args", default="", help="Argumentos extras para o tracker com --spawn")
+    parser.add_argument("--tracker-pid", type=int, help="PID de um tracker já em execução para medir CPU/RSS")
+    parser.add_argument("--startup-wait", type=float, default=1.0)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    process = spawn_tracker(args) if args.spawn else None
+    pid = process.pid if process else args.tracker_pid
+    monitor = Process_monitor(pid) if pid and os.path.exists(f"/proc/{pid}") else None
+
+    try:
+        exit_code = asyncio.run(run_load(args, monitor))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
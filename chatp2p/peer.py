@@ -1,21 +1,71 @@
-import socket, json, time, threading, os, sys
-from utils.encrypt_utils import deserialize_public_key, encrypt_with_public_key, decrypt_with_private_key
+import socket, json, time, threading, os, sys, random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.framing_utils import send_frame, recv_frame_with_kind, FRAME_HANDSHAKE, MAX_HANDSHAKE_FRAME_SIZE
+from utils.envelope_utils import negotiate_envelope, encode_payload, encode_handshake, decode_handshake
+from utils.channel_utils import Secure_channel, SLOW_PEER_DISCONNECT
+from utils.encrypt_utils import (
+    deserialize_public_key,
+    encrypt_with_public_key,
+    decrypt_with_private_key,
+    seal_with_public_key,
+    open_with_private_key,
+    generate_session_salt,
+    derive_session_key,
+    Session_cipher,
+    Public_key_cipher,
+    Group_sender_key,
+    read_group_header,
+    open_group_message,
+    sign_group_message,
+    verify_group_message,
+    deserialize_verify_key
+)
+from nacl.exceptions import CryptoError
+from utils.overlay_utils import Seen_messages, new_message_id
 from peer_managers.tracker_connection_manager import Tracker_connection_manager
 from peer_managers.auth_manager import Auth_manager
 from peer_managers.peer_room_manager import Peer_room_manager
+from peer_managers.peer_connection_pool import Peer_connection_pool, recv_response
+from peer_managers.offline_message_manager import Offline_message_manager
+from peer_managers.history_manager import History_manager, HISTORY_CONTACT, HISTORY_ROOM
+from peer_managers.file_transfer_manager import File_transfer_manager, Transfer_error, FILE_MESSAGE_TYPES, format_throughput
 from utils.terminal_utils import clear_terminal
-from datetime import datetime
+from datetime import datetime, timedelta
+
+GROUP_JOIN_TIMEOUT = 5
+GROUP_JOIN_CONCURRENCY = 16
+GROUP_KEYS_KEPT = 3 # Chaves antigas de cada remetente mantidas para mensagens ainda em trânsito
+ROOM_SEND_QUEUE_SIZE = 256 # Mensagens pendentes por membro antes de aplicar a política de peer lento
+
+# Topologias de sala: malha completa (cada membro conectado a todos) ou overlay com grau limitado,
+# em que as mensagens são repassadas de vizinho em vizinho e as cópias descartadas pelo id
+ROOM_TOPOLOGY_MESH = "mesh"
+ROOM_TOPOLOGY_OVERLAY = "overlay"
+OVERLAY_DEGREE = 4      # Vizinhos que um membro procura ao entrar na sala
+OVERLAY_MAX_DEGREE = 8  # Acima disso novos pedidos de conexão são recusados
+OVERLAY_MIN_DEGREE = 2  # Abaixo disso o membro procura novos vizinhos
+
+HISTORY_PAGE_SIZE = 20     # Mensagens exibidas por /historico
+HISTORY_RANGE_LIMIT = 500  # Máximo de mensagens exibidas em uma busca por intervalo de horário
+
+def same_public_key(channel, public_key_str):
+    return (public_key_str is not None and channel.peer_public_key is not None
+            and bytes(channel.peer_public_key) == bytes(deserialize_public_key(public_key_str)))
 
 class Peer:
-    def __init__(self, peer_host= "0.0.0.0", peer_listen_port=5565, max_conec=5):
+    def __init__(self, peer_host= "0.0.0.0", peer_listen_port=5565, max_conec=5,
+                 room_send_queue=ROOM_SEND_QUEUE_SIZE, slow_peer_policy=SLOW_PEER_DISCONNECT):
         # # Configura conexao com tracker 
         self.tracker_connection = Tracker_connection_manager()
         self.tracker_connection.connect_to_tracker()
         self.tracker_public_key = self.tracker_connection.tracker_public_key
+        self.tracker_connection.on_event = self.process_tracker_event
         # Configura o manager de autenticação
         self.auth_manager = Auth_manager(self.tracker_connection, self)
         # Configura o manager de salas
         self.peer_room_manager = Peer_room_manager(self.tracker_connection)
+        # Configura o manager de mensagens para usuários offline
+        self.offline_message_manager = Offline_message_manager(self.tracker_connection)
 
         # Configura server de conexao com peers
         self.peer_host = peer_host
@@ -32,12 +82,31 @@ class Peer:
         self.chatting = False
         
         self.in_group_chat = False
+        self.room_closed = False # A sala foi encerrada ou fomos removidos: a thread principal sai dela
         self.current_room = None
-        self.room_peers_conn = {} # Dicionário para {username: {conn: socket, public_key: key}}
+        self.room_peers_conn = {} # Dicionário para {username: {channel: Secure_channel}}
         self.room_peers_lock = threading.Lock()
+        self.group_key = None # Chave de grupo com que este peer cifra suas mensagens na sala
+        self.group_key_message = None # Anúncio da chave atual, reenviado a cada novo vizinho
+        self.group_key_stale = False # Overlay: alguém entrou ou saiu, trocar a chave antes do próximo envio
+        self.room_topology = ROOM_TOPOLOGY_MESH
+        self.room_sender_keys = {} # remetente -> {key-id: Group_sender_key}
+        self.seen_messages = Seen_messages()
+        self.overlay_repairing = False
+        self.room_members_online = {} # Membros online da sala atual, mantido pelos eventos do tracker
+        self.room_send_queue = room_send_queue
+        self.slow_peer_policy = slow_peer_policy
         
         self.pending_requests_lock = threading.Lock()
         self.pending_chat_requests = []
+
+        # Conexões com outros peers que sobram de chats e salas ficam aqui para reuso
+        self.connection_pool = Peer_connection_pool(self.dispatch_peer_request)
+        # Transferências de arquivo pelos canais de chat e de sala
+        self.file_transfer_manager = File_transfer_manager(self.print_chat_notice)
+        # Histórico local das conversas, por contato e por sala
+        self.history_manager = History_manager()
+        self.history_cursor = None # Sequência da mensagem mais antiga já exibida por /historico
     
     
     def peer_listen(self):
@@ -51,6 +120,7 @@ class Peer:
         
     def start(self):
         threading.Thread(target=self.peer_listen, daemon=True).start()
+        self.connection_pool.start()
         while True:
             clear_terminal()
             print("========== Tela inicial Chatp2p ==========")
@@ -78,13 +148,78 @@ class Peer:
                     self.clean_pending_requests()
                     return # Sai do programa
 
+    def open_peer_channel(self, peer_ip, peer_port, peer_public_key, request_msg, timeout=None, envelope=0):
+        """Conecta a outro peer e envia o pedido inicial, derivando a chave de sessão da conexão.
+
+        envelope é a versão do envelope binário que o outro peer anunciou ao tracker no login.
+        """
+        chat_socket = socket.create_connection((peer_ip, peer_port), timeout=timeout)
+        envelope = negotiate_envelope(envelope)
+
+        if envelope:
+            session_salt = generate_session_salt(raw=True)
+            sealed_request = seal_with_public_key(peer_public_key, encode_payload(request_msg))
+            send_frame(chat_socket, encode_handshake(envelope, self.tracker_connection.public_key, session_salt, sealed_request),
+                       FRAME_HANDSHAKE)
+        else:
+            session_salt = generate_session_salt()
+            request_with_public_key = {
+                "public_key": self.tracker_connection.public_key_str,
+                "session-salt": session_salt,
+                "encrypted": encrypt_with_public_key(peer_public_key, json.dumps(request_msg))
+            }
+            send_frame(chat_socket, json.dumps(request_with_public_key))
+
+        session_key = derive_session_key(self.tracker_connection.private_key, peer_public_key, session_salt)
+        return Secure_channel(chat_socket, Session_cipher(session_key, initiator=True), envelope, peer_public_key)
+
+    def request_peer_channel(self, username, peer_ip, peer_port, peer_public_key, request_msg, timeout, envelope=0):
+        """Envia um pedido a outro peer e espera a resposta, retornando (canal, resposta).
+
+        Usa a conexão ociosa do pool se houver uma; se ela estiver morta, abre uma nova.
+        """
+        channel = self.connection_pool.acquire(username, peer_public_key)
+        if channel is not None:
+            try:
+                channel.settimeout(timeout)
+                channel.send_message(request_msg)
+                response = recv_response(channel, request_msg, timeout)
+                if response is not None:
+                    channel.settimeout(None)
+                    return channel, response
+            except socket.timeout:
+                channel.close()
+                raise
+            except (json.JSONDecodeError, ValueError, OSError):
+                pass
+            channel.close()
+
+        channel = self.open_peer_channel(peer_ip, peer_port, peer_public_key, request_msg, timeout=timeout, envelope=envelope)
+        try:
+            response = recv_response(channel, request_msg, timeout)
+            if response is None:
+                raise ConnectionResetError("Erro de conexão!")
+            channel.settimeout(None)
+        except Exception:
+            channel.close()
+            raise
+        return channel, response
+
     def process_new_peer_connection(self, user_connec, addr):
         try:
-            data = user_connec.recv(4096).decode()
+            kind, data = recv_frame_with_kind(user_connec, MAX_HANDSHAKE_FRAME_SIZE)
             if not data:
                 raise ConnectionResetError("Erro de conexão!")
 
-            request_with_pub = json.loads(data)
+            if kind == FRAME_HANDSHAKE:
+                envelope, user_chat_pub_key, session_salt, sealed_request = decode_handshake(data)
+                request = json.loads(open_with_private_key(self.tracker_connection.private_key, sealed_request))
+                session_key = derive_session_key(self.tracker_connection.private_key, user_chat_pub_key, session_salt)
+                channel = Secure_channel(user_connec, Session_cipher(session_key, initiator=False), envelope, user_chat_pub_key)
+                self.dispatch_peer_request(channel, request)
+                return
+
+            request_with_pub = json.loads(data.decode())
             user_chat_pub_key_str = request_with_pub["public_key"]
             user_chat_pub_key = deserialize_public_key(user_chat_pub_key_str)
             encrypted_data = request_with_pub["encrypted"]
@@ -93,14 +228,25 @@ class Peer:
             request = json.loads(decrypted_request_data)
             request_type = request.get("type")
 
-            match request_type:
+            if "session-salt" in request_with_pub:
+                session_key = derive_session_key(self.tracker_connection.private_key, user_chat_pub_key, request_with_pub["session-salt"])
+                channel = Secure_channel(user_connec, Session_cipher(session_key, initiator=False), peer_public_key=user_chat_pub_key)
+            else:
+                channel = Secure_channel(user_connec, Public_key_cipher(self.tracker_connection.private_key, user_chat_pub_key),
+                                         peer_public_key=user_chat_pub_key)
+
+            self.dispatch_peer_request(channel, request)
+        except (ConnectionResetError, json.JSONDecodeError, ValueError, OSError, CryptoError):
+            user_connec.close()
+
+    def dispatch_peer_request(self, channel, request):
+        """Atende um pedido vindo de uma conexão nova ou de uma conexão ociosa do pool."""
+        try:
+            match request.get("type"):
                 case "chat_request": 
                     if self.chatting or self.in_group_chat:
-                        response = {"type": "busy"}
-                        encrypted = encrypt_with_public_key(
-                                    user_chat_pub_key, json.dumps(response))
-                        user_connec.send(encrypted.encode())
-                        user_connec.close()
+                        channel.send_message({"type": "busy"})
+                        self.connection_pool.release(request.get("from_user"), channel)
                         return
 
                     requester_user = request.get("from_user")
@@ -108,8 +254,7 @@ class Peer:
                     with self.pending_requests_lock:
                         self.pending_chat_requests.append({
                             "user": requester_user,
-                            "conn": user_connec,
-                            "public_key": user_chat_pub_key
+                            "channel": channel
                             }
                         )
                 
@@ -117,57 +262,66 @@ class Peer:
                     room_name = request.get("room_name")
                     requester_user = request.get("from_user")
                     
-                    if self.in_group_chat and room_name == self.current_room:
+                    overlay_full = (self.room_topology == ROOM_TOPOLOGY_OVERLAY
+                                    and len(self.room_peers_conn) >= OVERLAY_MAX_DEGREE)
+                    # O nome vem de quem abriu a conexão: só vale se a chave do handshake for a que o tracker informou
+                    with self.room_peers_lock:
+                        member = self.room_members_online.get(requester_user)
+                    if (self.in_group_chat and room_name == self.current_room and not overlay_full
+                            and member is not None and same_public_key(channel, member.get("peer-public-key"))):
+                        channel.start_writer(self.room_send_queue, self.slow_peer_policy)
                         with self.room_peers_lock:
-                            self.room_peers_conn[requester_user] = {
-                                "conn": user_connec,
-                                "public_key": user_chat_pub_key
-                            }
-                        threading.Thread(target=self.receive_group_messages, args=(user_connec, requester_user), daemon=True).start()
-                        
-                        response = {"type": "group_join_accept"}
-                        encrypted = encrypt_with_public_key(user_chat_pub_key, json.dumps(response))
-                        user_connec.send(encrypted.encode())
-                        
-                        # Limpa a linha de input atual, imprime a notificação e redesenha o prompt
-                        sys.stdout.write('\r' + ' ' * 80 + '\r')
-                        print(f"[SALA] {requester_user} entrou no chat.")
-                        sys.stdout.write("Eu: ")
-                        sys.stdout.flush()
+                            self.room_peers_conn[requester_user] = {"channel": channel}
+                            channel.send_message({"type": "group_join_accept"})
+                            # Novo membro: troca a chave para que ele não leia mensagens anteriores
+                            if self.room_topology == ROOM_TOPOLOGY_MESH:
+                                self.rotate_group_key()
+                            else:
+                                self.group_key_stale = True
+                        threading.Thread(target=self.receive_group_messages, args=(channel, requester_user), daemon=True).start()
+                        self.print_room_line(f"[SALA] {requester_user} entrou no chat.")
                     else:
-                        user_connec.close()
+                        channel.send_message({"type": "group_join_refuse"})
+                        self.connection_pool.release(requester_user, channel)
                 case _:
-                    user_connec.close()
-        except (ConnectionResetError, json.JSONDecodeError, ValueError, OSError):
-            user_connec.close()
+                    channel.close()
+        except OSError:
+            channel.close()
 
-    def receive_group_messages(self, conn, peer_username):
-        """Escuta por mensagens de um peer específico no chat em grupo e as exibe na tela."""
-        while self.in_group_chat:
+    def receive_group_messages(self, channel, peer_username):
+        """Escuta por mensagens de um vizinho no chat em grupo, exibe-as e, no modo overlay, as repassa."""
+        released = False # Saída combinada (group_leave/group_leave_ack): a conexão volta ao pool
+        while True:
             try:
-                encrypted_message = conn.recv(4096).decode()
-                if not encrypted_message:
+                data = channel.recv_message()
+                if data is None:
                     break # Conexão fechada
-
-                decrypted_message = decrypt_with_private_key(self.tracker_connection.private_key, encrypted_message)
-                data = json.loads(decrypted_message)
                 
                 msg_type = data.get("type")
-                if msg_type == "group_message":
-                    # Melhoria na interface: Limpa a linha de input, imprime a mensagem e redesenha o prompt
-                    sys.stdout.write('\r' + ' ' * 80 + '\r') # Limpa a linha atual
-                    message = data['content'].strip()
-                    sys.stdout.write(f"{peer_username}: {message}\n")
-                    sys.stdout.write("Eu: ")
-                    sys.stdout.flush()
+                if msg_type == "group_key":
+                    self.process_group_key(data, peer_username)
+
+                elif msg_type == "group_sealed":
+                    self.process_group_sealed(data["sealed"], peer_username)
+
+                elif msg_type in FILE_MESSAGE_TYPES:
+                    self.file_transfer_manager.handle_message(channel, peer_username, data)
 
                 elif msg_type == "group_leave":
-                    sys.stdout.write('\r' + ' ' * 80 + '\r')
-                    print(f"[SALA] {peer_username} saiu do chat.")
-                    sys.stdout.write("Eu: ")
-                    sys.stdout.flush()
+                    with self.room_peers_lock:
+                        self.forget_member(peer_username)
+                    # No overlay a saída é anunciada pelo evento do tracker, que chega a todos os membros
+                    if self.room_topology == ROOM_TOPOLOGY_MESH:
+                        self.print_room_line(f"[SALA] {peer_username} saiu do chat.")
+                    channel.send_message({"type": "group_leave_ack"})
+                    released = True
                     break # Encerra a thread para este usuário
 
+                elif msg_type == "group_leave_ack":
+                    # Nós saímos da sala e o peer confirmou
+                    released = True
+                    break
+
             except (json.JSONDecodeError, ValueError, ConnectionResetError, OSError):
                 # Erros esperados quando a conexão é encerrada.
                 break
@@ -177,16 +331,156 @@ class Peer:
                 break
         
         # Rotina de limpeza da conexão
+        self.file_transfer_manager.connection_lost(peer_username)
+        lost_neighbour = False
         with self.room_peers_lock:
-            if peer_username in self.room_peers_conn:
-                self.room_peers_conn[peer_username]["conn"].close()
+            if self.room_peers_conn.get(peer_username, {}).get("channel") is channel:
                 del self.room_peers_conn[peer_username]
+                lost_neighbour = True
+                # Quem saiu conhecia a chave atual, então ela é trocada para os que ficaram. No overlay
+                # o vizinho pode continuar na sala por outros caminhos: só o evento do tracker o tira
+                if self.in_group_chat and self.room_topology == ROOM_TOPOLOGY_MESH:
+                    if not released:
+                        self.forget_member(peer_username)
+                    self.rotate_group_key()
+
+        if lost_neighbour and self.in_group_chat and self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+            self.repair_overlay()
+
+        if released:
+            self.connection_pool.release(peer_username, channel)
+            return
+        channel.close()
         
         if self.in_group_chat: # Só imprime a notificação se ainda estivermos no chat
-            sys.stdout.write('\r' + ' ' * 80 + '\r')
-            print(f"[SALA] Conexão com {peer_username} encerrada.")
-            sys.stdout.write("Eu: ")
-            sys.stdout.flush()
+            self.print_room_line(f"[SALA] Conexão com {peer_username} encerrada.")
+
+    def print_chat_notice(self, text):
+        # Avisos que chegam durante um chat (privado ou em sala) sem atrapalhar o prompt
+        if self.in_group_chat:
+            self.print_room_line(text)
+        else:
+            timestamp = datetime.now().strftime('%H:%M')
+            print(f"\r{text}\n[{timestamp}] Eu: ", end="", flush=True)
+
+    def print_room_line(self, text):
+        # Limpa a linha de input atual, imprime e redesenha o prompt
+        sys.stdout.write('\r' + ' ' * 80 + '\r')
+        sys.stdout.write(text + "\n")
+        sys.stdout.write("Eu: ")
+        sys.stdout.flush()
+
+    def forward_to_neighbours(self, source, send):
+        """Repassa uma mensagem da sala a todos os vizinhos exceto quem a entregou (modo overlay).
+
+        Deve ser chamada com room_peers_lock adquirido.
+        """
+        for peer_user, peer_info in self.room_peers_conn.items():
+            if peer_user != source:
+                try:
+                    send(peer_info["channel"])
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # A thread de recepção do vizinho cuida da conexão perdida
+
+    def member_verify_key(self, username):
+        """Chave de assinatura que o tracker informou para o membro, ou None.
+
+        Deve ser chamada com room_peers_lock adquirido.
+        """
+        signing_key = self.room_members_online.get(username, {}).get("signing-key")
+        return deserialize_verify_key(signing_key) if signing_key else None
+
+    def process_group_key(self, data, neighbour):
+        sender = data.get("from", neighbour)
+        with self.room_peers_lock:
+            if sender == self.username:
+                return
+            if self.room_topology == ROOM_TOPOLOGY_MESH:
+                # Em malha cada membro entrega a própria chave: o canal identifica o remetente
+                if sender != neighbour:
+                    return
+                sender_key = Group_sender_key.from_message(data)
+            else:
+                # No overlay a chave chega repassada: vale só com a assinatura da chave que o tracker informou
+                verify_key = self.member_verify_key(sender)
+                if verify_key is None:
+                    return
+                try:
+                    sender_key = Group_sender_key.from_message(data, verify_key)
+                except CryptoError:
+                    return
+            if not self.seen_messages.add(data.get("msg-id")):
+                return
+            sender_keys = self.room_sender_keys.setdefault(sender, {})
+            new_member = not sender_keys
+            sender_keys[sender_key.key_id] = sender_key
+            for key_id in [k for k in sender_keys if k <= sender_key.key_id - GROUP_KEYS_KEPT]:
+                del sender_keys[key_id]
+
+            if self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+                self.forward_to_neighbours(neighbour, lambda channel: channel.send_message(data))
+                # Alguém novo na sala: a próxima mensagem que enviarmos já sai com outra chave
+                if new_member:
+                    self.group_key_stale = True
+
+    def process_group_sealed(self, sealed_message, neighbour):
+        _, message_id, sender, _ = read_group_header(sealed_message)
+        with self.room_peers_lock:
+            if self.room_topology == ROOM_TOPOLOGY_MESH:
+                if sender != neighbour:
+                    return
+            else:
+                # A chave de grupo é conhecida por toda a sala; quem assina é só o remetente
+                signed_message = sealed_message
+                verify_key = self.member_verify_key(sender)
+                if verify_key is None:
+                    return
+                try:
+                    sealed_message = verify_group_message(verify_key, signed_message)
+                except CryptoError:
+                    return
+            if not self.seen_messages.add(message_id.hex()):
+                return
+            if self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+                # Repassa o mesmo texto cifrado, sem decifrar e cifrar de novo
+                self.forward_to_neighbours(neighbour, lambda channel: channel.send_group_frame(signed_message))
+            sender_keys = self.room_sender_keys.get(sender, {})
+
+        try:
+            data = json.loads(open_group_message(sender_keys, sealed_message))
+        except (ValueError, CryptoError):
+            return # Mensagem cifrada com uma chave que não recebemos
+        if data.get("from", sender) != sender:
+            return
+
+        if data.get("type") == "group_message" and self.in_group_chat:
+            self.history_manager.record(self.username, HISTORY_ROOM, self.current_room, sender, data['content'])
+            self.print_room_line(f"{sender}: {data['content'].strip()}")
+
+    def forget_member(self, username):
+        """Descarta as chaves de quem saiu; no modo overlay a próxima mensagem já sai com outra chave.
+
+        Deve ser chamada com room_peers_lock adquirido.
+        """
+        self.room_sender_keys.pop(username, None)
+        if self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+            self.group_key_stale = True
+
+    def repair_overlay(self):
+        """Se o número de vizinhos caiu abaixo do mínimo, conecta a outros membros online."""
+        with self.room_peers_lock:
+            if self.overlay_repairing or len(self.room_peers_conn) >= OVERLAY_MIN_DEGREE:
+                return
+            self.overlay_repairing = True
+        try:
+            with self.room_peers_lock:
+                candidates = {user: details for user, details in self.room_members_online.items()
+                              if user not in self.room_peers_conn}
+                missing = OVERLAY_DEGREE - len(self.room_peers_conn)
+            if candidates and missing > 0 and self.in_group_chat:
+                self.connect_to_room_members(candidates, missing)
+        finally:
+            self.overlay_repairing = False
     # FIM DA ALTERAÇÃO
     def process_chat_functions(self):
         while True:
@@ -209,6 +503,7 @@ class Peer:
             print("[5] Entrar em uma sala")
             print("[6] Gerenciar sala (se moderador)")
             print("[7] Ver pedidos de chat")
+            print("[8] Enviar mensagem para usuário offline")
             print("[0] Logout")            
             
             try:
@@ -225,6 +520,7 @@ class Peer:
                 case 5: self.process_join_room()
                 case 6: self.peer_room_manager.process_manage_room()
                 case 7: self.process_pending_chats()
+                case 8: self.process_send_offline()
                 case 0: 
                     self.process_logout()
                     return
@@ -289,47 +585,36 @@ class Peer:
             user_to_connect_public_key_str = response.get("peer-public-key")
             user_to_connect_public_key = deserialize_public_key(user_to_connect_public_key_str)
 
-            chat_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            try:
-                chat_socket.connect((user_to_connect_ip, user_to_connect_port))
-            except socket.error as e:
-                print(f"[Erro] Falha ao conectar com {user_to_connect}")
-            
             request_msg = {"type": "chat_request", "from_user": self.username}
-            encrypted = encrypt_with_public_key(user_to_connect_public_key, json.dumps(request_msg))
-            
-            request_with_public_key = {
-                "public_key": self.tracker_connection.public_key_str,
-                "encrypted": encrypted
-            }
 
             try:
                 with self.peer_connection_lock:
-                    chat_socket.send(json.dumps(request_with_public_key).encode())
                     print("Pedido de chat enviado, aguardando resposta...")
-                    chat_socket.settimeout(60.0)
-                    encrypted_res = chat_socket.recv(4096).decode()
-                    chat_socket.settimeout(None)
-                    if not encrypted_res:
-                        raise ConnectionResetError("Erro de conexão!")
+                    chat_channel, response = self.request_peer_channel(user_to_connect, user_to_connect_ip, user_to_connect_port,
+                                                                       user_to_connect_public_key, request_msg, timeout=60.0,
+                                                                       envelope=response.get("envelope", 0))
             
-                data = decrypt_with_private_key(self.tracker_connection.private_key, encrypted_res)
-                response = json.loads(data)
                 response_type = response.get("type")
                 
                 match response_type:
                     case "busy":
                         print(f"{user_to_connect} já está em outro chat")
-                        chat_socket.close()
+                        self.connection_pool.release(user_to_connect, chat_channel)
                     case "accept":
                         print(f"{user_to_connect} aceitou o seu pedido, iniciando chat...")
                         time.sleep(1)
-                        self.handle_peer_chat(chat_socket, user_to_connect_public_key, user_to_connect)
+                        self.handle_peer_chat(chat_channel, user_to_connect)
+                    case "refuse":
+                        print(f"{user_to_connect} recusou o pedido")
+                        self.connection_pool.release(user_to_connect, chat_channel)
                     case _:
                         print(f"{user_to_connect} recusou o pedido")
+                        chat_channel.close()
             
             except socket.timeout:
                 print(f"{user_to_connect} não respondeu ao pedido.")               
+            except socket.error as e:
+                print(f"[Erro] Falha ao conectar com {user_to_connect}")
             except Exception as e:
                 print(f"A conexão com {user_to_connect} foi perdida! {e}")
             finally:
@@ -340,6 +625,38 @@ class Peer:
             input("Pressione qualquer tecla para retornar...")
         
 
+    def process_send_offline(self):
+        clear_terminal()
+        print("========== Mensagem para usuário offline ==========")
+        recipient = input("Digite o usuário: ").strip()
+        content = input("Digite a mensagem: ").strip()
+        if recipient and content:
+            response = self.offline_message_manager.send(self.username, recipient, content)
+            print(response.get("message"))
+            if response.get("status") == "ok":
+                self.history_manager.record(self.username, HISTORY_CONTACT, recipient, self.username, content)
+        input("Pressione qualquer tecla para retornar: ")
+
+    def receive_offline_messages(self, queued_messages):
+        # Mensagens recebidas pelo tracker entram no histórico do contato, como as do chat privado
+        messages = self.offline_message_manager.receive(queued_messages)
+        for message in messages:
+            self.history_manager.record(self.username, HISTORY_CONTACT, message["from"], message["from"], message["content"])
+        return messages
+
+    def show_offline_messages(self, queued_messages):
+        messages = self.receive_offline_messages(queued_messages)
+        if not messages:
+            return
+        print(f"Você recebeu {len(messages)} mensagem(ns) enquanto estava offline:")
+        for message in messages:
+            print(self.format_offline_message(message))
+        input("Pressione qualquer tecla para continuar: ")
+
+    def format_offline_message(self, message):
+        timestamp = datetime.fromtimestamp(message["time"]).strftime('%d/%m %H:%M')
+        return f"[OFFLINE {timestamp}] {message['from']}: {message['content']}"
+
     def process_list_rooms(self):
         requisition = {
             "cmd": "list-rooms"
@@ -358,12 +675,14 @@ class Peer:
 
         input("pressione qualquer tecla para retornar: ")
 
-    def handle_peer_chat(self, conn, peer_public_key, peer_username):
+    def handle_peer_chat(self, channel, peer_username):
         self.chatting = True
         clear_terminal()
-        print(f"Chat com {peer_username} iniciado. Digite '/sair' para sair.")
+        print(f"Chat com {peer_username} iniciado. Digite '/sair' para sair, '/arquivo <caminho>' para enviar um arquivo "
+              "ou '/historico' para ver mensagens anteriores.")
+        self.history_cursor = None
 
-        threading.Thread(target=self.receive_messages,args=(conn, peer_username), daemon=True).start()
+        threading.Thread(target=self.receive_messages,args=(channel, peer_username), daemon=True).start()
 
         while self.chatting:
             try:
@@ -374,17 +693,19 @@ class Peer:
                     break
 
                 if message_text.lower() == '/sair':
-                    notification = {"type": "exit"}
-                    encrypted_notification = encrypt_with_public_key(peer_public_key, json.dumps(notification))
-                    conn.send(encrypted_notification.encode())
+                    channel.send_message({"type": "exit"})
                     self.chatting = False
                     break
+                if message_text.lower().startswith('/arquivo'):
+                    self.start_file_transfer(message_text[len('/arquivo'):].strip(), [(peer_username, channel)])
+                    continue
+                if message_text.lower().startswith('/historico'):
+                    self.process_history_command(message_text[len('/historico'):].split(), HISTORY_CONTACT, peer_username)
+                    continue
                 
                 message_to_send = {"type": "message", "content": message_text}
-                json_message = json.dumps(message_to_send)
-                encrypted_message = encrypt_with_public_key(peer_public_key, json_message)
-                
-                conn.send(encrypted_message.encode())
+                channel.send_message(message_to_send)
+                self.history_manager.record(self.username, HISTORY_CONTACT, peer_username, self.username, message_text)
 
             except (BrokenPipeError, ConnectionResetError):
                 print(f"\n[AVISO] Não foi possível enviar a mensagem. O usuário {peer_username} desconectou.")
@@ -395,31 +716,40 @@ class Peer:
                 self.chatting = False
                 break
         
+        # A conexão é fechada ou devolvida ao pool pela thread de recepção
         print("\nChat encerrado.")
-        conn.close()
         self.chatting = False
         self.clean_pending_requests()
     
-    def receive_messages(self, conn, peer_username):
-        while self.chatting:
+    def receive_messages(self, channel, peer_username):
+        released = False # Saída combinada (exit/exit_ack): a conexão volta ao pool
+        while True:
             try:
-                encrypted_message = conn.recv(4096).decode()
+                data = channel.recv_message()
                 
-                if not encrypted_message:
+                if data is None:
                     if self.chatting:
                         print(f"\n[AVISO] Conexão perdida com {peer_username}.")
                     self.chatting = False
                     break
-                
-                decrypted_message = decrypt_with_private_key(self.tracker_connection.private_key, encrypted_message)
-                data = json.loads(decrypted_message)
 
                 if data.get("type") == "exit":
                     print(f"\n[AVISO] {peer_username} encerrou o chat.")
                     self.chatting = False
+                    channel.send_message({"type": "exit_ack"})
+                    released = True
+                    break
+
+                elif data.get("type") == "exit_ack":
+                    # Nós digitamos /sair e o peer confirmou
+                    released = True
                     break
                 
-                elif data.get("type") == "message":
+                elif data.get("type") in FILE_MESSAGE_TYPES:
+                    self.file_transfer_manager.handle_message(channel, peer_username, data)
+
+                elif data.get("type") == "message" and self.chatting:
+                    self.history_manager.record(self.username, HISTORY_CONTACT, peer_username, peer_username, data['content'])
                     timestamp = datetime.now().strftime('%H:%M')
                     print(f"\r[{timestamp}] {peer_username}: {data['content']}\n[{timestamp}] Eu: ", end="")
 
@@ -431,6 +761,28 @@ class Peer:
                 self.chatting = False
                 break
 
+        self.file_transfer_manager.connection_lost(peer_username)
+        if released:
+            self.connection_pool.release(peer_username, channel)
+        else:
+            channel.close()
+
+    def start_file_transfer(self, path, destinations):
+        """Envia o arquivo a cada destino (usuário, canal) em uma thread própria, sem travar o chat."""
+        if not path or not os.path.isfile(path):
+            print("Uso: /arquivo <caminho de um arquivo existente>")
+            return
+        for peer_username, channel in destinations:
+            threading.Thread(target=self.send_file, args=(channel, peer_username, path), daemon=True).start()
+
+    def send_file(self, channel, peer_username, path):
+        name = os.path.basename(path)
+        try:
+            sent, elapsed = self.file_transfer_manager.send_file(channel, peer_username, path)
+            self.print_chat_notice(f"[ARQUIVO] '{name}' enviado para {peer_username}: {format_throughput(sent, elapsed)}")
+        except (Transfer_error, OSError) as e:
+            self.print_chat_notice(f"[ARQUIVO] Envio de '{name}' para {peer_username} falhou: {e}")
+
     def process_join_room(self):
         requisition = {"cmd": "list-rooms"}
         response = self.tracker_connection.send_and_recv_encrypted_request(requisition)
@@ -458,8 +810,11 @@ class Peer:
                 
             room_name = rooms_list[choice - 1]
             
-            requisition = {"cmd": "join-room", "room-to-join": room_name}
-            response = self.tracker_connection.send_and_recv_encrypted_request(requisition)
+            # Entrada na sala e consulta dos membros online seguem juntas em um único lote
+            response, *member_responses = self.tracker_connection.send_batch_request([
+                {"cmd": "join-room", "room-to-join": room_name},
+                {"cmd": "get-room-members", "room-name": room_name}
+            ], stop_on_error=True)
             
             if response.get("status") != "ok":
                 print(f"Erro ao entrar na sala: {response.get('message')}")
@@ -467,47 +822,32 @@ class Peer:
                 return
             
             print(f"Você entrou no registro da sala '{room_name}'. Conectando aos outros membros...")
+            res_members = member_responses[0]
             self.current_room = room_name
+            self.room_topology = res_members.get("topology", ROOM_TOPOLOGY_MESH)
+            with self.room_peers_lock:
+                self.room_sender_keys.clear()
+                self.seen_messages.clear()
+                self.rotate_group_key()
+            self.room_closed = False
             self.in_group_chat = True
 
-            req_members = {"cmd": "get-room-members", "room-name": room_name}
-            res_members = self.tracker_connection.send_and_recv_encrypted_request(req_members)
-
             if res_members.get("status") == "ok":
                 online_members = res_members.get("members", {})
-                
-                for username, details in online_members.items():
-                    try:
-                        print(f"Tentando conectar com {username}...")
-                        peer_pub_key = deserialize_public_key(details["peer-public-key"])
-                        
-                        chat_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        chat_socket.connect((details["user-ip"], details["user-port"]))
-
-                        request_msg = {"type": "group_chat_join", "from_user": self.username, "room_name": self.current_room}
-                        encrypted = encrypt_with_public_key(peer_pub_key, json.dumps(request_msg))
-                        
-                        request_with_public_key = { "public_key": self.tracker_connection.public_key_str, "encrypted": encrypted }
-                        
-                        chat_socket.send(json.dumps(request_with_public_key).encode())
-                        
-                        encrypted_response = chat_socket.recv(4096).decode()
-                        if not encrypted_response:
-                            raise ConnectionError(f"Peer {username} não respondeu.")
-                        
-                        decrypted_response = decrypt_with_private_key(self.tracker_connection.private_key, encrypted_response)
-                        response_data = json.loads(decrypted_response)
-
-                        if response_data.get("type") == "group_join_accept":
-                            with self.room_peers_lock:
-                                self.room_peers_conn[username] = {"conn": chat_socket, "public_key": peer_pub_key}
-                            print(f"Conexão com {username} estabelecida.")
-                            threading.Thread(target=self.receive_group_messages, args=(chat_socket, username), daemon=True).start()
-                        else:
-                            print(f"Falha ao conectar com {username}.")
-                            chat_socket.close()
-                    except Exception as e:
-                        print(f"Erro ao conectar com {username}: {e}")
+                # Daqui em diante a lista é atualizada pelos eventos member-online/member-offline
+                with self.room_peers_lock:
+                    self.room_members_online = dict(online_members)
+                if online_members:
+                    if self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+                        # Overlay: só alguns vizinhos; as mensagens dos demais chegam repassadas
+                        print(f"Sala em modo overlay: conectando a até {OVERLAY_DEGREE} de {len(online_members)} membro(s) online...")
+                        connected, failed = self.connect_to_room_members(online_members, OVERLAY_DEGREE)
+                    else:
+                        print(f"Conectando a {len(online_members)} membro(s) online...")
+                        connected, failed = self.connect_to_room_members(online_members)
+                    print(f"Conectado a {len(connected)} de {len(online_members)} membro(s).")
+                    for username, reason in failed.items():
+                        print(f"Falha ao conectar com {username}: {reason}")
                 
                 self.handle_group_chat()
             else:
@@ -522,53 +862,241 @@ class Peer:
             
         input("Pressione qualquer tecla para retornar...")
 
+    def connect_to_room_members(self, online_members, target=None):
+        """Faz o handshake com os membros online em paralelo, cada um com seu prazo.
+
+        Com target (modo overlay), tenta membros em ordem aleatória até conectar a target deles.
+        Retorna a lista de quem conectou e um dicionário {usuário: motivo} de quem falhou.
+        """
+        connected, failed = [], {}
+        candidates = list(online_members.items())
+        if target is None:
+            target = len(candidates)
+        else:
+            random.shuffle(candidates)
+
+        with ThreadPoolExecutor(max_workers=min(GROUP_JOIN_CONCURRENCY, max(1, target))) as executor:
+            while candidates and len(connected) < target:
+                batch, candidates = candidates[:target - len(connected)], candidates[target - len(connected):]
+                futures = {
+                    executor.submit(self.connect_to_room_member, username, details): username
+                    for username, details in batch
+                }
+                for future in as_completed(futures):
+                    username = futures[future]
+                    try:
+                        future.result()
+                        connected.append(username)
+                    except socket.timeout:
+                        failed[username] = "tempo esgotado"
+                    except Exception as e:
+                        failed[username] = str(e) or type(e).__name__
+        return connected, failed
+
+    def connect_to_room_member(self, username, details):
+        peer_pub_key = deserialize_public_key(details["peer-public-key"])
+        request_msg = {"type": "group_chat_join", "from_user": self.username, "room_name": self.current_room}
+        try:
+            chat_channel, response_data = self.request_peer_channel(username, details["user-ip"], details["user-port"],
+                                                                    peer_pub_key, request_msg, timeout=GROUP_JOIN_TIMEOUT,
+                                                                    envelope=details.get("envelope", 0))
+        except ConnectionResetError:
+            raise ConnectionError("o peer não respondeu")
+        if response_data.get("type") != "group_join_accept":
+            if response_data.get("type") == "group_join_refuse":
+                self.connection_pool.release(username, chat_channel)
+            else:
+                chat_channel.close()
+            raise ConnectionError("o peer recusou a conexão")
+
+        chat_channel.start_writer(self.room_send_queue, self.slow_peer_policy)
+        with self.room_peers_lock:
+            # A chave vai pelo canal antes de qualquer mensagem cifrada com ela
+            chat_channel.send_message(self.group_key_message)
+            self.room_peers_conn[username] = {"channel": chat_channel}
+        threading.Thread(target=self.receive_group_messages, args=(chat_channel, username), daemon=True).start()
+
+    def rotate_group_key(self):
+        """Gera uma nova chave de grupo e a envia a todos os membros conectados.
+
+        Deve ser chamada com room_peers_lock adquirido.
+        """
+        self.group_key = Group_sender_key(self.group_key.key_id + 1 if self.group_key else 1)
+        message_id = new_message_id()
+        self.seen_messages.add(message_id.hex())
+        self.group_key_message = self.group_key.export_message(self.username, message_id, self.tracker_connection.signing_key)
+        self.group_key_stale = False
+        self.forward_to_neighbours(None, lambda channel: channel.send_message(self.group_key_message))
+
     def handle_group_chat(self):
         clear_terminal()
-        print(f"Bem-vindo à sala '{self.current_room}'. Digite '/sair' para sair.")
+        print(f"Bem-vindo à sala '{self.current_room}'. Digite '/sair' para sair, '/status' para ver as filas de envio, "
+              "'/arquivo <caminho>' para enviar um arquivo aos membros ou '/historico' para ver mensagens anteriores.")
+        self.history_cursor = None
         
         try:
-            while self.in_group_chat:
+            while self.in_group_chat and not self.room_closed:
                 message_text = input("Eu: ")
-                if not self.in_group_chat:
+                if not self.in_group_chat or self.room_closed:
                     break
                 if message_text.lower() == '/sair':
                     break
+                if message_text.lower() == '/status':
+                    self.print_room_send_stats()
+                    continue
+                if message_text.lower().startswith('/arquivo'):
+                    self.process_room_file(message_text[len('/arquivo'):].strip())
+                    continue
+                if message_text.lower().startswith('/historico'):
+                    self.process_history_command(message_text[len('/historico'):].split(), HISTORY_ROOM, self.current_room)
+                    continue
 
-                message_to_send = {"type": "group_message", "content": message_text}
-                json_message = json.dumps(message_to_send)
+                message_to_send = {"type": "group_message", "from": self.username, "content": message_text}
+                self.history_manager.record(self.username, HISTORY_ROOM, self.current_room, self.username, message_text)
 
                 with self.room_peers_lock:
-                    for peer_user, peer_info in list(self.room_peers_conn.items()):
+                    if self.group_key_stale:
+                        self.rotate_group_key()
+                    # Cifra uma única vez; o mesmo texto cifrado vai para todos os vizinhos
+                    message_id = new_message_id()
+                    self.seen_messages.add(message_id.hex())
+                    sealed_message = self.group_key.seal(json.dumps(message_to_send), self.username, message_id)
+                    if self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+                        sealed_message = sign_group_message(self.tracker_connection.signing_key, sealed_message)
+                    lost_peers = []
+                    for peer_user, peer_info in self.room_peers_conn.items():
+                        # Só enfileira: a thread de escrita de cada membro faz o envio
                         try:
-                            encrypted_message = encrypt_with_public_key(peer_info["public_key"], json_message)
-                            peer_info["conn"].send(encrypted_message.encode())
+                            peer_info["channel"].send_group_frame(sealed_message)
                         except (BrokenPipeError, ConnectionResetError):
-                            print(f"\n[SALA] A conexão com {peer_user} foi perdida.")
-                            peer_info["conn"].close()
-                            del self.room_peers_conn[peer_user]
-                            print("Eu: ", end="")
+                            lost_peers.append(peer_user)
+                    for peer_user in lost_peers:
+                        print(f"\n[SALA] A conexão com {peer_user} foi perdida.")
+                        self.room_peers_conn.pop(peer_user)["channel"].close()
+                        print("Eu: ", end="")
+                    if lost_peers and self.room_topology == ROOM_TOPOLOGY_MESH:
+                        for peer_user in lost_peers:
+                            self.forget_member(peer_user)
+                        self.rotate_group_key()
         finally:
             self.leave_group_chat()
 
-    def leave_group_chat(self):
-        if not self.in_group_chat:
+    def process_room_file(self, path):
+        # No overlay os vizinhos não são todos os membros e pedaços não são repassados
+        if self.room_topology != ROOM_TOPOLOGY_MESH:
+            print("Envio de arquivos só está disponível em salas em malha completa.")
             return
+        with self.room_peers_lock:
+            destinations = [(peer_user, peer_info["channel"]) for peer_user, peer_info in self.room_peers_conn.items()]
+        if not destinations:
+            print("Nenhum membro conectado.")
+            return
+        self.start_file_transfer(path, destinations)
 
-        self.in_group_chat = False 
+    def process_history_command(self, args, kind, name):
+        """/historico [N] mostra as últimas N mensagens, /historico mais continua para trás e
+        /historico HH:MM HH:MM mostra as mensagens de hoje nesse intervalo."""
+        try:
+            history = self.history_manager.conversation(self.username, kind, name)
+        except ValueError:
+            print("Não há histórico para este nome.")
+            return
+        try:
+            if len(args) == 2:
+                today = datetime.now().replace(second=0, microsecond=0)
+                start, end = (datetime.strptime(arg, "%H:%M").replace(year=today.year, month=today.month, day=today.day)
+                              for arg in args)
+                records = history.between(start.timestamp(), (end + timedelta(minutes=1)).timestamp(), limit=HISTORY_RANGE_LIMIT)
+            elif args and args[0].lower() == "mais":
+                if self.history_cursor is None:
+                    print("Use '/historico' primeiro.")
+                    return
+                records = history.last(HISTORY_PAGE_SIZE, before=self.history_cursor)
+            else:
+                records = history.last(int(args[0]) if args else HISTORY_PAGE_SIZE)
+        except ValueError:
+            print("Uso: /historico [N] | /historico mais | /historico HH:MM HH:MM")
+            return
 
-        notification = {"type": "group_leave"}
-        json_notification = json.dumps(notification)
+        if not records:
+            print("Nenhuma mensagem anterior.")
+            return
+        if len(args) != 2:
+            self.history_cursor = records[0]["seq"]
+        for record in records:
+            timestamp = datetime.fromtimestamp(record["time"]).strftime('%d/%m %H:%M')
+            sender = "Eu" if record["from"] == self.username else record["from"]
+            print(f"[{timestamp}] {sender}: {record['content']}")
+
+    def print_room_send_stats(self):
+        with self.room_peers_lock:
+            if not self.room_peers_conn:
+                print("Nenhum membro conectado.")
+            for peer_user, peer_info in self.room_peers_conn.items():
+                channel = peer_info["channel"]
+                print(f"{peer_user}: na fila {channel.pending()}, enviadas {channel.stats['sent']}, "
+                      f"descartadas {channel.stats['dropped']}, bytes {channel.stats['bytes-sent']}, "
+                      f"economizados pela compressão {channel.bytes_saved()}")
+
+    def process_tracker_event(self, event):
+        """Trata os eventos enviados pelo tracker (roda na thread de eventos da conexão)."""
+        if event.get("event") == "offline-messages":
+            for message in self.receive_offline_messages(event.get("messages", [])):
+                self.print_chat_notice(self.format_offline_message(message))
+            return
+        if not self.in_group_chat or event.get("room") != self.current_room:
+            return
+        user = event.get("user")
+
+        match event.get("event"):
+            case "member-online":
+                with self.room_peers_lock:
+                    self.room_members_online[user] = event.get("details", {})
+                if self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+                    self.repair_overlay()
+
+            case "member-offline":
+                if user == self.username:
+                    # A saída faz uma requisição ao tracker: fica para a thread principal, não para a de eventos
+                    self.room_closed = True
+                    self.print_room_line("[SALA] Você foi removido da sala pelo moderador. Pressione Enter para voltar.")
+                    return
+                with self.room_peers_lock:
+                    self.room_members_online.pop(user, None)
+                    peer_info = self.room_peers_conn.get(user)
+                    if self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+                        # Só o tracker anuncia saídas no overlay: um vizinho não pode tirar a chave de outro membro
+                        self.forget_member(user)
+                if self.room_topology == ROOM_TOPOLOGY_OVERLAY:
+                    self.print_room_line(f"[SALA] {user} saiu do chat.")
+                # Quem caiu sem avisar não vai mandar group_leave: encerra a conexão na hora
+                if peer_info is not None and event.get("reason") == "disconnected":
+                    peer_info["channel"].shutdown()
+
+            case "room-closed":
+                self.room_closed = True
+                self.print_room_line("[SALA] A sala foi encerrada. Pressione Enter para voltar.")
+
+    def leave_group_chat(self):
+        with self.room_peers_lock:
+            if not self.in_group_chat:
+                return
+            self.in_group_chat = False 
+
+        notification = {"type": "group_leave", "msg-id": new_message_id().hex()}
         
         with self.room_peers_lock:
+            # As conexões são devolvidas ao pool quando cada peer confirmar a saída
             for peer_info in self.room_peers_conn.values():
                 try:
-                    encrypted = encrypt_with_public_key(peer_info["public_key"], json_notification)
-                    peer_info["conn"].send(encrypted.encode())
+                    peer_info["channel"].send_message(notification)
                 except (BrokenPipeError, ConnectionResetError):
-                    pass
-                finally:
-                    peer_info["conn"].close()
+                    peer_info["channel"].close()
             self.room_peers_conn.clear()
+            self.room_members_online = {}
+            self.room_sender_keys.clear()
+            self.group_key = None
+            self.group_key_message = None
 
         if self.current_room:
             requisition = {"cmd": "leave-room", "room-name": self.current_room}
@@ -605,29 +1133,24 @@ class Peer:
                 return
 
         user = chosen_request['user']
-        conn = chosen_request['conn']
-        requester_public_key = chosen_request['public_key']
+        channel = chosen_request['channel']
         
         action = input(f"Deseja iniciar chat privado com {user}?[s/n]: ").strip().lower()
 
         try:
             match action:
+                case "s" if not self.verify_requester(user, channel):
+                    print(f"O pedido não veio de {user}: a chave da conexão não é a informada pelo tracker.")
+                    channel.send_message({"type": "refuse"})
+                    channel.close()
                 case "s":
-                    response_msg = {"type": "accept"}
-                    encrypted_response = encrypt_with_public_key(
-                        requester_public_key, json.dumps(response_msg)
-                    )
-                    conn.send(encrypted_response.encode())
+                    channel.send_message({"type": "accept"})
                     print(f"Pedido de {user} aceito. Iniciando chat...")
                     time.sleep(1)
-                    self.handle_peer_chat(conn, requester_public_key, user)
+                    self.handle_peer_chat(channel, user)
                 case "n":
-                    response_msg = {"type": "refuse"} 
-                    encrypted_response = encrypt_with_public_key(
-                        requester_public_key, json.dumps(response_msg)
-                    )
-                    conn.send(encrypted_response.encode())
-                    conn.close()
+                    channel.send_message({"type": "refuse"})
+                    self.connection_pool.release(user, channel)
                     print(f"Pedido de {user} recusado.")
                 case _:
                     print("Ação inválida. O pedido será mantido como pendente.")
@@ -636,22 +1159,22 @@ class Peer:
         
         except (socket.error, BrokenPipeError):
             print(f"O usuário {user} cancelou o pedido ou desconectou.")
-            conn.close()
+            channel.close()
+
+    def verify_requester(self, user, channel):
+        """Confere com o tracker que quem pediu o chat tem a chave pública de user."""
+        response = self.tracker_connection.send_and_recv_encrypted_request({"cmd": "get-peer-addr", "user-to-connect": user})
+        return response.get("status") == "ok" and same_public_key(channel, response.get("peer-public-key"))
 
     def clean_pending_requests(self, reject=False):
         with self.pending_requests_lock:
             for request in self.pending_chat_requests:
                 if reject:
                     try:
-                        response = {"type": "refuse"}
-                        requester_public_key = request['public_key']
-                        encrypted_response = encrypt_with_public_key(
-                            requester_public_key, json.dumps(response)
-                        )
-                        request['conn'].send(encrypted_response.encode())
+                        request['channel'].send_message({"type": "refuse"})
                     except socket.error:
                         pass
-                request['conn'].close()
+                request['channel'].close()
             self.pending_chat_requests.clear()
     
     def process_create_room(self): 
@@ -662,10 +1185,13 @@ class Peer:
         if not room_name:
             print("Nome da sala não pode ser vazio!")
             return
+
+        overlay = input("Sala grande? Membros se conectam só a alguns vizinhos (overlay) [s/n]: ").strip().lower()
         
         requisition = {
             "cmd": "create-room",
             "room-name": room_name,
+            "topology": ROOM_TOPOLOGY_OVERLAY if overlay == "s" else ROOM_TOPOLOGY_MESH
         }
         
         try:
@@ -683,12 +1209,15 @@ class Peer:
     def process_logout(self):
         print("Deslogando...")
         requisition = {"cmd":"logout"}
+        self.tracker_connection.stop_heartbeat()
         self.tracker_connection.send_and_recv_encrypted_request(requisition)
 
         if self.in_group_chat:
             self.leave_group_chat()
         
         self.clean_pending_requests(reject=True)
+        self.connection_pool.close_all()
+        self.history_manager.close_all()
         self.username = None
         print("Você foi deslogado.")
         time.sleep(1.5)
@@ -702,6 +1231,7 @@ class Peer:
             self.leave_group_chat()
 
         self.clean_pending_requests(reject=True)
+        self.connection_pool.close_all()
         self.peer_server_socket.close()
         self.tracker_connection.peer_socket.close()
         print("[INFO] Peer encerrado, Até logo!")
@@ -1,5 +1,5 @@
-import threading
 from utils.terminal_utils import clear_terminal
+from utils.envelope_utils import ENVELOPE_VERSION
 
 class Auth_manager():
 
@@ -18,6 +18,9 @@ class Auth_manager():
                 "usr": user, 
                 "password": input_password,
                 "peer-listen-port": self.peer_atributes.peer_listen_port,
+                "envelope": ENVELOPE_VERSION, # Formato que este peer aceita em conexões diretas
+                "mailbox-key": self.peer_atributes.offline_message_manager.load_mailbox_key(user),
+                "signing-key": self.tracker_connection.verify_key_str, # Verifica o que este peer assina em salas overlay
             }
 
             response = self.tracker_connection.send_and_recv_encrypted_request(requisition)
@@ -25,7 +28,8 @@ class Auth_manager():
             if response.get("status") == "ok":
                 print(response.get("message"))
                 self.peer_atributes.username = user
-                threading.Thread(target=self.tracker_connection.send_heartbeat, daemon=True).start()
+                self.tracker_connection.start_heartbeat(response.get("heartbeat"))
+                self.peer_atributes.show_offline_messages(response.get("offline-messages", []))
                 self.peer_atributes.process_chat_functions()
                 return
             else:
@@ -55,7 +59,8 @@ class Auth_manager():
                     input("Pressione qualquer tecla para ir para a tela de login...")
                     break
                 else:
-                    input("O nome de usuário em uso, tente novamente com outro nome.\nPressione qualquer tecla para continuar...")
+                    # Nome em uso, servidor ocupado ou tempo esgotado: o tracker (ou o cliente) diz qual
+                    input(f"{response.get('message')}\nPressione qualquer tecla para continuar...")
 
             else:
                 print("Usuario ou senha invalidos, tente novamente")
@@ -0,0 +1,357 @@
+import base64, hashlib, os, re, struct, threading, time
+from nacl.exceptions import CryptoError
+from utils.encrypt_utils import File_chunk_cipher
+from peer_managers.history_manager import safe_name
+
+FILE_CHUNK_SIZE = 256 * 1024
+FILE_WINDOW = 8           # Pedaços enviados e ainda não confirmados
+FILE_ACK_TIMEOUT = 30
+DOWNLOADS_DIR = "downloads"
+# Ofertas são aceitas sem perguntar, então o que o outro peer declara é limitado aqui
+FILE_MAX_SIZE = 2 * 1024 * 1024 * 1024
+FILE_MAX_CHUNK_SIZE = 4 * 1024 * 1024
+FILE_MAX_PENDING_BYTES = 4 * 1024 * 1024 * 1024 # Soma dos recebimentos em andamento e dos .part guardados
+FILE_MAX_OFFERS_PER_PEER = 4                    # Recebimentos simultâneos de um mesmo peer
+FILE_PART_MAX_AGE = 24 * 60 * 60                # .part sem atividade há mais tempo que isso é apagado
+TRANSFER_ID_SIZE = 8
+
+# Cabeçalho em claro de cada pedaço: id da transferência e offset no arquivo
+FILE_CHUNK_HEADER = struct.Struct(f">{TRANSFER_ID_SIZE}sQ")
+
+FILE_MESSAGE_TYPES = ("file_offer", "file_accept", "file_refuse", "file_chunk", "file_ack",
+                      "file_done", "file_complete", "file_error")
+
+class Transfer_error(Exception):
+    pass
+
+def safe_file_name(name):
+    # Nome legível para salvar o arquivo; colisões são resolvidas por available_path
+    name = re.sub(r"[^\w.-]", "_", name)
+    return "arquivo" if name in ("", ".", "..") else name
+
+def format_throughput(size, elapsed):
+    megabytes = size / (1024 * 1024)
+    return f"{megabytes:.1f} MB em {elapsed:.1f} s ({megabytes / max(elapsed, 1e-6):.1f} MB/s)"
+
+class File_transfer_manager:
+    """Envio e recebimento de arquivos pelos canais com outros peers (chat privado ou sala).
+
+    O arquivo é lido e escrito em pedaços com buffers reaproveitados, então a memória usada
+    não depende do tamanho dele. O remetente mantém no máximo FILE_WINDOW pedaços sem
+    confirmação. Quem recebe guarda o que já chegou em um arquivo .part e, se a mesma oferta
+    for feita de novo, responde com o offset de onde continuar. O .part é apagado quando a
+    transferência falha e, se a conexão cair, fica até FILE_PART_MAX_AGE esperando a retomada.
+    """
+
+    def __init__(self, notify=print, chunk_size=FILE_CHUNK_SIZE, window=FILE_WINDOW, downloads_dir=DOWNLOADS_DIR,
+                 max_size=FILE_MAX_SIZE, max_pending_bytes=FILE_MAX_PENDING_BYTES, max_offers_per_peer=FILE_MAX_OFFERS_PER_PEER):
+        self.notify = notify
+        self.chunk_size = chunk_size
+        self.window = window
+        self.downloads_dir = downloads_dir
+        self.max_size = max_size
+        self.max_pending_bytes = max_pending_bytes
+        self.max_offers_per_peer = max_offers_per_peer
+        self.changed = threading.Condition()
+        self.outgoing = {} # id da transferência -> estado do envio
+        self.incoming = {} # id da transferência -> estado do recebimento
+        self.expire_parts()
+
+    # Envio
+
+    def send_file(self, channel, peer_username, path):
+        """Envia o arquivo e retorna (bytes enviados, segundos); roda na thread de quem chamou."""
+        size = os.path.getsize(path)
+        name = os.path.basename(path)
+        transfer_id = os.urandom(TRANSFER_ID_SIZE)
+        cipher = File_chunk_cipher()
+        transfer = {"peer": peer_username, "accepted": None, "acked": 0, "complete": None, "error": None}
+        with self.changed:
+            self.outgoing[transfer_id] = transfer
+
+        try:
+            channel.send_message({"type": "file_offer", "transfer-id": transfer_id.hex(), "name": name, "size": size,
+                                  "chunk-size": self.chunk_size, "key": base64.b64encode(cipher.key).decode()})
+            offset = self.wait_for(transfer, lambda: transfer["accepted"] is not None)
+            if offset:
+                self.notify(f"[ARQUIVO] {peer_username} já tem {offset} bytes de '{name}', retomando.")
+
+            start = time.monotonic()
+            hasher = hashlib.sha256()
+            buffer = bytearray(self.chunk_size)
+            view = memoryview(buffer)
+            with open(path, "rb") as file:
+                # O hash cobre o arquivo inteiro: o trecho já entregue é relido, mas não reenviado
+                while file.tell() < offset:
+                    read = file.readinto(view[:min(self.chunk_size, offset - file.tell())])
+                    if not read:
+                        raise Transfer_error("arquivo encolheu durante a transferência")
+                    hasher.update(view[:read])
+
+                sent = offset
+                while sent < size:
+                    self.wait_for(transfer, lambda: sent - transfer["acked"] < self.window * self.chunk_size)
+                    read = file.readinto(buffer)
+                    if not read:
+                        raise Transfer_error("arquivo encolheu durante a transferência")
+                    chunk = bytes(view[:read])
+                    hasher.update(chunk)
+                    if not channel.send_file_chunk(FILE_CHUNK_HEADER.pack(transfer_id, sent) + cipher.seal(transfer_id, sent, chunk)):
+                        raise Transfer_error("fila de envio cheia")
+                    sent += read
+
+            channel.send_message({"type": "file_done", "transfer-id": transfer_id.hex(), "sha256": hasher.hexdigest()})
+            self.wait_for(transfer, lambda: transfer["complete"] is not None)
+            return size - offset, time.monotonic() - start
+        finally:
+            with self.changed:
+                self.outgoing.pop(transfer_id, None)
+
+    def wait_for(self, transfer, condition):
+        with self.changed:
+            if not self.changed.wait_for(lambda: transfer["error"] is not None or condition(), timeout=FILE_ACK_TIMEOUT):
+                raise Transfer_error("o outro peer não respondeu a tempo")
+            if transfer["error"] is not None:
+                raise Transfer_error(transfer["error"])
+            return transfer["accepted"]
+
+    def update_outgoing(self, data, **changes):
+        with self.changed:
+            transfer = self.outgoing.get(self.read_transfer_id(data))
+            if transfer is not None:
+                transfer.update(changes)
+                self.changed.notify_all()
+
+    # Recebimento
+
+    def handle_message(self, channel, peer_username, data):
+        """Trata uma mensagem da família file_*; chamada pela thread que lê o canal."""
+        try:
+            match data.get("type"):
+                case "file_offer":
+                    self.process_offer(channel, peer_username, data)
+                case "file_chunk":
+                    self.process_chunk(channel, data["chunk"])
+                case "file_done":
+                    self.process_done(channel, data)
+                case "file_accept":
+                    self.update_outgoing(data, accepted=int(data["offset"]), acked=int(data["offset"]))
+                case "file_ack":
+                    self.update_outgoing(data, acked=int(data["offset"]))
+                case "file_complete":
+                    if data.get("ok"):
+                        self.update_outgoing(data, complete=True)
+                    else:
+                        self.update_outgoing(data, error=data.get("message", "arquivo corrompido"))
+                case "file_refuse" | "file_error":
+                    self.update_outgoing(data, error=data.get("message", "transferência recusada"))
+        except (KeyError, ValueError, OSError) as e:
+            self.notify(f"[ARQUIVO] Falha na transferência com {peer_username}: {e}")
+
+    def process_offer(self, channel, peer_username, data):
+        transfer_id = self.read_transfer_id(data)
+        offered_name = os.path.basename(str(data["name"]))
+        name = safe_file_name(offered_name)
+        size = int(data["size"])
+        chunk_size = int(data["chunk-size"])
+        if size < 0:
+            return self.refuse_offer(channel, transfer_id, peer_username, name, "tamanho inválido")
+        if size > self.max_size:
+            return self.refuse_offer(channel, transfer_id, peer_username, name,
+                                     f"tamanho acima do limite de {self.max_size // (1024 * 1024)} MB")
+        if not 0 < chunk_size <= FILE_MAX_CHUNK_SIZE:
+            return self.refuse_offer(channel, transfer_id, peer_username, name, "tamanho de pedaço inválido")
+
+        os.makedirs(self.downloads_dir, exist_ok=True)
+        # A mesma oferta (remetente, nome e tamanho) reaproveita o que já chegou antes; o nome
+        # oferecido entra codificado por safe_name, para que "a b" e "a_b" não dividam o .part
+        part_name = safe_name(offered_name) if offered_name not in ("", ".", "..") else name
+        try:
+            part_path = os.path.join(self.downloads_dir, f".{safe_name(peer_username)}.{part_name}.{size}.part")
+        except ValueError:
+            part_path = None
+        if part_path is None or not self.inside_downloads(part_path) or not self.inside_downloads(os.path.join(self.downloads_dir, name)):
+            return self.refuse_offer(channel, transfer_id, peer_username, name, "nome de arquivo inválido")
+
+        self.expire_parts()
+        with self.changed:
+            self.drop_stalled(peer_username)
+            active = [transfer for transfer in self.incoming.values() if transfer["peer"] == peer_username]
+            if any(transfer["part-path"] == part_path for transfer in active):
+                reason = "o mesmo arquivo já está sendo recebido"
+            elif len(active) >= self.max_offers_per_peer:
+                reason = f"limite de {self.max_offers_per_peer} recebimentos simultâneos"
+            elif self.pending_bytes(exclude=part_path) + size > self.max_pending_bytes:
+                reason = "espaço reservado para recebimentos esgotado"
+            else:
+                reason = None
+                # Reserva o tamanho já aqui, para que ofertas simultâneas não passem juntas do limite
+                self.incoming[transfer_id] = {"peer": peer_username, "size": size, "part-path": part_path,
+                                              "file": None, "last-activity": time.monotonic()}
+        if reason is not None:
+            return self.refuse_offer(channel, transfer_id, peer_username, name, reason)
+
+        try:
+            transfer = self.open_part(transfer_id, peer_username, name, size, chunk_size, part_path, data)
+        except Exception:
+            with self.changed:
+                self.incoming.pop(transfer_id, None)
+            raise
+        offset = transfer["offset"]
+        self.notify(f"[ARQUIVO] Recebendo '{name}' de {peer_username} ({size / (1024 * 1024):.1f} MB)"
+                    + (f", retomando de {offset} bytes." if offset else "."))
+        channel.send_message({"type": "file_accept", "transfer-id": transfer_id.hex(), "offset": offset})
+
+    def open_part(self, transfer_id, peer_username, name, size, chunk_size, part_path, data):
+        offset = 0
+        if os.path.exists(part_path):
+            offset = min(os.path.getsize(part_path), size)
+            offset -= offset % chunk_size # Um pedaço escrito pela metade é recebido de novo
+        file = open(part_path, "r+b" if os.path.exists(part_path) else "w+b")
+        file.truncate(offset)
+
+        hasher = hashlib.sha256()
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        file.seek(0)
+        while file.tell() < offset:
+            read = file.readinto(buffer)
+            hasher.update(view[:read])
+
+        transfer = {
+            "peer": peer_username, "name": name, "size": size, "offset": offset, "start-offset": offset,
+            "file": file, "part-path": part_path, "hasher": hasher, "start": time.monotonic(),
+            "last-activity": time.monotonic(), "cipher": File_chunk_cipher(base64.b64decode(data["key"]))
+        }
+        with self.changed:
+            self.incoming[transfer_id] = transfer
+        return transfer
+
+    def refuse_offer(self, channel, transfer_id, peer_username, name, reason):
+        channel.send_message({"type": "file_refuse", "transfer-id": transfer_id.hex(), "message": reason})
+        self.notify(f"[ARQUIVO] Oferta de '{name}' de {peer_username} recusada: {reason}")
+
+    def pending_bytes(self, exclude=None):
+        """Tamanho declarado dos recebimentos em andamento mais o dos .part guardados; chamado com self.changed."""
+        active_parts = {transfer["part-path"] for transfer in self.incoming.values()}
+        total = sum(transfer["size"] for transfer in self.incoming.values())
+        for path in self.part_files():
+            if path not in active_parts and path != exclude:
+                try:
+                    total += os.path.getsize(path)
+                except OSError:
+                    pass
+        return total
+
+    def drop_stalled(self, peer_username):
+        """Libera recebimentos do peer parados há mais de FILE_ACK_TIMEOUT (remetente que desistiu); chamado com self.changed."""
+        now = time.monotonic()
+        for transfer_id, transfer in list(self.incoming.items()):
+            if transfer["peer"] == peer_username and transfer["file"] is not None \
+                    and now - transfer["last-activity"] > FILE_ACK_TIMEOUT:
+                del self.incoming[transfer_id]
+                transfer["file"].close() # O .part fica para a retomada, até expirar
+
+    def part_files(self):
+        try:
+            names = os.listdir(self.downloads_dir)
+        except OSError:
+            return []
+        return [os.path.join(self.downloads_dir, name) for name in names if name.startswith(".") and name.endswith(".part")]
+
+    def expire_parts(self):
+        """Apaga os .part sem atividade há mais de FILE_PART_MAX_AGE (transferências abandonadas)."""
+        with self.changed:
+            active_parts = {transfer["part-path"] for transfer in self.incoming.values()}
+        limit = time.time() - FILE_PART_MAX_AGE
+        for path in self.part_files():
+            try:
+                if path not in active_parts and os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def inside_downloads(self, path):
+        downloads_dir = os.path.realpath(self.downloads_dir)
+        return os.path.commonpath([downloads_dir, os.path.realpath(path)]) == downloads_dir
+
+    def process_chunk(self, channel, sealed_chunk):
+        transfer_id, offset = FILE_CHUNK_HEADER.unpack_from(sealed_chunk)
+        transfer = self.incoming.get(transfer_id)
+        if transfer is None or transfer["file"] is None:
+            return # Transferência já cancelada (ou ainda abrindo); pedaços em trânsito são ignorados
+        if offset != transfer["offset"]:
+            return self.abort_incoming(channel, transfer_id, f"pedaço fora de ordem no offset {offset}")
+        try:
+            chunk = transfer["cipher"].open(transfer_id, offset, sealed_chunk[FILE_CHUNK_HEADER.size:])
+        except CryptoError:
+            return self.abort_incoming(channel, transfer_id, "pedaço com autenticação inválida")
+        if offset + len(chunk) > transfer["size"]:
+            return self.abort_incoming(channel, transfer_id, "pedaço além do tamanho oferecido")
+
+        transfer["file"].write(chunk)
+        transfer["hasher"].update(chunk)
+        transfer["offset"] += len(chunk)
+        transfer["last-activity"] = time.monotonic()
+        channel.send_message({"type": "file_ack", "transfer-id": transfer_id.hex(), "offset": transfer["offset"]})
+
+    def process_done(self, channel, data):
+        transfer_id = self.read_transfer_id(data)
+        with self.changed:
+            transfer = self.incoming.get(transfer_id)
+            if transfer is None or transfer["file"] is None:
+                return
+            del self.incoming[transfer_id]
+        transfer["file"].close()
+
+        if transfer["offset"] != transfer["size"] or transfer["hasher"].hexdigest() != data.get("sha256"):
+            os.remove(transfer["part-path"])
+            channel.send_message({"type": "file_complete", "transfer-id": transfer_id.hex(), "ok": False,
+                                  "message": "conteúdo diferente do enviado"})
+            self.notify(f"[ARQUIVO] '{transfer['name']}' de {transfer['peer']} chegou corrompido e foi descartado.")
+            return
+
+        final_path = self.available_path(transfer["name"])
+        os.replace(transfer["part-path"], final_path)
+        channel.send_message({"type": "file_complete", "transfer-id": transfer_id.hex(), "ok": True})
+        received = transfer["size"] - transfer["start-offset"]
+        self.notify(f"[ARQUIVO] '{transfer['name']}' recebido de {transfer['peer']} em {final_path}: "
+                    f"{format_throughput(received, time.monotonic() - transfer['start'])}")
+
+    def abort_incoming(self, channel, transfer_id, reason):
+        with self.changed:
+            transfer = self.incoming.pop(transfer_id, None)
+        if transfer is None:
+            return
+        transfer["file"].close()
+        # Conteúdo inválido não serve para retomar: o .part vai embora com a transferência
+        try:
+            os.remove(transfer["part-path"])
+        except OSError:
+            pass
+        channel.send_message({"type": "file_error", "transfer-id": transfer_id.hex(), "message": reason})
+        self.notify(f"[ARQUIVO] Transferência de '{transfer['name']}' com {transfer['peer']} interrompida: {reason}")
+
+    def connection_lost(self, peer_username):
+        """Interrompe as transferências com um peer cuja conexão caiu, mantendo os .part até expirarem."""
+        with self.changed:
+            for transfer_id, transfer in list(self.incoming.items()):
+                if transfer["peer"] == peer_username and transfer["file"] is not None:
+                    del self.incoming[transfer_id]
+                    transfer["file"].close()
+            for transfer in self.outgoing.values():
+                if transfer["peer"] == peer_username and transfer["error"] is None:
+                    transfer["error"] = "conexão encerrada"
+            self.changed.notify_all()
+
+    def available_path(self, name):
+        base, extension = os.path.splitext(name)
+        path = os.path.join(self.downloads_dir, name)
+        copy = 1
+        while os.path.exists(path):
+            path = os.path.join(self.downloads_dir, f"{base} ({copy}){extension}")
+            copy += 1
+        return path
+
+    def read_transfer_id(self, data):
+        return bytes.fromhex(data["transfer-id"])
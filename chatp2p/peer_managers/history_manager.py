@@ -0,0 +1,57 @@
+import os, re, threading
+from utils.history_utils import History_log, HISTORY_SEGMENT_SIZE, HISTORY_MAX_SEGMENTS
+
+HISTORY_DIR = "history"
+
+# Tipos de conversa: chat privado com um contato ou sala
+HISTORY_CONTACT = "contato"
+HISTORY_ROOM = "sala"
+
+# Fora destes, todo caractere (inclusive "." e "%") vira %XX dos bytes em UTF-8
+UNSAFE_NAME_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+def safe_name(name):
+    """Nome de usuário ou de sala como nome de diretório, sem que dois nomes caiam no mesmo.
+
+    Nomes só com letras ASCII, dígitos, "_" e "-" ficam iguais; "", "." e ".." levantam ValueError.
+    """
+    if name in ("", ".", ".."):
+        raise ValueError(f"Nome inválido: {name!r}")
+    return UNSAFE_NAME_CHARS.sub(lambda match: "".join(f"%{byte:02X}" for byte in match.group().encode('utf-8')), name)
+
+class History_manager:
+    """Histórico local das conversas do usuário logado: um History_log por contato e por sala.
+
+    Os logs ficam abertos depois do primeiro uso, então gravar uma mensagem recebida
+    custa só as duas escritas do append.
+    """
+
+    def __init__(self, base_dir=HISTORY_DIR, segment_size=HISTORY_SEGMENT_SIZE, max_segments=HISTORY_MAX_SEGMENTS):
+        self.base_dir = base_dir
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.logs = {} # (dono, tipo, nome) -> History_log
+
+    def conversation(self, owner, kind, name):
+        key = (owner, kind, name)
+        with self.lock:
+            log = self.logs.get(key)
+            if log is None:
+                directory = os.path.join(self.base_dir, safe_name(owner), kind, safe_name(name))
+                log = self.logs[key] = History_log(directory, self.segment_size, self.max_segments)
+            return log
+
+    def record(self, owner, kind, name, sender, content):
+        if owner is None:
+            return None
+        try:
+            return self.conversation(owner, kind, name).append({"from": sender, "content": content})
+        except (OSError, ValueError):
+            return None # Falha no disco (ou nome sem diretório possível) não interrompe o chat
+
+    def close_all(self):
+        with self.lock:
+            logs, self.logs = self.logs, {}
+        for log in logs.values():
+            log.close()
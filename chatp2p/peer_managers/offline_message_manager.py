@@ -0,0 +1,72 @@
+import json, os, threading, time
+from nacl.public import PrivateKey
+from nacl.exceptions import CryptoError
+from utils.encrypt_utils import serialize_public_key, deserialize_public_key, encrypt_with_public_key, decrypt_with_private_key
+
+MAILBOX_KEYS_DIR = "keys"
+
+class Offline_message_manager:
+    """Mensagens para usuários offline, guardadas pelo tracker até o destinatário entrar.
+
+    Cada usuário tem um par de chaves de caixa postal salvo localmente, que sobrevive entre
+    execuções (as chaves das conexões são novas a cada vez); a pública vai no login. Quem
+    envia cifra a mensagem para essa chave, então o tracker guarda só o texto cifrado.
+    """
+
+    def __init__(self, tracker_connection, keys_dir=MAILBOX_KEYS_DIR):
+        self.tracker_connection = tracker_connection
+        self.keys_dir = keys_dir
+        self.private_key = None
+        self.username = None
+        self.last_id = 0 # Id da última mensagem confirmada; reentregas são ignoradas
+        self.lock = threading.Lock()
+
+    def load_mailbox_key(self, username):
+        """Carrega (ou cria na primeira vez) a chave de caixa postal do usuário e retorna a pública serializada."""
+        os.makedirs(self.keys_dir, exist_ok=True)
+        path = os.path.join(self.keys_dir, username.encode("utf-8").hex() + ".key")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                private_key = PrivateKey(f.read())
+        else:
+            private_key = PrivateKey.generate()
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(bytes(private_key))
+        with self.lock:
+            self.private_key = private_key
+            self.username = username
+            self.last_id = 0
+        return serialize_public_key(private_key.public_key)
+
+    def send(self, sender, recipient, content):
+        response = self.tracker_connection.send_and_recv_encrypted_request({"cmd": "get-mailbox-key", "user": recipient})
+        if response.get("status") != "ok":
+            return response
+        message = {"from": sender, "to": recipient, "content": content, "time": time.time()}
+        sealed_message = encrypt_with_public_key(deserialize_public_key(response["mailbox-key"]), json.dumps(message))
+        return self.tracker_connection.send_and_recv_encrypted_request({"cmd": "send-offline", "to": recipient, "sealed": sealed_message})
+
+    def receive(self, queued_messages):
+        """Decifra as mensagens entregues pelo tracker, confirma o recebimento e retorna as novas."""
+        received = []
+        with self.lock:
+            new_messages = [queued for queued in queued_messages if queued["id"] > self.last_id]
+            if not new_messages:
+                return received
+            for queued in new_messages:
+                try:
+                    message = json.loads(decrypt_with_private_key(self.private_key, queued["sealed"]))
+                except (CryptoError, ValueError):
+                    continue # Cifrada para outra chave (ex.: de antes de apagar a pasta keys)
+                # O remetente dentro da mensagem precisa ser o que o tracker autenticou
+                if message.get("from") != queued["from"] or message.get("to") != self.username:
+                    continue
+                received.append(message)
+            self.last_id = new_messages[-1]["id"]
+            last_id = self.last_id
+
+        # Os ids confirmam só o que chegou; last-id fica para trackers que não os conhecem
+        ids = [queued["id"] for queued in new_messages]
+        self.tracker_connection.send_and_recv_encrypted_request({"cmd": "ack-offline", "last-id": last_id, "ids": ids})
+        return received
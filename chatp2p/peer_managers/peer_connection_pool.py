@@ -0,0 +1,185 @@
+import json, selectors, socket, threading, time
+from collections import OrderedDict
+
+POOL_MAX_SIZE = 32
+POOL_IDLE_TIMEOUT = 300
+POOL_PING_INTERVAL = 60
+
+POOL_READ_TIMEOUT = 5 # Segundos para terminar de ler um frame que começou a chegar numa conexão ociosa
+
+# Mensagens que iniciam uma conversa; o resto que chega numa conexão ociosa é descartado
+REQUEST_TYPES = ("chat_request", "group_chat_join")
+# Respostas possíveis a cada pedido; numa conexão reaproveitada pode haver ping ou ack atrasado antes delas
+RESPONSE_TYPES = {
+    "chat_request": ("busy", "accept", "refuse"),
+    "group_chat_join": ("group_join_accept", "group_join_refuse")
+}
+
+def recv_response(channel, request_msg, timeout):
+    """Lê do canal a resposta ao pedido, descartando o que chegar antes dela; None se a conexão fechou."""
+    expected = RESPONSE_TYPES.get(request_msg.get("type"), ())
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("Tempo esgotado esperando a resposta do peer")
+        channel.settimeout(remaining)
+        message = channel.recv_message()
+        if message is None or message.get("type") in expected:
+            return message
+
+def pool_key(username, peer_public_key):
+    return username, (bytes(peer_public_key) if peer_public_key is not None else None)
+
+class Peer_connection_pool:
+    """Conexões ociosas com outros peers, reaproveitadas em chats privados e salas.
+
+    Cada conexão fica guardada pelo usuário e pela chave pública do handshake: o nome de quem
+    abriu a conexão é só o que ele declarou, então o reuso exige a chave que o tracker informou.
+
+    Uma única thread vigia os sockets ociosos: repassa a on_request os pedidos que chegam
+    por eles, descarta as conexões encerradas pelo outro lado, fecha as que passaram de
+    idle_timeout e envia ping às demais para detectar conexões mortas.
+    """
+
+    def __init__(self, on_request, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT, ping_interval=POOL_PING_INTERVAL):
+        self.on_request = on_request
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.idle = OrderedDict() # (username, chave pública) -> {"channel", "idle-since", "last-ping"}, do menos para o mais recente
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ, None)
+        self.stats = {"reused": 0, "released": 0, "evicted": 0, "expired": 0, "dead": 0}
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def acquire(self, username, peer_public_key):
+        """Retira do pool a conexão ociosa com o usuário e a chave pública dadas, se houver uma ainda aberta."""
+        with self.lock:
+            entry = self.pop_idle(pool_key(username, peer_public_key))
+            if entry is None:
+                return None
+            if entry["channel"].closed:
+                self.stats["dead"] += 1
+                return None
+            self.stats["reused"] += 1
+            return entry["channel"]
+
+    def release(self, username, channel):
+        """Devolve ao pool uma conexão que terminou um chat ou uma sala sem erro."""
+        if channel.closed:
+            return
+        key = pool_key(username, channel.peer_public_key)
+        now = time.monotonic()
+        with self.lock:
+            self.drop_closed()
+            previous = self.pop_idle(key)
+            if previous is not None and previous["channel"] is not channel:
+                previous["channel"].close()
+            self.idle[key] = {"channel": channel, "idle-since": now, "last-ping": now}
+            self.selector.register(channel.sock, selectors.EVENT_READ, key)
+            self.stats["released"] += 1
+            self.evict_over_limit()
+        self.wakeup()
+
+    def evict_over_limit(self):
+        while len(self.idle) > self.max_size:
+            _, evicted = self.idle.popitem(last=False)
+            self.unregister(evicted["channel"])
+            evicted["channel"].close()
+            self.stats["evicted"] += 1
+
+    def close_all(self):
+        with self.lock:
+            for key in list(self.idle):
+                self.pop_idle(key)["channel"].close()
+
+    def drop_closed(self):
+        # Canais fechados por fora (ex.: falha na thread de escrita) não podem continuar no selector
+        for key in [k for k, entry in self.idle.items() if entry["channel"].closed]:
+            self.pop_idle(key)
+            self.stats["dead"] += 1
+
+    def pop_idle(self, key):
+        entry = self.idle.pop(key, None)
+        if entry is not None:
+            self.unregister(entry["channel"])
+        return entry
+
+    def unregister(self, channel):
+        try:
+            self.selector.unregister(channel.sock)
+        except (KeyError, ValueError):
+            pass
+
+    def wakeup(self):
+        try:
+            self.wakeup_send.send(b"\0")
+        except OSError:
+            pass
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select(timeout=1):
+                if key.data is None:
+                    self.wakeup_recv.recv(4096)
+                else:
+                    self.handle_readable(key.data)
+            self.check_idle()
+
+    def handle_readable(self, key):
+        # A conexão sai do pool durante a leitura, feita em outra thread: nem o lock nem o
+        # selector ficam presos a um peer lento, e um acquire concorrente abre outra conexão
+        # em vez de disputar o mesmo socket
+        with self.lock:
+            entry = self.pop_idle(key)
+        if entry is not None:
+            threading.Thread(target=self.read_idle, args=(key, entry), daemon=True).start()
+
+    def read_idle(self, key, entry):
+        channel = entry["channel"]
+        try:
+            # Com timeout: um peer que mande meio frame não prende esta thread para sempre
+            channel.settimeout(POOL_READ_TIMEOUT)
+            message = channel.recv_message()
+            channel.settimeout(None)
+        except (json.JSONDecodeError, ValueError, OSError):
+            message = None
+
+        if message is None:
+            channel.close()
+            with self.lock:
+                self.stats["dead"] += 1
+            return
+        if message.get("type") in REQUEST_TYPES:
+            self.on_request(channel, message)
+            return
+
+        # ping, confirmações atrasadas de /sair etc.: a conexão volta ociosa como estava
+        with self.lock:
+            if key in self.idle or channel.closed:
+                channel.close() # Outra conexão com o mesmo usuário foi devolvida enquanto esta era lida
+                return
+            self.idle[key] = entry
+            self.selector.register(channel.sock, selectors.EVENT_READ, key)
+            self.evict_over_limit()
+
+    def check_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            self.drop_closed()
+            for key, entry in list(self.idle.items()):
+                if now - entry["idle-since"] > self.idle_timeout:
+                    self.pop_idle(key)["channel"].close()
+                    self.stats["expired"] += 1
+                elif now - entry["last-ping"] > self.ping_interval:
+                    entry["last-ping"] = now
+                    try:
+                        entry["channel"].send_message({"type": "ping"})
+                    except OSError:
+                        self.pop_idle(key)["channel"].close()
+                        self.stats["dead"] += 1
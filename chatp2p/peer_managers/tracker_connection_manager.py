@@ -1,13 +1,27 @@
-import socket, json, sys, threading, time, os
+import socket, json, sys, threading, time, os, queue, base64, itertools
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
+from utils.framing_utils import send_frame, recv_frame, recv_frame_with_kind, FRAME_HANDSHAKE, MAX_HANDSHAKE_FRAME_SIZE
+from utils.envelope_utils import negotiate_envelope, encode_handshake, seal_message, open_message, new_compression_context
+from utils.heartbeat_utils import encode_heartbeat
 from utils.encrypt_utils import(
-    encrypt_with_public_key,
-    decrypt_with_private_key,
     deserialize_public_key,
     serialize_public_key,
-    generate_ecc_keys
+    generate_ecc_keys,
+    generate_signing_key,
+    serialize_verify_key,
+    generate_session_salt,
+    derive_session_key,
+    Session_cipher,
+    Public_key_cipher
 )
 
+TRACKER_REQUEST_TIMEOUT = 5
+# login e register esperam na fila do argon2id do tracker (até PASSWORD_MAX_PENDING hashes):
+# sob carga isso passa de segundos, e o tracker responde "Servidor ocupado" quando a fila enche
+TRACKER_KDF_TIMEOUT = 30
+KDF_COMMANDS = ("login", "register")
+
 class Tracker_connection_manager:
     def __init__(self, tracker_host="localhost", tracker_port=6000):
         self.tracker_host = tracker_host
@@ -16,9 +30,24 @@ class Tracker_connection_manager:
         self.peer_socket_lock = threading.Lock()
         self.private_key, self.public_key = generate_ecc_keys()
         self.public_key_str = serialize_public_key(self.public_key)
+        # Assina o que este peer anuncia em salas overlay, onde as mensagens chegam repassadas
+        self.signing_key = generate_signing_key()
+        self.verify_key_str = serialize_verify_key(self.signing_key)
         self.peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.peer_socket.settimeout(5)
         self.tracker_public_key = None
+        self.cipher = None
+        self.envelope = 0
+        self.compression = None
+        # Uma única thread lê o socket: cada resposta completa o Future da requisição com o
+        # mesmo id, e os eventos do tracker vão para on_event
+        self.request_ids = itertools.count(1)
+        self.pending = {} # request-id -> Future, na ordem de envio
+        self.pending_lock = threading.Lock()
+        self.connection_lost = False
+        self.events = queue.Queue()
+        self.on_event = None
+        self.heartbeat_stop = None # Event da thread de heartbeat do login atual; o logout o sinaliza
 
     def connect_to_tracker(self):
         try:
@@ -28,41 +57,186 @@ class Tracker_connection_manager:
         
         # Troca de chaves com tracker
         try:
-            self.tracker_public_key = deserialize_public_key(
-                json.loads(self.peer_socket.recv(4096).decode())["public_key"])
-            self.peer_socket.send(json.dumps({"public_key": self.public_key_str}).encode())
+            tracker_handshake = json.loads(recv_frame(self.peer_socket, MAX_HANDSHAKE_FRAME_SIZE).decode())
+            self.tracker_public_key = deserialize_public_key(tracker_handshake["public_key"])
+            self.envelope = negotiate_envelope(tracker_handshake.get("envelope"))
+            self.compression = new_compression_context(self.envelope)
+
+            if self.envelope:
+                # Tracker entende o envelope binário: chave e salt vão em bytes, sem JSON
+                session_salt = generate_session_salt(raw=True)
+                session_key = derive_session_key(self.private_key, self.tracker_public_key, session_salt)
+                self.cipher = Session_cipher(session_key, initiator=True)
+                send_frame(self.peer_socket, encode_handshake(self.envelope, self.public_key, session_salt), FRAME_HANDSHAKE)
+            else:
+                handshake = {"public_key": self.public_key_str}
+
+                # Se o tracker suporta sessões, deriva uma chave simétrica uma única vez
+                if tracker_handshake.get("session"):
+                    handshake["session-salt"] = generate_session_salt()
+                    session_key = derive_session_key(self.private_key, self.tracker_public_key, handshake["session-salt"])
+                    self.cipher = Session_cipher(session_key, initiator=True)
+                else:
+                    self.cipher = Public_key_cipher(self.private_key, self.tracker_public_key)
+
+                send_frame(self.peer_socket, json.dumps(handshake))
         except Exception as e:
             print(f"[Erro] Falha na troca de chaves com tracker {e}")
             sys.exit()
 
+        self.peer_socket.settimeout(None)
+        threading.Thread(target=self.read_loop, daemon=True).start()
+        threading.Thread(target=self.dispatch_events, daemon=True).start()
 
-    def send_and_recv_encrypted_request(self, requisition):
-        """Helper para enviar requisições criptografadas"""
-        encrypted = encrypt_with_public_key(
-            self.tracker_public_key, json.dumps(requisition))
+    def read_loop(self):
+        error = None
+        try:
+            while True:
+                kind, encrypted_data = recv_frame_with_kind(self.peer_socket)
+                if not encrypted_data:
+                    break
+                message = open_message(self.cipher, kind, encrypted_data, self.compression)
+                if "event" in message:
+                    self.events.put(message)
+                else:
+                    self.complete_request(message)
+        except Exception as e:
+            # Qualquer falha (inclusive CryptoError de um frame adulterado) encerra a conexão:
+            # depois dela os contadores da sessão não batem mais
+            error = e
+
+        # Acorda quem estiver esperando uma resposta
+        with self.pending_lock:
+            self.connection_lost = True
+            pending, self.pending = self.pending, {}
+        try:
+            self.peer_socket.close()
+        except OSError:
+            pass
+        message = f"Erro de conexão: {error}" if error is not None else "Erro de conexão!"
+        for future in pending.values():
+            future.set_exception(ConnectionResetError(message))
+
+    def complete_request(self, response):
+        with self.pending_lock:
+            request_id = response.pop("request-id", None)
+            if request_id is None and self.pending:
+                # Tracker sem ids responde na ordem em que recebeu
+                request_id = next(iter(self.pending))
+            future = self.pending.pop(request_id, None)
+        if future is not None:
+            future.set_result(response)
+
+    def dispatch_events(self):
+        # Eventos são tratados fora da thread de leitura, pois o tratamento pode fazer novas requisições
+        while True:
+            event = self.events.get()
+            if self.on_event is not None:
+                try:
+                    self.on_event(event)
+                except Exception as e:
+                    print(f"[ERRO] Falha ao tratar evento do tracker: {e}")
+
+
+    def send_request(self, requisition):
+        """Envia uma requisição e retorna o Future da resposta, sem esperar por ela."""
+        future = Future()
+        with self.pending_lock:
+            if self.connection_lost:
+                raise ConnectionResetError("Erro de conexão!")
+            request_id = next(self.request_ids)
+            self.pending[request_id] = future
+
+        # O lock cobre só o envio, para os frames (e os contadores da sessão) não se cruzarem
         try:
             with self.peer_socket_lock:
-                self.peer_socket.send(encrypted.encode())    
-                encrypted_data = self.peer_socket.recv(4096).decode()
+                kind, payload = seal_message(self.cipher, {**requisition, "request-id": request_id}, self.envelope, self.compression)
+                send_frame(self.peer_socket, payload, kind)
+        except OSError:
+            self.forget_request(future)
+            raise
+        return future
 
-                if not encrypted_data:
-                    raise ConnectionResetError("Erro de conexão!")
-            
-            data = decrypt_with_private_key(self.private_key, encrypted_data)              
-            return json.loads(data)
+    def forget_request(self, future):
+        with self.pending_lock:
+            for request_id, pending_future in self.pending.items():
+                if pending_future is future:
+                    del self.pending[request_id]
+                    return
+
+    def send_and_recv_encrypted_request(self, requisition):
+        """Helper para enviar requisições criptografadas"""
+        try:
+            future = self.send_request(requisition)
+            try:
+                return future.result(timeout=request_timeout(requisition))
+            except FutureTimeoutError:
+                # A conexão continua de pé: quem chamou trata como qualquer outra resposta de erro
+                self.forget_request(future)
+                return {"status": "error", "message": "O tracker não respondeu a tempo, tente novamente", "timeout": True}
         except Exception as e:
             print("A conexão com o servidor foi perdida!")
             print(f"Erro: {e}")
             print("Encerrando cliente...")
             sys.exit()
 
-    def send_heartbeat(self, interval=30):
-        while True:
+    def send_batch_request(self, requisitions, stop_on_error=False):
+        """Envia vários comandos em um único frame e retorna as respostas na mesma ordem."""
+        response = self.send_and_recv_encrypted_request(
+            {"cmd": "batch", "requests": requisitions, "stop-on-error": stop_on_error})
+
+        if "responses" in response:
+            return response["responses"]
+        if response.get("timeout"):
+            return [response]
+
+        # Tracker sem suporte a lotes: envia um comando por vez
+        responses = []
+        for requisition in requisitions:
+            responses.append(self.send_and_recv_encrypted_request(requisition))
+            if stop_on_error and responses[-1].get("status") != "ok":
+                break
+        return responses
+
+    def start_heartbeat(self, heartbeat_info=None, interval=30):
+        """Inicia os heartbeats deste login, encerrando os de um login anterior."""
+        self.stop_heartbeat()
+        self.heartbeat_stop = threading.Event()
+        threading.Thread(target=self.send_heartbeat, args=(self.heartbeat_stop, heartbeat_info, interval), daemon=True).start()
+
+    def stop_heartbeat(self):
+        if self.heartbeat_stop is not None:
+            self.heartbeat_stop.set()
+
+    def send_heartbeat(self, stop, heartbeat_info=None, interval=30):
+        if heartbeat_info:
+            return self.send_udp_heartbeat(stop, heartbeat_info)
+
+        # Tracker sem heartbeat por UDP: uma requisição cifrada a cada intervalo
+        while not stop.is_set():
             try:
                 requisition = {"cmd": "heartbeat"}
                 self.send_and_recv_encrypted_request(requisition)
             except Exception as e:
                 pass
             
-            time.sleep(interval)
-    
+            stop.wait(interval)
+
+    def send_udp_heartbeat(self, stop, heartbeat_info):
+        """Envia um datagrama autenticado por intervalo; o tracker não responde."""
+        session_id = bytes.fromhex(heartbeat_info["session-id"])
+        key = base64.b64decode(heartbeat_info["key"])
+        address = (self.tracker_host, heartbeat_info["port"])
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+            for counter in itertools.count(1):
+                if stop.is_set():
+                    return
+                try:
+                    udp_socket.sendto(encode_heartbeat(session_id, counter, key), address)
+                except OSError:
+                    pass # Datagrama perdido; o próximo intervalo tenta de novo
+                stop.wait(heartbeat_info["interval"])
+
+def request_timeout(requisition):
+    commands = [requisition.get("cmd")] + [request.get("cmd") for request in requisition.get("requests", [])]
+    return TRACKER_KDF_TIMEOUT if any(cmd in KDF_COMMANDS for cmd in commands) else TRACKER_REQUEST_TIMEOUT
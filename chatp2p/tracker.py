@@ -1,187 +1,556 @@
-import socket, json, threading, time
-from datetime import datetime
+import socket, json, threading, time, argparse, multiprocessing, os, queue, shutil, signal, tempfile
+from multiprocessing.connection import wait
+from nacl.public import PrivateKey
 from tracker_managers.user_manager import User_manager
-from tracker_managers.room_manager import Room_manager
-from utils.encrypt_utils import generate_ecc_keys, serialize_public_key, deserialize_public_key, encrypt_with_public_key, decrypt_with_private_key
+from tracker_managers.room_manager import Room_manager, ROOM_TOPOLOGY_MESH, EVENT_MEMBER_ONLINE
+from tracker_managers.tracker_session import Tracker_session, INVALID_REQUEST_ERRORS
+from tracker_managers.heartbeat_manager import Heartbeat_manager
+from tracker_managers.offline_queue_manager import Offline_queue_manager
+from tracker_managers.password_manager import Password_manager, PASSWORD_WORKERS, PASSWORD_MAX_PENDING, PASSWORD_RATE, PASSWORD_BURST
+from utils.scheduler_utils import Expiry_scheduler
+from tracker_managers.async_tracker_engine import Async_tracker_engine
+from tracker_managers.worker_manager import Worker_manager, State_link
+from utils.framing_utils import send_frame, recv_frame_with_kind, encode_frame, FRAME_HANDSHAKE, MAX_HANDSHAKE_FRAME_SIZE
+from utils.envelope_utils import ENVELOPE_VERSION, seal_message, open_message, decode_handshake, new_compression_context
+from utils.log_utils import logger, LEVELS_BY_NAME, DEBUG
+from utils.encrypt_utils import PASSWORD_OPSLIMIT, PASSWORD_MEMLIMIT, generate_ecc_keys, serialize_public_key, deserialize_public_key, derive_session_key, Session_cipher, Public_key_cipher
+
+MAX_BATCH_SIZE = 32
+MAX_PUSH_QUEUE = 256 # Eventos esperando um peer no motor com threads; acima disso são descartados
+WORKER_RESTART_DELAY = 0.5     # Espera antes de reiniciar um worker que caiu logo após subir; dobra a cada queda
+WORKER_MAX_RESTART_DELAY = 30
+WORKER_STABLE_TIME = 60        # Um worker de pé por esse tempo zera a contagem de quedas
+WORKER_MAX_RESTARTS = 10       # Quedas seguidas de um mesmo worker antes de desistir
+DEFAULT_LOG_SAMPLE = ["heartbeat=100"]
+
+def open_server_socket(server_info, max_connec, reuse_port=False):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if reuse_port:
+        # Vários workers escutam na mesma porta e o kernel distribui as conexões entre eles
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind(server_info)
+    server.listen(max_connec)
+    return server
 
 class Tracker:
-    def __init__(self, host='0.0.0.0', port=6000, max_connec=5):
+    forwards_commands = False # True nos workers, que repassam os comandos ao processo de estado
+
+    def __init__(self, host='0.0.0.0', port=6000, max_connec=5, password_manager=None, serve_peers=True):
         self.host = host
         self.port = port
         self.server_info = (host, port)
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind(self.server_info)
-        self.server.listen(max_connec)
+        # Com --workers este processo só guarda o estado; quem aceita os peers são os workers
+        self.server = open_server_socket(self.server_info, max_connec) if serve_peers else None
+        # Heartbeats chegam por UDP na mesma porta do tracker
+        self.heartbeat_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.heartbeat_socket.bind(self.server_info)
 
         self.private_key, self.public_key = generate_ecc_keys()
         self.public_key_str = serialize_public_key(self.public_key)
 
-        self.user_manager = User_manager()
-        self.room_manager = Room_manager()
-
-        threading.Thread(target=self.monitor_inactive_users, daemon=True).start()
-        threading.Thread(target=self.room_manager.monitor_rooms, daemon=True).start()
+        self.expiry_scheduler = Expiry_scheduler()
+        self.room_manager = Room_manager(self.expiry_scheduler, on_room_event=self.notify_room_event)
+        self.password_manager = password_manager or Password_manager()
+        self.user_manager = User_manager(self.expiry_scheduler, on_user_expired=self.process_user_expired,
+                                         password_manager=self.password_manager)
+        self.heartbeat_manager = Heartbeat_manager(self.process_heartbeat)
+        self.offline_queue_manager = Offline_queue_manager(self.expiry_scheduler)
+        self.expiry_scheduler.start()
 
         print(f"Tracker iniciado em {self.host}:{self.port}")
         print("Aguardando conexões...")
 
 
-    def monitor_inactive_users(self):
-        while True:
-            time.sleep(30)
-            now = time.time()
-            inactive_users = []
-
-            with self.user_manager.active_peers_lock:
-                for username, user_data in list(self.user_manager.active_peers.items()):
-                    if now - user_data.get("last-seen", now) > 60:
-                        inactive_users.append(username)
-            
-            if inactive_users:
-                print(f"Detectados usuários inativos: {inactive_users}")
-                for user in inactive_users:
-                    self.user_manager.logout(user)
-                    self.room_manager.remove_user_from_all_rooms(user)
-
-
     def listen(self):
+        if self.heartbeat_socket is not None:
+            threading.Thread(target=self.heartbeat_manager.serve, args=(self.heartbeat_socket,), daemon=True).start()
         while True:
             peer_conec, address = self.server.accept()
-            print("Conexao de: " + str(address))
+            logger.info("Conexao de: %s", address, category="conexao")
             threading.Thread(target=self.process_new_peer, args=(peer_conec, address)).start()
 
 
     def process_new_peer(self, peer_conec, address):
-            user = None
+            session = Tracker_session(address, peer_conec)
+            session.push_handler = lambda message: self.queue_push(session, message)
             try:
-                peer_conec.send(json.dumps({"public_key": self.public_key_str}).encode())
+                send_frame(peer_conec, self.handshake_message())
                 
-                peer_public_key_str = json.loads(peer_conec.recv(4096).decode())["public_key"]
-                peer_public_key = deserialize_public_key(peer_public_key_str)
+                self.process_handshake(session, *recv_frame_with_kind(peer_conec, MAX_HANDSHAKE_FRAME_SIZE))
                 
                 while True:
-                    encrypted_data = peer_conec.recv(4096)
+                    kind, encrypted_data = recv_frame_with_kind(peer_conec)
                     if not encrypted_data:
                         break
 
-                    data = decrypt_with_private_key(self.private_key, encrypted_data.decode())
-                    peer_requisition = json.loads(data)
-                    
+                    peer_requisition = self.decrypt_request(session, kind, encrypted_data)
                     cmd = peer_requisition.get("cmd")
-                    
-                    response = {"status": "error", "message": "Comando inválido ou usuário não logado"}
-
-                    match cmd:
-                        case "login":
-                            response = self.user_manager.login(peer_requisition["usr"], 
-                                                               peer_requisition["password"], 
-                                                               address,
-                                                               peer_requisition["peer-listen-port"],
-                                                               peer_public_key_str,
-                                                               peer_conec)
-                                                               
-                            if response.get("status") == "ok":
-                                user = response.get("usr")
-
-                        case "logout":
-                            if user:
-                                response = self.user_manager.logout(user)
-                                if response.get("status") == "ok":
-                                    user = None
-                        
-                        case "register":
-                            response = self.user_manager.register(peer_requisition["usr"], peer_requisition["password"])
-                        
-                        case "list-peers":
-                            if user:
-                                response = self.user_manager.list_active_peers(user)
-                        
-                        case "get-peer-addr":
-                            if user:
-                                response = self.user_manager.get_peer_addr(peer_requisition["user-to-connect"])
-
-                        case "list-rooms":
-                            if user:
-                                response = self.room_manager.list_rooms()
-                        
-                        case "create-room":
-                            if user:
-                                response = self.room_manager.create_room(peer_requisition["room-name"], user)
-                        
-                        case "join-room":
-                            if user:
-                                response = self.room_manager.join_room(peer_requisition["room-to-join"], user)
-                        
-                        case "get-room-members":
-                            if user:
-                                room_name = peer_requisition.get("room-name")
-                                online_users_response = self.room_manager.get_online_members_in_room(room_name, user)
-
-                                if online_users_response["status"] == "ok":
-                                    online_usernames = online_users_response["online-members"]
-                                    members_info = {}
-                                    for member_user in online_usernames:
-                                        info_response = self.user_manager.get_peer_addr(member_user)
-                                        if info_response["status"] == "ok":
-                                            members_info[member_user] = {
-                                                "user-ip": info_response["user-ip"],
-                                                "user-port": info_response["user-port"],
-                                                "peer-public-key": info_response["peer-public-key"]
-                                            }
-                                    response = {"status": "ok", "members": members_info}
-                                else:
-                                    response = online_users_response
-                        
-                        case "leave-room":
-                            if user:
-                                response = self.room_manager.leave_room(peer_requisition["room-name"], user)
-
-                        case "list-my-rooms":
-                            if user:
-                                response = self.room_manager.list_my_rooms(user)
-
-                        case "list-members":
-                            if user:
-                                response = self.room_manager.list_members(peer_requisition["room-name"])
-
-                        case "add-member":
-                            if user:
-                                response = self.room_manager.add_member(peer_requisition["room-name"], peer_requisition["user"], user, self.user_manager.users)
-
-                        case "remove-member":
-                            if user:
-                                response = self.room_manager.remove_member(peer_requisition["room-name"], peer_requisition["user"], user)
-
-                        case "close-room":
-                            if user:
-                                response = self.room_manager.close_room(peer_requisition["room-name"], user)
-
-                        case "heartbeat":
-                            if user:
-                                response = self.user_manager.update_heartbeat(user)
-                                self.room_manager.update_mod_heartbeat(user)
-                    
-                    timestamp = datetime.now().strftime('%H:%M')  
-                    print(f"[{timestamp}] Comando '{cmd}' de '{user if user else str(address)}'. Resposta: {response}")
-
-                    encrypted_response = encrypt_with_public_key(peer_public_key, json.dumps(response))
-                    peer_conec.send(encrypted_response.encode())
+                    response = self.process_command(session, cmd, peer_requisition)
+                    # O lock só cobre cifrar e enviar, para eventos de outras threads não cruzarem a resposta
+                    with session.send_lock:
+                        peer_conec.sendall(self.encrypt_response(session, cmd, response))
             
             except (ConnectionResetError, json.JSONDecodeError, ValueError, OSError):
                 pass
+
+            except INVALID_REQUEST_ERRORS as e:
+                self.log_invalid_request(session, e)
             
             finally:
-                if user:
-                    self.user_manager.logout(user)
-                    self.room_manager.remove_user_from_all_rooms(user)
+                self.end_session(session)
+                self.stop_push(session)
                 peer_conec.close()
+
+    def log_invalid_request(self, session, error):
+        logger.warning("Sessão de '%s' encerrada por requisição inválida: %s: %s", session.describe(),
+                       type(error).__name__, error, category="requisicao-invalida")
+
+    def handshake_message(self):
+        return json.dumps({"public_key": self.public_key_str, "session": True, "envelope": ENVELOPE_VERSION})
+
+    def process_handshake(self, session, kind, handshake_data):
+        if kind == FRAME_HANDSHAKE:
+            # Cliente que entende o envelope binário: chave e salt chegam em bytes
+            session.envelope, session.peer_public_key, session_salt, _ = decode_handshake(handshake_data)
+            session.compression = new_compression_context(session.envelope)
+            session.peer_public_key_str = serialize_public_key(session.peer_public_key)
+            session_key = derive_session_key(self.private_key, session.peer_public_key, session_salt)
+            session.cipher = Session_cipher(session_key, initiator=False)
+            return
+
+        handshake = json.loads(handshake_data.decode())
+        session.peer_public_key_str = handshake["public_key"]
+        session.peer_public_key = deserialize_public_key(session.peer_public_key_str)
+
+        # Clientes que enviam um salt de sessão usam criptografia simétrica após o handshake
+        if "session-salt" in handshake:
+            session_key = derive_session_key(self.private_key, session.peer_public_key, handshake["session-salt"])
+            session.cipher = Session_cipher(session_key, initiator=False)
+        else:
+            session.cipher = Public_key_cipher(self.private_key, session.peer_public_key)
+
+    def decrypt_request(self, session, kind, encrypted_data):
+        return open_message(session.cipher, kind, encrypted_data, session.compression)
+
+    def encrypt_response(self, session, cmd, response):
+        if logger.is_enabled(DEBUG):
+            logger.debug("Comando '%s' de '%s'. Resposta: %s", cmd, session.describe(), response, category=cmd)
+        else:
+            logger.info("Comando '%s' de '%s'", cmd, session.describe(), category=cmd, status=response.get("status"))
+
+        return self.encode_message(session, response)
+
+    def encode_message(self, session, message):
+        """Cifra a mensagem no formato negociado com o peer e retorna o frame pronto para envio."""
+        kind, payload = seal_message(session.cipher, message, session.envelope, session.compression)
+        return encode_frame(payload, kind)
+
+    def process_command(self, session, cmd, peer_requisition):
+        user = session.user
+        address = session.address
+        response = {"status": "error", "message": "Comando inválido ou usuário não logado"}
+
+        match cmd:
+            case "login" | "register" if not self.password_manager.allow(address[0]):
+                # Cada tentativa custa um argon2id: um mesmo endereço não pode ocupar o pool sozinho
+                response = {"status": "error", "message": "Muitas tentativas, aguarde alguns segundos"}
+
+            case "login":
+                response = self.user_manager.login(peer_requisition["usr"], 
+                                                   peer_requisition["password"], 
+                                                   address,
+                                                   peer_requisition["peer-listen-port"],
+                                                   session.peer_public_key_str,
+                                                   session,
+                                                   peer_requisition.get("envelope", 0),
+                                                   peer_requisition.get("signing-key"))
+                                                   
+                if response.get("status") == "ok":
+                    session.user = response.get("usr")
+                    response["heartbeat"] = self.heartbeat_manager.register(session.user, self.port)
+                    if "mailbox-key" in peer_requisition:
+                        self.user_manager.set_mailbox_key(session.user, peer_requisition["mailbox-key"])
+                    # Mensagens guardadas enquanto o usuário estava offline vão todas de uma vez;
+                    # saem da fila só depois do ack-offline
+                    offline_messages = self.offline_queue_manager.pending(session.user)
+                    if offline_messages:
+                        response["offline-messages"] = offline_messages
+
+            case "logout":
+                if user:
+                    response = self.user_manager.logout(user)
+                    self.heartbeat_manager.unregister(user)
+                    if response.get("status") == "ok":
+                        session.user = None
+            
+            case "register":
+                response = self.user_manager.register(peer_requisition["usr"], peer_requisition["password"])
+            
+            case "list-peers":
+                if user:
+                    response = self.user_manager.list_active_peers(user)
+            
+            case "get-peer-addr":
+                if user:
+                    response = self.user_manager.get_peer_addr(peer_requisition["user-to-connect"])
+
+            case "list-rooms":
+                if user:
+                    response = self.room_manager.list_rooms()
+            
+            case "create-room":
+                if user:
+                    response = self.room_manager.create_room(peer_requisition["room-name"], user,
+                                                             peer_requisition.get("topology", ROOM_TOPOLOGY_MESH))
+            
+            case "join-room":
+                if user:
+                    response = self.room_manager.join_room(peer_requisition["room-to-join"], user)
+            
+            case "get-room-members":
+                if user:
+                    room_name = peer_requisition.get("room-name")
+                    online_users_response = self.room_manager.get_online_members_in_room(room_name, user)
+
+                    if online_users_response["status"] == "ok":
+                        online_usernames = online_users_response["online-members"]
+                        members_info = {}
+                        for member_user in online_usernames:
+                            info_response = self.user_manager.get_peer_addr(member_user)
+                            if info_response["status"] == "ok":
+                                members_info[member_user] = {
+                                    "user-ip": info_response["user-ip"],
+                                    "user-port": info_response["user-port"],
+                                    "peer-public-key": info_response["peer-public-key"],
+                                    "envelope": info_response["envelope"],
+                                    "signing-key": info_response["signing-key"]
+                                }
+                        response = {"status": "ok", "members": members_info, "topology": online_users_response["topology"]}
+                    else:
+                        response = online_users_response
+            
+            case "leave-room":
+                if user:
+                    response = self.room_manager.leave_room(peer_requisition["room-name"], user)
+
+            case "list-my-rooms":
+                if user:
+                    response = self.room_manager.list_my_rooms(user)
+
+            case "list-members":
+                if user:
+                    response = self.room_manager.list_members(peer_requisition["room-name"])
+
+            case "add-member":
+                if user:
+                    response = self.room_manager.add_member(peer_requisition["room-name"], peer_requisition["user"], user, self.user_manager.users)
+
+            case "remove-member":
+                if user:
+                    response = self.room_manager.remove_member(peer_requisition["room-name"], peer_requisition["user"], user)
+
+            case "close-room":
+                if user:
+                    response = self.room_manager.close_room(peer_requisition["room-name"], user)
+
+            case "heartbeat":
+                if user:
+                    response = self.process_heartbeat(user)
+
+            case "get-mailbox-key":
+                if user:
+                    response = self.user_manager.get_mailbox_key(peer_requisition["user"])
+
+            case "send-offline":
+                if user:
+                    response = self.process_send_offline(user, peer_requisition["to"], peer_requisition["sealed"])
+
+            case "ack-offline":
+                if user:
+                    response = self.offline_queue_manager.acknowledge(user, peer_requisition["last-id"], peer_requisition.get("ids"))
+
+            case "batch":
+                response = self.process_batch(session, peer_requisition)
+
+        # O id permite ao peer ter várias requisições em andamento e casar cada resposta
+        if "request-id" in peer_requisition:
+            response["request-id"] = peer_requisition["request-id"]
+        return response
+
+    def process_batch(self, session, peer_requisition):
+        """Executa uma lista ordenada de subcomandos e devolve as respostas na mesma ordem."""
+        requests = peer_requisition.get("requests", [])
+        if len(requests) > MAX_BATCH_SIZE:
+            return {"status": "error", "message": f"Lote excede o limite de {MAX_BATCH_SIZE} comandos"}
+
+        responses = []
+        failed = False
+        for sub_requisition in requests:
+            if failed:
+                responses.append({"status": "error", "message": "Não executado: comando anterior falhou"})
+                continue
+
+            sub_cmd = sub_requisition.get("cmd")
+            if sub_cmd == "batch":
+                sub_response = {"status": "error", "message": "Lotes aninhados não são permitidos"}
+            else:
+                sub_response = self.process_command(session, sub_cmd, sub_requisition)
+            responses.append(sub_response)
+
+            if peer_requisition.get("stop-on-error") and sub_response.get("status") != "ok":
+                failed = True
+
+        return {"status": "ok", "responses": responses}
+
+    def process_send_offline(self, user, recipient, sealed_message):
+        if self.user_manager.get_mailbox_key(recipient)["status"] != "ok":
+            return {"status": "error", "message": "Usuário não existe ou não pode receber mensagens offline"}
+        response, message = self.offline_queue_manager.enqueue(recipient, user, sealed_message)
+        if message is None:
+            return response
+
+        # Destinatário que entrou nesse meio tempo recebe na hora; a mensagem segue na fila até o ack.
+        # Só a nova: as anteriores já foram entregues no login ou em eventos anteriores
+        session = self.user_manager.get_session(recipient)
+        if session is not None:
+            session.push({"event": "offline-messages", "messages": [message]})
+            response["message"] = f"{recipient} está online e recebeu a mensagem"
+        return response
+
+    def process_heartbeat(self, user):
+        # Chamado tanto pelo comando "heartbeat" (TCP) quanto pelos datagramas UDP
+        response = self.user_manager.update_heartbeat(user)
+        if response["status"] == "ok":
+            # Usuário que já expirou não mantém suas salas abertas
+            self.room_manager.update_mod_heartbeat(user)
+        return response
+
+    def process_user_expired(self, user):
+        # As credenciais UDP do login expirado deixam de valer, como no logout
+        self.heartbeat_manager.unregister(user)
+        self.room_manager.remove_user_from_all_rooms(user)
+
+    def send_to_session(self, session, message):
+        with session.send_lock:
+            session.peer_conec.sendall(self.encode_message(session, message))
+
+    def queue_push(self, session, message):
+        # Quem gera o evento (a thread de outro peer, o agendador de expiração, o link com o
+        # processo de estado) só enfileira: um peer que não lê perde eventos em vez de travá-lo
+        with session.push_lock:
+            if session.push_queue is None:
+                session.push_queue = queue.Queue(maxsize=MAX_PUSH_QUEUE)
+                threading.Thread(target=self.push_loop, args=(session,), daemon=True).start()
+            try:
+                session.push_queue.put_nowait(message)
+            except queue.Full:
+                logger.warning("Evento para '%s' descartado: peer não está lendo", session.describe(), category="push-descartado")
+
+    def push_loop(self, session):
+        while True:
+            message = session.push_queue.get()
+            if message is None:
+                return
+            try:
+                self.send_to_session(session, message)
+            except OSError:
+                return # A thread da sessão trata a conexão perdida
+
+    def stop_push(self, session):
+        with session.push_lock:
+            if session.push_queue is None:
+                return
+            # Desbloqueia um envio parado em um peer que não lê; a fila nunca fica cheia sem
+            # a thread de envio estar enviando, e esse envio agora falha
+            try:
+                session.peer_conec.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                session.push_queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def notify_room_event(self, event, room_name, user, recipients, reason):
+        """Empurra um evento de sala para os peers que estão dentro dela."""
+        if not recipients:
+            return
+        message = {"event": event, "room": room_name, "user": user, "reason": reason}
+        if event == EVENT_MEMBER_ONLINE:
+            peer_addr = self.user_manager.get_peer_addr(user)
+            if peer_addr["status"] == "ok":
+                message["details"] = {key: peer_addr[key] for key in ("user-ip", "user-port", "peer-public-key", "envelope", "signing-key")}
+
+        for recipient in recipients:
+            session = self.user_manager.get_session(recipient)
+            if session is not None:
+                session.push(message)
+        logger.debug("Evento '%s' da sala '%s' enviado a %d peer(s)", event, room_name, len(recipients), category="evento")
+
+    def log_compression(self, session):
+        if session.compression is not None and session.compression.stats["compressed"]:
+            logger.info("Compressão na sessão de '%s': %d bytes economizados", session.describe(),
+                        session.compression.stats["bytes-saved"], category="compressao")
+
+    def end_session(self, session):
+        self.log_compression(session)
+        if session.user:
+            self.user_manager.logout(session.user)
+            self.heartbeat_manager.unregister(session.user)
+            self.room_manager.remove_user_from_all_rooms(session.user)
+            session.user = None
+
+class Tracker_worker(Tracker):
+    """Worker do tracker com --workers: atende os peers na porta compartilhada (SO_REUSEPORT).
+
+    Handshake, criptografia, compressão e JSON rodam aqui, cada worker com seu próprio GIL;
+    os comandos já decifrados vão ao processo de estado, que responde e empurra os eventos.
+    """
+    forwards_commands = True
+
+    def __init__(self, host, port, max_connec, private_key, state_socket_path):
+        self.host = host
+        self.port = port
+        self.server_info = (host, port)
+        self.server = open_server_socket(self.server_info, max_connec, reuse_port=True)
+        self.heartbeat_socket = None # Os heartbeats UDP chegam ao processo de estado
+
+        # Todos os workers usam a chave do tracker, gerada pelo processo de estado
+        self.private_key = PrivateKey(private_key)
+        self.public_key = self.private_key.public_key
+        self.public_key_str = serialize_public_key(self.public_key)
+        self.state_link = State_link(state_socket_path)
+
+    def process_handshake(self, session, kind, handshake_data):
+        super().process_handshake(session, kind, handshake_data)
+        self.state_link.open_session(session)
+
+    def process_command(self, session, cmd, peer_requisition):
+        return self.state_link.request(session, cmd, peer_requisition)
+
+    def end_session(self, session):
+        self.log_compression(session)
+        if session.state_id is not None:
+            self.state_link.close_session(session)
+
+def run_worker(host, port, max_connec, private_key, state_socket_path, use_async, log_level, sample_rates):
+    logger.configure(level=log_level, sample_rates=sample_rates)
+    worker = Tracker_worker(host, port, max_connec, private_key, state_socket_path)
+    try:
+        if use_async:
+            Async_tracker_engine(worker).run()
+        else:
+            worker.listen()
+    except KeyboardInterrupt:
+        logger.flush()
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+def run_with_workers(tracker, workers, max_connec, use_async, log_level, sample_rates):
+    """Sobe os workers e mantém este processo como dono do estado (usuários, salas, fila offline e heartbeats)."""
+    # SIGTERM também encerra os workers e salva os dados, como o Ctrl+C
+    signal.signal(signal.SIGTERM, interrupt)
+    state_dir = tempfile.mkdtemp(prefix="chatp2p-tracker-")
+    worker_manager = Worker_manager(tracker, os.path.join(state_dir, "estado.sock"))
+    worker_manager.start()
+    threading.Thread(target=tracker.heartbeat_manager.serve, args=(tracker.heartbeat_socket,), daemon=True).start()
+
+    # spawn em vez de fork: este processo já tem threads (diário, agendador, log, pool do KDF)
+    context = multiprocessing.get_context("spawn")
+    worker_args = (tracker.host, tracker.port, max_connec, bytes(tracker.private_key), worker_manager.socket_path,
+                   use_async, log_level, sample_rates)
+
+    def start_worker(slot):
+        slot["process"] = context.Process(target=run_worker, args=worker_args, daemon=True)
+        slot["process"].start()
+        slot["started"] = time.monotonic()
+
+    slots = [{"process": None, "started": 0, "failures": 0, "restart-at": 0} for _ in range(workers)]
+    for slot in slots:
+        start_worker(slot)
+    print(f"{workers} worker(s) atendendo a porta {tracker.port}")
+    try:
+        while True:
+            now = time.monotonic()
+            for slot in slots:
+                process = slot["process"]
+                if process is not None and not process.is_alive():
+                    # Um worker que cai logo ao subir (porta, chave, bug) cairia de novo em seguida:
+                    # a espera cresce a cada queda seguida e, passado o limite, o tracker desiste
+                    failures = 0 if now - slot["started"] >= WORKER_STABLE_TIME else slot["failures"] + 1
+                    if failures > WORKER_MAX_RESTARTS:
+                        logger.error("Worker %d saiu com código %s após %d quedas seguidas; encerrando o tracker",
+                                     process.pid, process.exitcode, slot["failures"])
+                        return 1
+                    delay = min(WORKER_RESTART_DELAY * 2 ** (failures - 1), WORKER_MAX_RESTART_DELAY) if failures else 0
+                    logger.warning("Worker %d saiu com código %s; iniciando outro em %.1fs", process.pid, process.exitcode, delay)
+                    slot.update({"process": None, "failures": failures, "restart-at": now + delay})
+                if slot["process"] is None and now >= slot["restart-at"]:
+                    start_worker(slot)
+
+            restarts = [slot["restart-at"] - now for slot in slots if slot["process"] is None]
+            wait([slot["process"].sentinel for slot in slots if slot["process"] is not None],
+                 timeout=max(0, min(restarts)) if restarts else None)
+    finally:
+        for slot in slots:
+            if slot["process"] is not None:
+                slot["process"].terminate()
+        worker_manager.close()
+        shutil.rmtree(state_dir, ignore_errors=True)
     
 if __name__ == "__main__":
-    tracker = Tracker()
+    parser = argparse.ArgumentParser(description="Tracker do Chatp2p")
+    parser.add_argument("--port", type=int, default=6000, help="Porta de escuta do tracker")
+    parser.add_argument("--backlog", type=int, default=5, help="Tamanho da fila de conexões pendentes")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Atende todas as sessões em um único event loop asyncio em vez de uma thread por conexão")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Processos que atendem os peers na mesma porta (SO_REUSEPORT), com usuários e salas "
+                             "em um processo de estado compartilhado; 0 atende tudo neste processo")
+    parser.add_argument("--log-level", choices=LEVELS_BY_NAME.keys(), default="info",
+                        help="Nível mínimo de log; 'debug' inclui a resposta completa de cada comando")
+    parser.add_argument("--log-sample", action="append", default=None, metavar="CMD=N",
+                        help="Registra apenas 1 a cada N ocorrências do comando (padrão: heartbeat=100; informar a opção substitui o padrão)")
+    parser.add_argument("--kdf-ops", type=int, default=PASSWORD_OPSLIMIT, help="Iterações do argon2id das senhas")
+    parser.add_argument("--kdf-mem", type=int, default=PASSWORD_MEMLIMIT // (1024 * 1024), help="Memória do argon2id por hash, em MiB")
+    parser.add_argument("--kdf-workers", type=int, default=PASSWORD_WORKERS, help="Threads que calculam hashes de senha")
+    parser.add_argument("--kdf-queue", type=int, default=PASSWORD_MAX_PENDING,
+                        help="Hashes de senha em andamento antes de recusar logins e cadastros com 'servidor ocupado'")
+    parser.add_argument("--login-rate", type=float, default=PASSWORD_RATE,
+                        help="Logins e cadastros por segundo por endereço após o burst (0 desativa o limite)")
+    parser.add_argument("--login-burst", type=int, default=PASSWORD_BURST, help="Tentativas seguidas permitidas por endereço")
+    args = parser.parse_args()
+    if args.workers and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers precisa de SO_REUSEPORT, disponível no Linux")
+
+    sample_rates = {}
+    # Passar --log-sample substitui o padrão em vez de somar a ele
+    for option in args.log_sample if args.log_sample is not None else DEFAULT_LOG_SAMPLE:
+        cmd, _, rate = option.partition("=")
+        sample_rates[cmd] = int(rate)
+    logger.configure(level=LEVELS_BY_NAME[args.log_level], sample_rates=sample_rates)
+
+    password_manager = Password_manager(workers=args.kdf_workers, max_pending=args.kdf_queue, opslimit=args.kdf_ops,
+                                        memlimit=args.kdf_mem * 1024 * 1024, rate=args.login_rate, burst=args.login_burst)
+    tracker = Tracker(port=args.port, max_connec=args.backlog, password_manager=password_manager,
+                      serve_peers=args.workers == 0)
+    exit_code = 0
     try:
-        tracker.listen()
+        if args.workers:
+            # Só retorna quando um worker cai seguidas vezes
+            exit_code = run_with_workers(tracker, args.workers, args.backlog, args.use_async,
+                                         LEVELS_BY_NAME[args.log_level], sample_rates)
+        elif args.use_async:
+            Async_tracker_engine(tracker).run()
+        else:
+            tracker.listen()
     except KeyboardInterrupt:
-        print("\n[INFO] Encerrando o tracker... Salvando dados.")
-        tracker.user_manager.save_users()
-        tracker.room_manager.save_rooms()
-        print("[INFO] Dados salvos. tracker encerrado!!")
\ No newline at end of file
+        pass
+    logger.flush()
+    print("\n[INFO] Encerrando o tracker... Salvando dados.")
+    tracker.user_manager.save_users()
+    tracker.room_manager.save_rooms()
+    tracker.offline_queue_manager.save_queues()
+    print("[INFO] Dados salvos. tracker encerrado!!")
+    raise SystemExit(exit_code)
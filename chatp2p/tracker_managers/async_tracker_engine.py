@@ -0,0 +1,123 @@
+import asyncio, json
+from concurrent.futures import ThreadPoolExecutor
+from tracker_managers.tracker_session import Tracker_session, INVALID_REQUEST_ERRORS
+from utils.framing_utils import encode_frame, read_frame_with_kind, MAX_HANDSHAKE_FRAME_SIZE
+from utils.log_utils import logger
+
+# Comandos que podem bloquear (register espera o fsync do diário, login e register esperam o
+# hash da senha no pool do KDF, a fila offline lê e grava os arquivos dos destinatários)
+# rodam fora do event loop
+BLOCKING_COMMANDS = {"register", "login", "batch", "send-offline", "ack-offline"}
+
+# Eventos não esperam o peer ler: acima disso no buffer de envio da sessão eles são descartados
+MAX_PUSH_BUFFER = 1024 * 1024
+
+class Async_tracker_engine:
+    """Atende todas as sessões do tracker em um único event loop.
+
+    Reaproveita o socket de escuta e o processamento de comandos do Tracker, trocando
+    apenas o modelo de concorrência: cada conexão vira uma corrotina em vez de uma thread.
+    """
+
+    def __init__(self, tracker, max_workers=64):
+        self.tracker = tracker
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        if self.tracker.heartbeat_socket is not None:
+            await loop.create_datagram_endpoint(lambda: Heartbeat_protocol(self.tracker.heartbeat_manager),
+                                                sock=self.tracker.heartbeat_socket)
+        server = await asyncio.start_server(self.process_new_peer, sock=self.tracker.server)
+        async with server:
+            await server.serve_forever()
+
+    async def process_new_peer(self, reader, writer):
+        address = writer.get_extra_info("peername")
+        logger.info("Conexao de: %s", address, category="conexao")
+        session = Tracker_session(address, writer)
+        loop = asyncio.get_running_loop()
+        # Eventos podem vir de qualquer thread; cifrar e escrever no loop mantém a ordem dos contadores
+        session.push_handler = lambda message: loop.call_soon_threadsafe(self.write_push, session, writer, message)
+        pending_tasks = set()
+        try:
+            writer.write(encode_frame(self.tracker.handshake_message()))
+            await writer.drain()
+
+            self.tracker.process_handshake(session, *await read_frame_with_kind(reader, MAX_HANDSHAKE_FRAME_SIZE))
+
+            while True:
+                kind, encrypted_data = await read_frame_with_kind(reader)
+                if not encrypted_data:
+                    break
+
+                peer_requisition = self.tracker.decrypt_request(session, kind, encrypted_data)
+                cmd = peer_requisition.get("cmd")
+                # Em um worker todo comando espera a resposta do processo de estado
+                blocking = cmd in BLOCKING_COMMANDS or self.tracker.forwards_commands
+                if blocking and "request-id" in peer_requisition:
+                    # Com id na requisição a resposta pode chegar fora de ordem: os próximos
+                    # comandos da sessão não esperam o fsync deste
+                    task = loop.create_task(self.process_blocking_command(session, writer, cmd, peer_requisition))
+                    pending_tasks.add(task)
+                    task.add_done_callback(pending_tasks.discard)
+                    continue
+                if blocking:
+                    response = await loop.run_in_executor(
+                        self.executor, self.tracker.process_command, session, cmd, peer_requisition)
+                else:
+                    response = self.tracker.process_command(session, cmd, peer_requisition)
+
+                writer.write(self.tracker.encrypt_response(session, cmd, response))
+                await writer.drain()
+
+        except (ConnectionResetError, json.JSONDecodeError, ValueError, OSError):
+            pass
+
+        except INVALID_REQUEST_ERRORS as e:
+            self.tracker.log_invalid_request(session, e)
+
+        finally:
+            writer.close()
+            # Cancelar a task não para a thread do executor: um login ainda em andamento terminaria
+            # depois do end_session e deixaria o usuário online sem conexão. A sessão só é
+            # encerrada depois dos comandos que já saíram para o executor
+            if pending_tasks:
+                await asyncio.gather(*pending_tasks, return_exceptions=True)
+            self.tracker.end_session(session)
+
+    async def process_blocking_command(self, session, writer, cmd, peer_requisition):
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.tracker.process_command, session, cmd, peer_requisition)
+        except (ValueError, *INVALID_REQUEST_ERRORS) as e:
+            # Fechar o writer faz process_new_peer sair do laço e encerrar a sessão
+            self.tracker.log_invalid_request(session, e)
+            writer.close()
+            return
+        if not writer.is_closing():
+            writer.write(self.tracker.encrypt_response(session, cmd, response))
+            try:
+                await writer.drain()
+            except (ConnectionResetError, OSError):
+                pass # process_new_peer encerra a sessão
+
+    def write_push(self, session, writer, message):
+        if writer.is_closing():
+            return
+        # Roda como callback no loop, sem poder esperar o drain: um peer que não lê perde eventos
+        # em vez de fazer o buffer crescer sem limite
+        if writer.transport.get_write_buffer_size() > MAX_PUSH_BUFFER:
+            logger.warning("Evento para '%s' descartado: peer não está lendo", session.describe(), category="push-descartado")
+            return
+        writer.write(self.tracker.encode_message(session, message))
+
+class Heartbeat_protocol(asyncio.DatagramProtocol):
+    def __init__(self, heartbeat_manager):
+        self.heartbeat_manager = heartbeat_manager
+
+    def datagram_received(self, data, addr):
+        self.heartbeat_manager.process_datagram(data, addr)
@@ -0,0 +1,75 @@
+import base64, threading
+from utils.heartbeat_utils import new_heartbeat_credentials, decode_heartbeat, verify_heartbeat
+from utils.log_utils import logger
+
+# Com USER_INACTIVITY_TIMEOUT de 60 s, a perda de um datagrama não derruba o peer
+HEARTBEAT_INTERVAL = 20
+
+class Heartbeat_manager:
+    """Recebe os heartbeats por UDP: um datagrama autenticado por peer, sem resposta.
+
+    No login o tracker entrega ao peer, pelo canal cifrado, um id de sessão e uma chave
+    de MAC. Datagramas com MAC inválido ou contador repetido são descartados.
+    """
+
+    def __init__(self, on_heartbeat, interval=HEARTBEAT_INTERVAL):
+        self.on_heartbeat = on_heartbeat
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.sessions = {} # id da sessão -> {"user", "key", "counter"}
+        self.session_by_user = {}
+        self.stats = {"accepted": 0, "rejected": 0}
+
+    def register(self, user, port):
+        """Cria as credenciais de heartbeat do usuário, invalidando as de um login anterior."""
+        session_id, key = new_heartbeat_credentials()
+        with self.lock:
+            self.sessions.pop(self.session_by_user.get(user), None)
+            self.sessions[session_id] = {"user": user, "key": key, "counter": 0}
+            self.session_by_user[user] = session_id
+        return {
+            "port": port,
+            "session-id": session_id.hex(),
+            "key": base64.b64encode(key).decode(),
+            "interval": self.interval
+        }
+
+    def unregister(self, user):
+        with self.lock:
+            session_id = self.session_by_user.pop(user, None)
+            self.sessions.pop(session_id, None)
+
+    def process_datagram(self, datagram, address):
+        try:
+            session_id, counter = decode_heartbeat(datagram)
+        except ValueError:
+            return self.reject(address)
+
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or counter <= session["counter"] or not verify_heartbeat(session["key"], datagram):
+                user = None
+                self.stats["rejected"] += 1
+            else:
+                session["counter"] = counter
+                user = session["user"]
+                self.stats["accepted"] += 1
+
+        if user is None:
+            logger.debug("Heartbeat UDP inválido de %s", address, category="heartbeat-invalido")
+            return
+        self.on_heartbeat(user)
+        logger.info("Heartbeat UDP de '%s'", user, category="heartbeat", counter=counter)
+
+    def reject(self, address):
+        with self.lock:
+            self.stats["rejected"] += 1
+        logger.debug("Heartbeat UDP inválido de %s", address, category="heartbeat-invalido")
+
+    def serve(self, udp_socket):
+        while True:
+            try:
+                datagram, address = udp_socket.recvfrom(64)
+            except OSError:
+                return
+            self.process_datagram(datagram, address)
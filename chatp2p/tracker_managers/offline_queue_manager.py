@@ -0,0 +1,234 @@
+import json, os, threading, time
+from utils.log_utils import logger
+
+OFFLINE_DIR = "data_storage/offline"
+OFFLINE_TTL = 7 * 24 * 3600          # Mensagens não entregues nesse prazo são descartadas
+OFFLINE_MAX_MESSAGES = 200           # Por destinatário
+OFFLINE_MAX_BYTES = 512 * 1024       # Por destinatário, somando memória e disco
+OFFLINE_MAX_MESSAGE_SIZE = 16 * 1024 # Texto cifrado de uma única mensagem
+OFFLINE_MEMORY_PER_USER = 16 * 1024  # Acima disso as mensagens do destinatário vão para o disco
+OFFLINE_MEMORY_TOTAL = 8 * 1024 * 1024
+
+class Offline_queue_manager:
+    """Fila de mensagens para usuários offline, cifradas pelo remetente para a chave de caixa
+    postal do destinatário (o tracker só guarda e repassa o texto cifrado).
+
+    As primeiras mensagens de cada destinatário ficam em memória; passando de
+    memory_per_user (ou do total de memory_total entre todos), as seguintes são anexadas
+    a um arquivo do destinatário. Profundidade e bytes por destinatário são limitados, e
+    cada mensagem expira em ttl segundos. A fila só é apagada quando o destinatário
+    confirma o recebimento (ack), então uma entrega interrompida é repetida no próximo login.
+    """
+
+    def __init__(self, expiry_scheduler, directory=OFFLINE_DIR, ttl=OFFLINE_TTL, max_messages=OFFLINE_MAX_MESSAGES,
+                 max_bytes=OFFLINE_MAX_BYTES, memory_per_user=OFFLINE_MEMORY_PER_USER, memory_total=OFFLINE_MEMORY_TOTAL):
+        self.expiry_scheduler = expiry_scheduler
+        self.directory = directory
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.memory_per_user = memory_per_user
+        self.memory_total = memory_total
+        self.lock = threading.Lock()
+        # destinatário -> {"memory": [mensagens], "memory-bytes", "spilled", "spilled-bytes", "oldest"}
+        self.queues = {}
+        # Ids crescentes entre todas as filas e execuções, para um ack atrasado não apagar mensagens novas
+        self.last_id = 0
+        self.memory_bytes = 0
+        self.stats = {"queued": 0, "spilled": 0, "delivered": 0, "expired": 0, "rejected": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.load_spilled()
+
+    def spill_path(self, user):
+        # Nomes de usuário são livres; em hexadecimal viram nomes de arquivo válidos
+        return os.path.join(self.directory, user.encode("utf-8").hex() + ".queue")
+
+    def load_spilled(self):
+        """Recupera as filas gravadas em disco por uma execução anterior."""
+        for name in os.listdir(self.directory):
+            if not name.endswith(".queue"):
+                continue
+            try:
+                user = bytes.fromhex(name[:-len(".queue")]).decode("utf-8")
+            except ValueError:
+                continue
+            messages = self.read_spilled(user)
+            if not messages:
+                continue
+            self.queues[user] = {
+                "memory": [], "memory-bytes": 0,
+                "spilled": len(messages), "spilled-bytes": sum(self.message_size(message) for message in messages),
+                "oldest": messages[0]["time"]
+            }
+            self.last_id = max(self.last_id, messages[-1]["id"])
+            self.schedule_expiry(user, messages[0]["time"])
+
+    def message_size(self, message):
+        return len(message["sealed"]) + len(message["from"])
+
+    def enqueue(self, recipient, sender, sealed_message):
+        """Guarda a mensagem e retorna (resposta, mensagem na fila); a mensagem é None se recusada."""
+        if len(sealed_message) > OFFLINE_MAX_MESSAGE_SIZE:
+            return self.reject(recipient, f"Mensagem excede o limite de {OFFLINE_MAX_MESSAGE_SIZE} bytes"), None
+
+        with self.lock:
+            self.drop_expired(recipient)
+            message = {"id": max(self.last_id + 1, time.time_ns()), "from": sender, "sealed": sealed_message, "time": time.time()}
+            queue = self.queues.setdefault(recipient, {"memory": [], "memory-bytes": 0, "spilled": 0, "spilled-bytes": 0,
+                                                       "oldest": message["time"]})
+            size = self.message_size(message)
+            if (len(queue["memory"]) + queue["spilled"] >= self.max_messages or
+                    queue["memory-bytes"] + queue["spilled-bytes"] + size > self.max_bytes):
+                full = True
+            else:
+                full = False
+                self.last_id = message["id"]
+                # Depois que uma mensagem foi para o disco, as seguintes também vão, para manter a ordem
+                if (queue["spilled"] or queue["memory-bytes"] + size > self.memory_per_user or
+                        self.memory_bytes + size > self.memory_total):
+                    self.append_spilled(recipient, [message])
+                    queue["spilled"] += 1
+                    queue["spilled-bytes"] += size
+                    self.stats["spilled"] += 1
+                else:
+                    queue["memory"].append(message)
+                    queue["memory-bytes"] += size
+                    self.memory_bytes += size
+                self.stats["queued"] += 1
+                if len(queue["memory"]) + queue["spilled"] == 1:
+                    self.schedule_expiry(recipient, message["time"])
+
+        if full:
+            return self.reject(recipient, f"A caixa de mensagens de {recipient} está cheia"), None
+        logger.info("Mensagem offline de '%s' para '%s' na fila", sender, recipient, category="offline", size=size)
+        return {"status": "ok", "message": f"Mensagem guardada até {recipient} entrar"}, message
+
+    def reject(self, recipient, reason):
+        with self.lock:
+            self.stats["rejected"] += 1
+        logger.info("Mensagem offline para '%s' recusada: %s", recipient, reason, category="offline")
+        return {"status": "error", "message": reason}
+
+    def pending(self, user):
+        """Mensagens aguardando o usuário, das mais antigas para as mais novas (sem removê-las)."""
+        with self.lock:
+            self.drop_expired(user)
+            queue = self.queues.get(user)
+            if queue is None:
+                return []
+            messages = list(queue["memory"])
+            if queue["spilled"]:
+                messages.extend(self.read_spilled(user))
+            return messages
+
+    def acknowledge(self, user, last_id, ids=None):
+        """Remove as mensagens entregues: as de ids, se informados, ou todas até last_id inclusive.
+
+        Com ids, uma mensagem nova empurrada ao peer não confirma outra, mais antiga, cujo
+        evento foi descartado no caminho.
+        """
+        acknowledged = set(ids) if ids is not None else None
+        with self.lock:
+            queue = self.queues.get(user)
+            if queue is None:
+                return {"status": "ok", "removed": 0}
+            if acknowledged is None:
+                removed = self.remove_messages(user, queue, lambda message: message["id"] <= last_id)
+            else:
+                removed = self.remove_messages(user, queue, lambda message: message["id"] in acknowledged)
+            self.stats["delivered"] += removed
+        return {"status": "ok", "removed": removed}
+
+    def remove_messages(self, user, queue, should_remove):
+        # Deve ser chamada com self.lock adquirido
+        kept = [message for message in queue["memory"] if not should_remove(message)]
+        removed = len(queue["memory"]) - len(kept)
+        kept_bytes = sum(self.message_size(message) for message in kept)
+        self.memory_bytes -= queue["memory-bytes"] - kept_bytes
+        queue["memory"], queue["memory-bytes"] = kept, kept_bytes
+
+        if queue["spilled"]:
+            spilled = self.read_spilled(user)
+            kept_spilled = [message for message in spilled if not should_remove(message)]
+            removed += len(spilled) - len(kept_spilled)
+            if len(kept_spilled) != len(spilled):
+                self.rewrite_spilled(user, kept_spilled)
+            queue["spilled"] = len(kept_spilled)
+            queue["spilled-bytes"] = sum(self.message_size(message) for message in kept_spilled)
+            if kept_spilled:
+                queue["oldest"] = kept_spilled[0]["time"]
+
+        if queue["memory"]:
+            queue["oldest"] = queue["memory"][0]["time"]
+        elif not queue["spilled"]:
+            del self.queues[user]
+            self.expiry_scheduler.cancel(("offline", user))
+        return removed
+
+    def drop_expired(self, user):
+        # Deve ser chamada com self.lock adquirido
+        queue = self.queues.get(user)
+        deadline = time.time() - self.ttl
+        if queue is None or queue["oldest"] >= deadline:
+            return
+        expired = self.remove_messages(user, queue, lambda message: message["time"] < deadline)
+        if expired:
+            self.stats["expired"] += expired
+            logger.info("%d mensagem(ns) offline para '%s' expiraram", expired, user, category="offline")
+
+    def schedule_expiry(self, user, oldest_time):
+        self.expiry_scheduler.schedule(("offline", user), oldest_time + self.ttl, self.expire_queue)
+
+    def expire_queue(self, key):
+        _, user = key
+        with self.lock:
+            self.drop_expired(user)
+            queue = self.queues.get(user)
+            if queue is None:
+                return
+            self.schedule_expiry(user, queue["oldest"])
+
+    def read_spilled(self, user):
+        try:
+            with open(self.spill_path(user), "r") as f:
+                messages = []
+                for line in f:
+                    try:
+                        messages.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break # Última linha incompleta de uma escrita interrompida
+                return messages
+        except FileNotFoundError:
+            return []
+
+    def append_spilled(self, user, messages):
+        # O remetente só ouve "guardada" depois do fsync
+        with open(self.spill_path(user), "a") as f:
+            f.write("".join(json.dumps(message, separators=(",", ":")) + "\n" for message in messages))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def rewrite_spilled(self, user, messages):
+        path = self.spill_path(user)
+        if not messages:
+            os.remove(path)
+            return
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write("".join(json.dumps(message, separators=(",", ":")) + "\n" for message in messages))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+    def save_queues(self):
+        """Grava no disco as mensagens que estão só em memória (no encerramento do tracker)."""
+        with self.lock:
+            for user, queue in self.queues.items():
+                if not queue["memory"]:
+                    continue
+                # As da memória são as mais antigas e vêm antes das que já estão no arquivo
+                self.rewrite_spilled(user, queue["memory"] + self.read_spilled(user))
+                queue["spilled"] += len(queue["memory"])
+                queue["spilled-bytes"] += queue["memory-bytes"]
+                self.memory_bytes -= queue["memory-bytes"]
+                queue["memory"], queue["memory-bytes"] = [], 0
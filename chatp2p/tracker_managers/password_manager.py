@@ -0,0 +1,72 @@
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.encrypt_utils import hash_password, verify_password, password_needs_rehash, PASSWORD_OPSLIMIT, PASSWORD_MEMLIMIT
+from utils.throttle_utils import Rate_limiter
+
+PASSWORD_WORKERS = min(4, os.cpu_count() or 1)
+# Hashes na fila do pool antes de recusar novos logins. A fila cheia espera max_pending / workers
+# hashes (alguns segundos sob carga), bem abaixo do TRACKER_KDF_TIMEOUT do cliente
+PASSWORD_MAX_PENDING = 64
+PASSWORD_RATE = 1.0       # Logins e cadastros por segundo por endereço, depois do burst
+PASSWORD_BURST = 10
+
+class Password_pool_busy(Exception):
+    pass
+
+class Password_manager:
+    """Calcula e verifica os hashes de senha (argon2id) em um pool limitado de threads.
+
+    O argon2id leva dezenas de milissegundos e libera o GIL, então os logins rodam em
+    paralelo no pool, sem segurar os locks do User_manager. A memória do KDF fica limitada
+    a workers × memlimit; com mais de max_pending hashes em andamento o pedido é recusado,
+    e cada endereço tem seu próprio limite de tentativas.
+    """
+
+    def __init__(self, workers=PASSWORD_WORKERS, max_pending=PASSWORD_MAX_PENDING, opslimit=PASSWORD_OPSLIMIT,
+                 memlimit=PASSWORD_MEMLIMIT, rate=PASSWORD_RATE, burst=PASSWORD_BURST):
+        self.opslimit = opslimit
+        self.memlimit = memlimit
+        # Verificado no lugar do hash de um usuário que não existe, com o mesmo custo de KDF
+        self.dummy_hash = hash_password(os.urandom(16).hex(), opslimit, memlimit)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.throttle = Rate_limiter(rate, burst)
+        self.stats_lock = threading.Lock()
+        self.stats = {"hashed": 0, "verified": 0, "upgraded": 0, "busy": 0, "throttled": 0}
+
+    def allow(self, source):
+        """Consome uma tentativa do endereço; False se ele passou do limite."""
+        if self.throttle.allow(source):
+            return True
+        self.count("throttled")
+        return False
+
+    def hash(self, password):
+        self.count("hashed")
+        return self.run(hash_password, password, self.opslimit, self.memlimit)
+
+    def verify(self, password_hash, password):
+        self.count("verified")
+        return self.run(verify_password, password_hash, password)
+
+    def verify_unknown(self, password):
+        """Gasta o mesmo tempo de um verify para um usuário inexistente; sempre False."""
+        self.verify(self.dummy_hash, password)
+        return False
+
+    def needs_rehash(self, password_hash):
+        return password_needs_rehash(password_hash, self.opslimit, self.memlimit)
+
+    def run(self, function, *args):
+        # Bloqueia só a thread (ou o worker do motor asyncio) que atende este pedido
+        if not self.slots.acquire(blocking=False):
+            self.count("busy")
+            raise Password_pool_busy()
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
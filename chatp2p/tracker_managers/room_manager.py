@@ -1,34 +1,129 @@
-import threading, os, json, time
+import threading, time
+from utils.journal_utils import Journal
+from utils.log_utils import logger
 
 ROOM_DATA_FILE = "data_storage/rooms.json"
+MODERATOR_INACTIVITY_TIMEOUT = 60
+
+# Como os peers de uma sala se conectam entre si (ver peer.py)
+ROOM_TOPOLOGY_MESH = "mesh"
+ROOM_TOPOLOGY_OVERLAY = "overlay"
+ROOM_TOPOLOGIES = (ROOM_TOPOLOGY_MESH, ROOM_TOPOLOGY_OVERLAY)
+
+# Eventos enviados pelo tracker aos peers que estão dentro de uma sala
+EVENT_MEMBER_ONLINE = "member-online"
+EVENT_MEMBER_OFFLINE = "member-offline"
+EVENT_ROOM_CLOSED = "room-closed"
 
 class Room_manager:
-    def __init__(self):
-        self.chat_rooms = self.load_rooms()
+    def __init__(self, expiry_scheduler, on_room_event=None):
         self.lock = threading.Lock()
+        self.expiry_scheduler = expiry_scheduler
+        # on_room_event(evento, sala, usuário, destinatários, motivo) é chamado fora do lock
+        self.on_room_event = on_room_event
+        self.journal = Journal(ROOM_DATA_FILE, self.apply_journal_entry, self.lock, self.serialize_rooms, self.deserialize_rooms)
+        self.chat_rooms = self.journal.load()
+        self.journal.start()
+
+        # Índices reversos (usuário -> salas) para não percorrer todas as salas a cada chamada
+        self.member_rooms = {}
+        self.present_rooms = {}
+        self.moderator_rooms = {}
+        for room_name, room in self.chat_rooms.items():
+            self.index_new_room(room_name, room)
+            self.schedule_expiry(room_name, room.get("mod-last-seen", time.time()))
+
+    def index_room(self, index, user, room_name):
+        index.setdefault(user, {})[room_name] = None
+
+    def unindex_room(self, index, user, room_name):
+        rooms = index.get(user)
+        if rooms is not None:
+            rooms.pop(room_name, None)
+            if not rooms:
+                del index[user]
+
+    def index_new_room(self, room_name, room):
+        self.index_room(self.moderator_rooms, room["moderator"], room_name)
+        for member in room["members"]:
+            self.index_room(self.member_rooms, member, room_name)
+        for member in room["in-room"]:
+            self.index_room(self.present_rooms, member, room_name)
+
+    def unindex_closed_room(self, room_name, room):
+        self.unindex_room(self.moderator_rooms, room["moderator"], room_name)
+        for member in room["members"]:
+            self.unindex_room(self.member_rooms, member, room_name)
+        for member in room["in-room"]:
+            self.unindex_room(self.present_rooms, member, room_name)
 
-    def load_rooms(self):
-        if os.path.exists(ROOM_DATA_FILE):
-            try:
-                with open(ROOM_DATA_FILE, "r") as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print("Erro ao carregar usuários")
-                return {}
-        return {}
+    # Em memória, "members" e "in-room" são dicts usados como conjuntos ordenados (pertinência O(1));
+    # só viram listas na hora de persistir ou responder
+    def serialize_rooms(self):
+        return {
+            room_name: {**room, "members": list(room["members"]), "in-room": list(room["in-room"])}
+            for room_name, room in self.chat_rooms.items()
+        }
+
+    def deserialize_rooms(self, chat_rooms):
+        for room in chat_rooms.values():
+            room["members"] = dict.fromkeys(room["members"])
+            room["in-room"] = dict.fromkeys(room.get("in-room", []))
+        return chat_rooms
+
+    def apply_journal_entry(self, chat_rooms, entry):
+        room = chat_rooms.get(entry.get("room"))
+        match entry["op"]:
+            case "create-room":
+                chat_rooms[entry["room"]] = {
+                    "moderator": entry["moderator"],
+                    "mod-last-seen": entry["mod-last-seen"],
+                    "topology": entry.get("topology", ROOM_TOPOLOGY_MESH),
+                    "members": {entry["moderator"]: None},
+                    "in-room": {}
+                }
+            case "close-room":
+                chat_rooms.pop(entry["room"], None)
+            case "add-member":
+                if room is not None:
+                    room["members"][entry["user"]] = None
+            case "remove-member":
+                if room is not None:
+                    room["members"].pop(entry["user"], None)
+                    room["in-room"].pop(entry["user"], None)
+            case "join-room":
+                if room is not None:
+                    room["in-room"][entry["user"]] = None
+            case "leave-room":
+                if room is not None:
+                    room["in-room"].pop(entry["user"], None)
+            case "leave-all-rooms":
+                for room_name in entry.get("rooms", list(chat_rooms)):
+                    room = chat_rooms.get(room_name)
+                    if room is not None:
+                        room["in-room"].pop(entry["user"], None)
     
     def save_rooms(self):
-        with open(ROOM_DATA_FILE, "w") as f:
-            json.dump(self.chat_rooms, f, indent=4)
+        self.journal.compact()
+
+    def notify(self, events):
+        if self.on_room_event:
+            for event in events:
+                self.on_room_event(*event)
+
+    def present_users(self, room_name, excluding=None):
+        return [member for member in self.chat_rooms[room_name]["in-room"] if member != excluding]
 
     def list_rooms(self):
         with self.lock:
             room_list = list(self.chat_rooms.keys())
             return {"status": "ok", "room-list": room_list}
     
-    def create_room(self, room_name, creator):
+    def create_room(self, room_name, creator, topology=ROOM_TOPOLOGY_MESH):
         if not room_name:
             return {"status": "error", "message": "Nome da sala não pode ser vazio"}
+        if topology not in ROOM_TOPOLOGIES:
+            return {"status": "error", "message": f"Topologia inválida: {topology}"}
         
         with self.lock:
             if room_name in self.chat_rooms:
@@ -37,13 +132,18 @@ class Room_manager:
             self.chat_rooms[room_name] = {
                 "moderator": creator,
                 "mod-last-seen": time.time(),
-                "members": [creator],
-                "in-room": []
+                "topology": topology,
+                "members": {creator: None},
+                "in-room": {}
             }
-            self.save_rooms()
+            self.index_new_room(room_name, self.chat_rooms[room_name])
+            self.journal.append({"op": "create-room", "room": room_name, "moderator": creator,
+                                 "mod-last-seen": self.chat_rooms[room_name]["mod-last-seen"], "topology": topology})
+            self.schedule_expiry(room_name, self.chat_rooms[room_name]["mod-last-seen"])
             return {"status": "ok", "message": f"Sala '{room_name}' criada com sucesso"}
     
     def join_room(self, room_to_join, user):
+        events = []
         with self.lock:
             if room_to_join not in self.chat_rooms:
                 return {"status": "error", "message": "Sala não encontrada"}
@@ -53,18 +153,18 @@ class Room_manager:
             
             # INÍCIO DA ALTERAÇÃO: Adiciona o usuário na lista de membros ativos ('in-room')
             if user not in self.chat_rooms[room_to_join]["in-room"]:
-                self.chat_rooms[room_to_join]["in-room"].append(user)
-                self.save_rooms()
+                events.append((EVENT_MEMBER_ONLINE, room_to_join, user, self.present_users(room_to_join), "joined"))
+                self.chat_rooms[room_to_join]["in-room"][user] = None
+                self.index_room(self.present_rooms, user, room_to_join)
+                self.journal.append({"op": "join-room", "room": room_to_join, "user": user})
             # FIM DA ALTERAÇÃO
-            
-            return {"status": "ok", "message": f"O usuário {user} entrou na sala"}
+
+        self.notify(events)
+        return {"status": "ok", "message": f"O usuário {user} entrou na sala"}
 
     def list_my_rooms(self, user):
         with self.lock:
-            my_rooms = [
-                room_name for room_name, room_data in self.chat_rooms.items()
-                if room_data["moderator"] == user
-            ]
+            my_rooms = list(self.moderator_rooms.get(user, ()))
             return {"status": "ok", "rooms": my_rooms}
     
     def list_members(self, room_name):
@@ -75,7 +175,7 @@ class Room_manager:
             room = self.chat_rooms[room_name]
             return {
                 "status": "ok",
-                "members": room["members"],
+                "members": list(room["members"]),
                 "moderator": room["moderator"]
             }
     
@@ -95,9 +195,10 @@ class Room_manager:
             if user_to_add not in users:
                 return {"status": "error", "message": "Esse usuário não existe"}
             
-            room["members"].append(user_to_add)
-            self.save_rooms()
-            return {"Status": "ok", "message": f"Usuário {user_to_add} adicionado à sala"}
+            room["members"][user_to_add] = None
+            self.index_room(self.member_rooms, user_to_add, room_name)
+            self.journal.append({"op": "add-member", "room": room_name, "user": user_to_add})
+            return {"status": "ok", "message": f"Usuário {user_to_add} adicionado à sala"}
         
     def remove_member(self, room_name, user_to_remove, moderator):
         with self.lock:
@@ -112,24 +213,34 @@ class Room_manager:
             if user_to_remove == room["moderator"]:
                 return {"status": "error", "message": "Moderador não pode ser removido"}
 
-            if user_to_remove in room["members"]:
-                room["members"].remove(user_to_remove)
-                if user_to_remove in room["in-room"]:
-                    room["in-room"].remove(user_to_remove)
-                self.save_rooms()
-                return {"status": "ok", "message": f"Usuário {user_to_remove} removido da sala"}
-            
-            return {"status": "ok", "message": "Usuário não encontrado"}
+            if user_to_remove not in room["members"]:
+                return {"status": "ok", "message": "Usuário não encontrado"}
+
+            del room["members"][user_to_remove]
+            self.unindex_room(self.member_rooms, user_to_remove, room_name)
+            events = []
+            if user_to_remove in room["in-room"]:
+                # O próprio removido também recebe o evento, para sair da sala
+                events.append((EVENT_MEMBER_OFFLINE, room_name, user_to_remove, self.present_users(room_name), "removed"))
+                del room["in-room"][user_to_remove]
+                self.unindex_room(self.present_rooms, user_to_remove, room_name)
+            self.journal.append({"op": "remove-member", "room": room_name, "user": user_to_remove})
+
+        self.notify(events)
+        return {"status": "ok", "message": f"Usuário {user_to_remove} removido da sala"}
 
     # INÍCIO DA ALTERAÇÃO: Nova função para um peer notificar que está saindo da sala
     def leave_room(self, room_name, user):
+        events = []
         with self.lock:
-            if room_name in self.chat_rooms and user in self.chat_rooms[room_name].get("in-room", []):
-                self.chat_rooms[room_name]["in-room"].remove(user)
-                self.save_rooms()
-                return {"status": "ok", "message": "Você saiu da sala."}
-            # Não retorna erro se a sala ou usuário não for encontrado, para evitar problemas de estado inconsistente
-            return {"status": "ok", "message": "Você saiu da sala."}
+            if room_name in self.chat_rooms and user in self.chat_rooms[room_name]["in-room"]:
+                del self.chat_rooms[room_name]["in-room"][user]
+                self.unindex_room(self.present_rooms, user, room_name)
+                self.journal.append({"op": "leave-room", "room": room_name, "user": user})
+                events.append((EVENT_MEMBER_OFFLINE, room_name, user, self.present_users(room_name), "left"))
+        self.notify(events)
+        # Não retorna erro se a sala ou usuário não for encontrado, para evitar problemas de estado inconsistente
+        return {"status": "ok", "message": "Você saiu da sala."}
     # FIM DA ALTERAÇÃO
 
     # INÍCIO DA ALTERAÇÃO: Nova função para obter a lista de membros online (in-room) de uma sala
@@ -142,36 +253,42 @@ class Room_manager:
                 member for member in self.chat_rooms[room_name]["in-room"]
                 if member != requesting_user
             ]
-            return {"status": "ok", "online-members": online_members}
+            topology = self.chat_rooms[room_name].get("topology", ROOM_TOPOLOGY_MESH)
+            return {"status": "ok", "online-members": online_members, "topology": topology}
     # FIM DA ALTERAÇÃO
 
     # INÍCIO DA ALTERAÇÃO: Nova função para remover um usuário de todas as listas 'in-room' ao desconectar
     def remove_user_from_all_rooms(self, user):
+        events = []
         with self.lock:
-            for room_name in self.chat_rooms:
-                if user in self.chat_rooms[room_name].get("in-room", []):
-                    self.chat_rooms[room_name]["in-room"].remove(user)
-            self.save_rooms()
+            rooms = list(self.present_rooms.pop(user, ()))
+            for room_name in rooms:
+                del self.chat_rooms[room_name]["in-room"][user]
+                events.append((EVENT_MEMBER_OFFLINE, room_name, user, self.present_users(room_name), "disconnected"))
+            if rooms:
+                self.journal.append({"op": "leave-all-rooms", "user": user, "rooms": rooms})
+        self.notify(events)
     # FIM DA ALTERAÇÃO
     
     def update_mod_heartbeat(self, user):
-        for room in self.chat_rooms.values():
-            if room["moderator"] == user:
-                room["mod-last-seen"] = time.time()
-    
-    def monitor_rooms(self):
-        while True:
-            time.sleep(10)
+        with self.lock:
             now = time.time()
-            to_close = []
+            for room_name in self.moderator_rooms.get(user, ()):
+                self.chat_rooms[room_name]["mod-last-seen"] = now
+                self.schedule_expiry(room_name, now)
 
-            for room_name, room in self.chat_rooms.items():
-                if now - room.get("mod-last-seen", now) > 60:
-                    print(f"Fechando sala {room_name} por inatividade do moderador")
-                    to_close.append(room_name)
-            
-            for room_name in to_close:
-                self.close_room(room_name, self.chat_rooms[room_name]["moderator"])
+    def schedule_expiry(self, room_name, mod_last_seen):
+        self.expiry_scheduler.schedule(("room", room_name), mod_last_seen + MODERATOR_INACTIVITY_TIMEOUT, self.expire_room)
+
+    def expire_room(self, key):
+        _, room_name = key
+        with self.lock:
+            if room_name not in self.chat_rooms:
+                return
+            moderator = self.chat_rooms[room_name]["moderator"]
+
+        logger.info("Fechando sala %s por inatividade do moderador", room_name)
+        self.close_room(room_name, moderator)
     
     def close_room(self, room_name, moderator):
         with self.lock:
@@ -183,6 +300,11 @@ class Room_manager:
             if room["moderator"] != moderator:
                 return {"status": "error", "message": "Apenas o moderador pode fechar a sala"}
 
+            recipients = self.present_users(room_name)
             del self.chat_rooms[room_name]
-            self.save_rooms()
-            return {"status": "ok", "message": f"A sala {room_name} foi fechada"}
\ No newline at end of file
+            self.unindex_closed_room(room_name, room)
+            self.expiry_scheduler.cancel(("room", room_name))
+            self.journal.append({"op": "close-room", "room": room_name})
+
+        self.notify([(EVENT_ROOM_CLOSED, room_name, moderator, recipients, "closed")])
+        return {"status": "ok", "message": f"A sala {room_name} foi fechada"}
\ No newline at end of file
@@ -0,0 +1,35 @@
+import threading
+from nacl.exceptions import CryptoError
+
+# Requisições que não decifram (frame adulterado) ou sem os campos esperados encerram a sessão
+INVALID_REQUEST_ERRORS = (CryptoError, KeyError, AttributeError, TypeError)
+
+class Tracker_session:
+    """Estado de uma conexão de peer com o tracker, independente do motor (threads ou asyncio)."""
+
+    def __init__(self, address, peer_conec):
+        self.address = address
+        self.peer_conec = peer_conec
+        self.user = None
+        self.peer_public_key = None
+        self.peer_public_key_str = None
+        self.cipher = None
+        self.envelope = 0 # Versão do envelope binário negociada no handshake (0 = formato legado)
+        self.compression = None
+        self.send_lock = threading.Lock()
+        self.push_handler = None # Definido pelo motor: entrega uma mensagem não solicitada ao peer
+        self.push_lock = threading.Lock()
+        self.push_queue = None # Motor com threads: eventos esperando a thread de envio da sessão
+        self.state_id = None # Id da sessão no processo de estado (tracker com --workers)
+
+    def push(self, message):
+        """Envia um evento ao peer fora do fluxo requisição/resposta; pode ser chamado de qualquer thread."""
+        if self.push_handler is None or self.cipher is None:
+            return
+        try:
+            self.push_handler(message)
+        except OSError:
+            pass # A thread/corrotina da sessão trata a conexão perdida
+
+    def describe(self):
+        return self.user if self.user else str(self.address)
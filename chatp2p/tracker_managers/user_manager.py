@@ -1,45 +1,90 @@
-import threading, json, os, time
-from utils.encrypt_utils import hash_password
+import threading, time
+from tracker_managers.password_manager import Password_manager, Password_pool_busy
+from utils.journal_utils import Journal
+from utils.log_utils import logger
 
 USER_DATA_FILE = "data_storage/users.json"
+USER_INACTIVITY_TIMEOUT = 60
+
+BUSY_RESPONSE = {"status": "error", "message": "Servidor ocupado, tente novamente em instantes"}
 
 class User_manager:
-    def __init__(self):
-        self.users = self.load_users()
-        self.active_peers = {}
+    def __init__(self, expiry_scheduler, on_user_expired=None, password_manager=None):
+        self.expiry_scheduler = expiry_scheduler
+        self.on_user_expired = on_user_expired
+        self.password_manager = password_manager or Password_manager()
         self.users_lock = threading.Lock()
+        self.registering = set() # Nomes reservados enquanto o hash do cadastro é calculado
         self.active_peers_lock = threading.Lock()
-    
-    def load_users(self):
-        if os.path.exists(USER_DATA_FILE):
-            try:
-                with open(USER_DATA_FILE, "r") as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print("Erro ao carregar usuários")
-                return {}
-        return {}
+        self.journal = Journal(USER_DATA_FILE, self.apply_journal_entry, self.users_lock,
+                               lambda: {user: dict(data) for user, data in self.users.items()})
+        self.users = self.journal.load()
+        self.journal.start()
+        self.active_peers = {}
+
+    def apply_journal_entry(self, users, entry):
+        match entry["op"]:
+            case "register":
+                users[entry["user"]] = {"password": entry["password"]}
+            case "unregister":
+                users.pop(entry["user"], None)
+            case "password":
+                if entry["user"] in users:
+                    users[entry["user"]]["password"] = entry["password"]
+            case "mailbox-key":
+                if entry["user"] in users:
+                    users[entry["user"]]["mailbox-key"] = entry["key"]
 
     def save_users(self):
-        with open(USER_DATA_FILE, "w") as f:
-            json.dump(self.users, f, indent=4)
+        self.journal.compact()
  
     def register(self, user, password):
         with self.users_lock:
-            if user in self.users:
+            if user in self.users or user in self.registering:
                 return {"status": "error", "message": "Nome de usuário já existente"}
+            self.registering.add(user)
+
+        # O KDF roda no pool, sem segurar users_lock
+        try:
+            password_hash = self.password_manager.hash(password)
+        except Password_pool_busy:
+            password_hash = None
 
+        with self.users_lock:
+            self.registering.discard(user)
+            if password_hash is None:
+                return dict(BUSY_RESPONSE)
             self.users[user] = {
-                "password": hash_password(password)
+                "password": password_hash
             }
-            self.save_users()
-            return {"status": "ok", "message": "Usuário registrado com sucesso!"}
+            seq = self.journal.append({"op": "register", "user": user, "password": password_hash})
+
+        # Só confirma o cadastro depois do fsync, mas sem segurar o lock durante a espera
+        if not self.journal.wait_durable(seq):
+            # Sem a confirmação do disco o cadastro é desfeito, para não sumir num reinício
+            # depois de o cliente ter ouvido que deu certo
+            with self.users_lock:
+                if self.users.get(user, {}).get("password") == password_hash:
+                    del self.users[user]
+                    self.journal.append({"op": "unregister", "user": user})
+            return {"status": "error", "message": "Não foi possível gravar o cadastro, tente novamente mais tarde"}
+        return {"status": "ok", "message": "Usuário registrado com sucesso!"}
     
-    def login(self, user, password, address, peer_server_port, peer_public_key, peer_conec):
+    def login(self, user, password, address, peer_server_port, peer_public_key, peer_conec, envelope=0, signing_key=None):
         peer_ip, _ = address
         with self.users_lock:
-            if user not in self.users or self.users[user]["password"] != hash_password(password):
+            password_hash = self.users.get(user, {}).get("password")
+        try:
+            # Usuário inexistente também passa pelo argon2id: o tempo de resposta não revela quem está cadastrado
+            if password_hash is None:
+                self.password_manager.verify_unknown(password)
+                return {"status": "error", "message": "Usuário ou senha incorretos"}
+            if not self.password_manager.verify(password_hash, password):
                 return {"status": "error", "message": "Usuário ou senha incorretos"}
+            if self.password_manager.needs_rehash(password_hash):
+                self.upgrade_password(user, password_hash, password)
+        except Password_pool_busy:
+            return dict(BUSY_RESPONSE)
         
         with self.active_peers_lock:
             self.active_peers[user] = {
@@ -47,19 +92,53 @@ class User_manager:
                 "peer-port": peer_server_port,
                 "last-seen": time.time(),
                 "peer-public-key": peer_public_key,
-                "peer-conec": peer_conec
+                "peer-conec": peer_conec,
+                "envelope": envelope, # Versão do envelope binário que o peer aceita em conexões diretas
+                "signing-key": signing_key # Chave com que o peer assina anúncios e mensagens em salas overlay
             }
+            self.schedule_expiry(user, self.active_peers[user]["last-seen"])
         
         return {"status": "ok", "message": "Login bem-sucedido", "usr": user}
     
+    def upgrade_password(self, user, old_hash, password):
+        """Refaz com o KDF atual um hash antigo (SHA-256 ou parâmetros menores), já com a senha verificada."""
+        try:
+            new_hash = self.password_manager.hash(password)
+        except Password_pool_busy:
+            return # Fica para o próximo login
+        with self.users_lock:
+            # Outro login pode ter migrado a senha enquanto o hash era calculado
+            if self.users.get(user, {}).get("password") != old_hash:
+                return
+            self.users[user]["password"] = new_hash
+            self.journal.append({"op": "password", "user": user, "password": new_hash})
+        self.password_manager.count("upgraded")
+        logger.info("Hash de senha de '%s' migrado para o formato atual", user, category="senha")
+
     def logout(self, user):
         with self.active_peers_lock:
             if user in self.active_peers:
                 del self.active_peers[user]
-                print(f"Usuário {user} desconectado")
+                self.expiry_scheduler.cancel(("user", user))
+                logger.info("Usuário %s desconectado", user, category="logout")
                 return {"status": "ok", "message": "Logout bem-sucedido"}
             return {"status": "error", "message": "Usuário não estava logado"}
     
+    def set_mailbox_key(self, user, mailbox_key):
+        """Guarda a chave pública de longo prazo para a qual as mensagens offline do usuário são cifradas."""
+        with self.users_lock:
+            if user not in self.users or self.users[user].get("mailbox-key") == mailbox_key:
+                return
+            self.users[user]["mailbox-key"] = mailbox_key
+            self.journal.append({"op": "mailbox-key", "user": user, "key": mailbox_key})
+
+    def get_mailbox_key(self, user):
+        with self.users_lock:
+            mailbox_key = self.users.get(user, {}).get("mailbox-key")
+        if mailbox_key is None:
+            return {"status": "error", "message": "Usuário não existe ou não pode receber mensagens offline"}
+        return {"status": "ok", "mailbox-key": mailbox_key}
+
     def list_active_peers(self, requesting_user):
         with self.active_peers_lock:
             peer_list = [peer for peer in self.active_peers.keys() if peer != requesting_user]
@@ -69,10 +148,16 @@ class User_manager:
         with self.active_peers_lock:
             if user_to_connect in self.active_peers:
                 user_info = self.active_peers[user_to_connect]
-                return {"status": "ok", "user-ip": user_info["peer-ip"], "user-port": user_info["peer-port"], "peer-public-key": user_info["peer-public-key"]}
+                return {"status": "ok", "user-ip": user_info["peer-ip"], "user-port": user_info["peer-port"], "peer-public-key": user_info["peer-public-key"], "envelope": user_info["envelope"],
+                        "signing-key": user_info.get("signing-key")}
             else:
                 return {"status": "error", "message": "Usuário não está ativo ou não existe"}
     
+    def get_session(self, user):
+        with self.active_peers_lock:
+            user_info = self.active_peers.get(user)
+            return user_info["peer-conec"] if user_info else None
+
     def list_peers_to_connect(self, user):
         with self.active_peers_lock:
             peers_to_connect = self.active_peers.copy()
@@ -85,5 +170,25 @@ class User_manager:
         with self.active_peers_lock:
             if user in self.active_peers:
                 self.active_peers[user]["last-seen"] = time.time()
+                self.schedule_expiry(user, self.active_peers[user]["last-seen"])
                 return {"status": "ok", "message": f"heartbeat recebido de {user}"}
-    
\ No newline at end of file
+            return {"status": "error", "message": "Usuário não está logado"}
+
+    def schedule_expiry(self, user, last_seen):
+        self.expiry_scheduler.schedule(("user", user), last_seen + USER_INACTIVITY_TIMEOUT, self.expire_user)
+
+    def expire_user(self, key):
+        _, user = key
+        with self.active_peers_lock:
+            if user not in self.active_peers:
+                return
+            last_seen = self.active_peers[user]["last-seen"]
+            if time.time() - last_seen <= USER_INACTIVITY_TIMEOUT:
+                # Heartbeat chegou enquanto o prazo vencia
+                self.schedule_expiry(user, last_seen)
+                return
+
+        logger.info("Detectado usuário inativo: %s", user)
+        self.logout(user)
+        if self.on_user_expired:
+            self.on_user_expired(user)
@@ -0,0 +1,263 @@
+import itertools, os, pickle, queue, socket, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from utils.framing_utils import encode_frame, recv_frame
+from utils.log_utils import logger
+
+# Mensagens entre workers e processo de estado (tuplas serializadas com pickle em frames):
+#   worker -> estado: ("open", sessão, endereço, chave pública), ("request", id, sessão, cmd, requisição), ("close", sessão)
+#   estado -> worker: ("response", id, resposta, usuário), ("error", id, motivo), ("push", sessão, evento)
+
+LINK_QUEUE_SIZE = 4096 # Mensagens esperando a thread de escrita de um link com worker
+LINK_SEND_TIMEOUT = 5  # Segundos que uma resposta espera vaga na fila antes de o worker ser desconectado
+
+class Remote_session:
+    """Sessão de um peer atendido por um worker, vista pelo processo de estado.
+
+    Tem os campos de Tracker_session que o processamento de comandos usa; os eventos
+    empurrados pelo tracker voltam ao worker, que cifra e entrega ao peer.
+    """
+
+    def __init__(self, link, session_id, address, peer_public_key_str):
+        self.link = link
+        self.session_id = session_id
+        self.address = address
+        self.peer_public_key_str = peer_public_key_str
+        self.user = None
+        self.compression = None # A compressão fica no worker
+        # O close só encerra a sessão depois dos comandos dela que ainda estão no executor
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.closed = False
+
+    def push(self, message):
+        try:
+            self.link.send(("push", self.session_id, message), droppable=True)
+        except OSError:
+            pass # O worker caiu; suas sessões são encerradas por serve_link
+
+    def describe(self):
+        return self.user if self.user else str(self.address)
+
+class Worker_link:
+    """Conexão do processo de estado com um worker.
+
+    Quem envia (threads do executor, eventos de qualquer sessão) só enfileira; uma thread por
+    link escreve no socket, de forma que um worker lento não trava os outros.
+    """
+
+    def __init__(self, link_socket):
+        self.socket = link_socket
+        self.sessions = {} # id da sessão no worker -> Remote_session
+        self.outbound = queue.Queue(maxsize=LINK_QUEUE_SIZE)
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def send(self, message, droppable=False):
+        """Enfileira a mensagem; com a fila cheia, eventos são descartados e respostas esperam LINK_SEND_TIMEOUT."""
+        try:
+            if droppable:
+                self.outbound.put_nowait(message)
+            else:
+                self.outbound.put(message, timeout=LINK_SEND_TIMEOUT)
+        except queue.Full:
+            if droppable:
+                logger.warning("Evento para um worker descartado: link com a fila cheia", category="push-descartado")
+                return
+            # O worker não lê o link: desconectá-lo encerra suas sessões e ele é reiniciado
+            logger.error("Worker não está lendo o link com o processo de estado; desconectando")
+            self.close()
+            raise ConnectionResetError("Link com o worker parado")
+
+    def write_loop(self):
+        while True:
+            message = self.outbound.get()
+            if message is None:
+                return
+            try:
+                self.socket.sendall(encode_frame(pickle.dumps(message, pickle.HIGHEST_PROTOCOL)))
+            except OSError:
+                return # serve_link encerra as sessões do worker
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.outbound.put_nowait(None)
+        except queue.Full:
+            pass # A thread de escrita sai quando o próximo envio falhar
+
+class Worker_manager:
+    """Lado do processo de estado no modo com vários workers (--workers N).
+
+    Os workers aceitam os peers na porta do tracker, fazem o handshake, cifram, decifram e
+    tratam o JSON; cada comando já decifrado chega aqui por um socket Unix e é executado
+    pelo Tracker deste processo, o único dono de usuários, salas, fila offline e heartbeats.
+    Assim get-peer-addr e get-room-members enxergam os mesmos dados em qualquer worker.
+    """
+
+    def __init__(self, tracker, socket_path, max_threads=128):
+        self.tracker = tracker
+        self.socket_path = socket_path
+        # Comandos podem bloquear (hash da senha, fsync do diário): não rodam na thread do link
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="estado")
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(socket_path)
+        self.listener.listen()
+
+    def start(self):
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                link_socket, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_link, args=(link_socket,), daemon=True).start()
+
+    def serve_link(self, link_socket):
+        link = Worker_link(link_socket)
+        try:
+            while True:
+                payload = recv_frame(link_socket)
+                if not payload:
+                    break
+                message = pickle.loads(payload)
+                match message[0]:
+                    case "open":
+                        _, session_id, address, peer_public_key_str = message
+                        link.sessions[session_id] = Remote_session(link, session_id, address, peer_public_key_str)
+                    case "request":
+                        _, request_id, session_id, cmd, peer_requisition = message
+                        session = link.sessions.get(session_id)
+                        if session is not None:
+                            with session.lock:
+                                session.pending += 1
+                            self.executor.submit(self.process_request, link, request_id, session, cmd, peer_requisition)
+                    case "close":
+                        session = link.sessions.pop(message[1], None)
+                        if session is not None:
+                            self.close_session(session)
+
+        except (ConnectionResetError, OSError, ValueError, pickle.UnpicklingError):
+            pass
+
+        finally:
+            logger.warning("Worker desconectado do processo de estado; encerrando %d sessão(ões)", len(link.sessions))
+            link.close()
+            link_socket.close()
+            for session in link.sessions.values():
+                self.close_session(session)
+
+    def close_session(self, session):
+        # Um login ainda no executor terminaria depois do end_session e deixaria o usuário
+        # online sem conexão: com comandos pendentes quem encerra é o último deles
+        with session.lock:
+            session.closed = True
+            idle = session.pending == 0
+        if idle:
+            self.executor.submit(self.tracker.end_session, session)
+
+    def process_request(self, link, request_id, session, cmd, peer_requisition):
+        try:
+            response = self.tracker.process_command(session, cmd, peer_requisition)
+            message = ("response", request_id, response, session.user)
+        except Exception as e:
+            # Requisição malformada (ex.: campo faltando): o worker encerra a conexão do peer
+            message = ("error", request_id, repr(e))
+        finally:
+            with session.lock:
+                session.pending -= 1
+                finished = session.closed and session.pending == 0
+            if finished:
+                self.tracker.end_session(session)
+        try:
+            link.send(message)
+        except OSError:
+            pass
+
+    def close(self):
+        self.listener.close()
+        self.executor.shutdown(wait=False)
+
+class State_link:
+    """Lado do worker: repassa os comandos ao processo de estado e recebe respostas e eventos.
+
+    Vários comandos podem estar em andamento ao mesmo tempo; cada resposta é casada pelo id.
+    """
+
+    def __init__(self, socket_path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.pending = {}  # id da requisição -> Future
+        self.sessions = {} # id da sessão -> Tracker_session, para entregar os eventos
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def send(self, message):
+        frame = encode_frame(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+        with self.send_lock:
+            self.socket.sendall(frame)
+
+    def open_session(self, session):
+        session.state_id = next(self.ids)
+        with self.lock:
+            self.sessions[session.state_id] = session
+        self.send(("open", session.state_id, session.address, session.peer_public_key_str))
+
+    def close_session(self, session):
+        with self.lock:
+            if self.sessions.pop(session.state_id, None) is None:
+                return
+        self.send(("close", session.state_id))
+
+    def request(self, session, cmd, peer_requisition):
+        """Executa o comando no processo de estado e retorna a resposta, atualizando session.user."""
+        request_id = next(self.ids)
+        future = Future()
+        with self.lock:
+            self.pending[request_id] = future
+        self.send(("request", request_id, session.state_id, cmd, peer_requisition))
+        response, session.user = future.result()
+        return response
+
+    def serve(self):
+        try:
+            while True:
+                payload = recv_frame(self.socket)
+                if not payload:
+                    break
+                message = pickle.loads(payload)
+                match message[0]:
+                    case "response":
+                        _, request_id, response, user = message
+                        with self.lock:
+                            future = self.pending.pop(request_id, None)
+                        if future is not None:
+                            future.set_result((response, user))
+                    case "error":
+                        _, request_id, reason = message
+                        with self.lock:
+                            future = self.pending.pop(request_id, None)
+                        if future is not None:
+                            future.set_exception(ValueError(reason))
+                    case "push":
+                        _, session_id, event = message
+                        with self.lock:
+                            session = self.sessions.get(session_id)
+                        # push só enfileira (fila por sessão no motor com threads, call_soon_threadsafe
+                        # no asyncio): um peer lento não segura as respostas das outras sessões
+                        if session is not None:
+                            session.push(event)
+
+        except (ConnectionResetError, OSError, ValueError, pickle.UnpicklingError):
+            pass
+
+        # Sem o processo de estado o worker não consegue atender ninguém: sai para o
+        # kernel parar de distribuir conexões para ele
+        logger.error("Conexão com o processo de estado perdida; encerrando worker %d", os.getpid())
+        logger.flush()
+        os._exit(1)
@@ -0,0 +1,135 @@
+import queue, socket, threading
+from utils.framing_utils import send_frame, recv_frame_with_kind, FRAME_MESSAGE, FRAME_GROUP, FRAME_FILE
+from utils.envelope_utils import seal_message, open_message, new_compression_context
+
+# O que fazer quando a fila de envio de um peer lento atinge o limite
+SLOW_PEER_DROP = "drop"             # descarta a mensagem nova e segue
+SLOW_PEER_DISCONNECT = "disconnect" # encerra a conexão com o peer
+SLOW_PEER_POLICIES = (SLOW_PEER_DROP, SLOW_PEER_DISCONNECT)
+
+class Secure_channel:
+    """Socket com framing e o cifrador negociado no handshake (sessão ou chave pública).
+
+    Por padrão os envios são síncronos. Depois de start_writer, cada envio só entra na fila
+    do canal e uma thread própria cifra e escreve no socket, de forma que um peer lento não
+    bloqueia quem envia.
+
+    envelope é a versão do envelope binário negociada no handshake (0 = formato legado) e
+    peer_public_key a chave pública com que o outro lado fez o handshake.
+    """
+
+    def __init__(self, sock, cipher, envelope=0, peer_public_key=None):
+        self.sock = sock
+        self.cipher = cipher
+        self.envelope = envelope
+        self.peer_public_key = peer_public_key
+        self.compression = new_compression_context(envelope)
+        self.send_lock = threading.Lock()
+        self.outbound = None
+        self.policy = SLOW_PEER_DISCONNECT
+        self.closed = False
+        self.stats = {"sent": 0, "dropped": 0, "bytes-sent": 0}
+
+    def start_writer(self, high_water=256, policy=SLOW_PEER_DISCONNECT):
+        if policy not in SLOW_PEER_POLICIES:
+            raise ValueError(f"Política inválida para peer lento: {policy}")
+        self.policy = policy
+        if self.outbound is not None:
+            return # Canal reaproveitado do pool já tem sua thread de escrita
+        self.outbound = queue.Queue(maxsize=high_water)
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def send_message(self, message):
+        if self.outbound is not None:
+            return self.enqueue((FRAME_MESSAGE, message))
+        # Cifrar e enviar sob o mesmo lock mantém os contadores da sessão em ordem no fio
+        with self.send_lock:
+            self.write_frame(FRAME_MESSAGE, message)
+        return True
+
+    def send_group_frame(self, sealed_message):
+        """Envia uma mensagem já cifrada com a chave de grupo, sem cifrar de novo para este canal."""
+        return self.send_sealed_frame(FRAME_GROUP, sealed_message)
+
+    def send_file_chunk(self, sealed_chunk):
+        """Envia um pedaço de arquivo já cifrado com a chave da transferência."""
+        return self.send_sealed_frame(FRAME_FILE, sealed_chunk)
+
+    def send_sealed_frame(self, kind, payload):
+        if self.outbound is not None:
+            return self.enqueue((kind, payload))
+        with self.send_lock:
+            self.write_frame(kind, payload)
+        return True
+
+    def write_frame(self, kind, payload):
+        if kind == FRAME_MESSAGE:
+            kind, payload = seal_message(self.cipher, payload, self.envelope, self.compression)
+        send_frame(self.sock, payload, kind)
+        self.stats["sent"] += 1
+        self.stats["bytes-sent"] += len(payload)
+
+    def enqueue(self, item):
+        """Coloca um envio na fila; retorna False se ele foi descartado pela política de peer lento."""
+        if self.closed:
+            raise BrokenPipeError("Canal encerrado")
+        try:
+            self.outbound.put_nowait(item)
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            if self.policy == SLOW_PEER_DROP:
+                return False
+            self.shutdown()
+            raise BrokenPipeError("Fila de envio cheia, peer desconectado")
+
+    def write_loop(self):
+        while True:
+            item = self.outbound.get()
+            if item is None:
+                break
+            try:
+                self.write_frame(*item)
+            except OSError:
+                break
+        self.shutdown()
+
+    def bytes_saved(self):
+        return self.compression.stats["bytes-saved"] if self.compression is not None else 0
+
+    def pending(self):
+        return self.outbound.qsize() if self.outbound is not None else 0
+
+    def recv_message(self):
+        kind, encrypted_data = recv_frame_with_kind(self.sock)
+        if not encrypted_data:
+            return None
+        if kind == FRAME_GROUP:
+            return {"type": "group_sealed", "sealed": encrypted_data}
+        if kind == FRAME_FILE:
+            return {"type": "file_chunk", "chunk": encrypted_data}
+        return open_message(self.cipher, kind, encrypted_data, self.compression)
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def shutdown(self):
+        # shutdown acorda as threads bloqueadas em recv/send neste socket
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def close(self):
+        """Encerra o canal. Com a fila ativa, o que já foi enfileirado ainda é enviado antes."""
+        if self.outbound is None or self.closed:
+            self.closed = True
+            self.sock.close()
+            return
+        self.closed = True
+        try:
+            self.outbound.put_nowait(None)
+        except queue.Full:
+            self.shutdown()
@@ -0,0 +1,75 @@
+import zlib
+from utils.framing_utils import MAX_FRAME_SIZE
+
+COMPRESSION_THRESHOLD = 256 # Mensagens menores vão sem compressão
+
+# Primeiro byte do texto claro no envelope com compressão
+CODEC_RAW = 0
+CODEC_DEFLATE = 1
+
+# Janela de 4 KiB e memLevel 5: cerca de 32 KiB por conexão, criados só na primeira
+# mensagem comprimida, em vez dos ~256 KiB do padrão do zlib
+WINDOW_BITS = 12
+MEM_LEVEL = 5
+SYNC_FLUSH_TAIL = b"\x00\x00\xff\xff" # Fim de todo Z_SYNC_FLUSH; não precisa ir no fio
+
+# Trechos que se repetem no protocolo, do menos para o mais frequente (o fim do dicionário
+# fica mais perto dos dados e custa menos para referenciar)
+PRESET_DICTIONARY = (
+    b'"event":"room-closed","event":"member-offline","reason":"disconnected","reason":"joined"'
+    b'"type":"group_member_left","type":"group_key","key-id":,"key":"","msg-id":"'
+    b'"cmd":"get-room-members","cmd":"list-rooms","cmd":"join-room","room-name":"'
+    b'"rooms":[{"topology":"mesh","topology":"overlay","event":"member-online","room":"'
+    b'"members":{"user-ip":"127.0.0.1","user-port":,"peer-public-key":"","envelope":'
+    b'"status":"ok","message":"","request-id":,"type":"chat_message","content":"","from":"'
+)
+
+class Compression_context:
+    """Estado de compressão de uma conexão: um fluxo deflate em cada sentido.
+
+    O fluxo é contínuo durante toda a conexão (Z_SYNC_FLUSH por mensagem), então chaves
+    JSON e nomes de usuário que já passaram por ela viram referências curtas. Os dois
+    lados precisam processar as mensagens comprimidas na mesma ordem em que foram
+    enviadas, o que o canal já garante.
+    """
+
+    def __init__(self, threshold=COMPRESSION_THRESHOLD):
+        self.threshold = threshold
+        self.compressor = None
+        self.decompressor = None
+        self.stats = {"compressed": 0, "bytes-in": 0, "bytes-out": 0, "bytes-saved": 0}
+
+    def compress(self, data):
+        if self.threshold is None or len(data) < self.threshold:
+            return bytes([CODEC_RAW]) + data
+
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -WINDOW_BITS,
+                                               MEM_LEVEL, zdict=PRESET_DICTIONARY)
+        body = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        body = body[:-len(SYNC_FLUSH_TAIL)]
+
+        self.stats["compressed"] += 1
+        self.stats["bytes-in"] += len(data)
+        self.stats["bytes-out"] += len(body)
+        self.stats["bytes-saved"] += len(data) - len(body)
+        return bytes([CODEC_DEFLATE]) + body
+
+    def decompress(self, data):
+        if not data:
+            raise ValueError("Mensagem sem o byte de compressão")
+        codec, body = data[0], data[1:]
+        if codec == CODEC_RAW:
+            return body
+        if codec != CODEC_DEFLATE:
+            raise ValueError(f"Compressão desconhecida: {codec}")
+
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(-WINDOW_BITS, zdict=PRESET_DICTIONARY)
+        try:
+            data = self.decompressor.decompress(body + SYNC_FLUSH_TAIL, MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise ValueError(f"Mensagem comprimida inválida: {e}")
+        if self.decompressor.unconsumed_tail:
+            raise ValueError("Mensagem descomprimida excede o tamanho máximo")
+        return data
@@ -1,6 +1,18 @@
 from nacl.public import PrivateKey, PublicKey, Box
-from nacl.encoding import Base64Encoder
-import base64, hashlib
+from nacl.signing import SigningKey, VerifyKey
+from nacl.secret import SecretBox
+from nacl.encoding import Base64Encoder, RawEncoder
+from nacl.hash import blake2b
+from nacl.utils import random as random_bytes
+from nacl.exceptions import InvalidkeyError
+from nacl import pwhash
+import base64, hashlib, hmac, struct, threading
+
+SESSION_SALT_SIZE = 16
+
+# Custo do argon2id das senhas; cada hash usa PASSWORD_MEMLIMIT bytes de memória
+PASSWORD_OPSLIMIT = pwhash.argon2id.OPSLIMIT_INTERACTIVE
+PASSWORD_MEMLIMIT = pwhash.argon2id.MEMLIMIT_INTERACTIVE
 
 def generate_ecc_keys():
     private_key = PrivateKey.generate()
@@ -13,7 +25,19 @@ def serialize_public_key(public_key):
 def deserialize_public_key(public_key_str):
     return PublicKey(public_key_str.encode('utf-8'), encoder=Base64Encoder)
 
+def generate_signing_key():
+    return SigningKey.generate()
+
+def serialize_verify_key(signing_key):
+    return signing_key.verify_key.encode(encoder=Base64Encoder).decode('utf-8')
+
+def deserialize_verify_key(verify_key_str):
+    return VerifyKey(verify_key_str.encode('utf-8'), encoder=Base64Encoder)
+
 def encrypt_with_public_key(public_key, message):
+    return base64.b64encode(seal_with_public_key(public_key, message)).decode('utf-8')
+
+def seal_with_public_key(public_key, message):
     if isinstance(message, str):
         message = message.encode('utf-8')
     
@@ -27,13 +51,12 @@ def encrypt_with_public_key(public_key, message):
     encrypted = box.encrypt(message)
     
     # Combina a chave pública efêmera com a mensagem criptografada
-    combined = bytes(ephemeral_public) + encrypted
-    
-    return base64.b64encode(combined).decode('utf-8')
+    return bytes(ephemeral_public) + encrypted
 
 def decrypt_with_private_key(private_key, encrypted_message):
-    encrypted_message = base64.b64decode(encrypted_message)
-    
+    return open_with_private_key(private_key, base64.b64decode(encrypted_message)).decode('utf-8')
+
+def open_with_private_key(private_key, encrypted_message):
     # Extrai a chave pública efêmera (32 bytes) e o texto cifrado
     ephemeral_public_bytes = encrypted_message[:32]
     ciphertext = encrypted_message[32:]
@@ -44,13 +67,188 @@ def decrypt_with_private_key(private_key, encrypted_message):
     box = Box(private_key, ephemeral_public)
     
     # Descriptografa a mensagem
-    decrypted = box.decrypt(ciphertext)    
-    return decrypted.decode('utf-8')
+    return box.decrypt(ciphertext)
+
+def generate_session_salt(raw=False):
+    salt = random_bytes(SESSION_SALT_SIZE)
+    return salt if raw else base64.b64encode(salt).decode('utf-8')
+
+def derive_session_key(private_key, peer_public_key, session_salt):
+    # Um único acordo X25519 por conexão; o salt aleatório garante chave nova a cada sessão
+    if isinstance(session_salt, str):
+        session_salt = base64.b64decode(session_salt)
+    shared_key = Box(private_key, peer_public_key).shared_key()
+    return blake2b(shared_key, digest_size=SecretBox.KEY_SIZE, salt=session_salt,
+                   person=b"chatp2p-session", encoder=RawEncoder)
+
+class Public_key_cipher:
+    """Modo legado: um acordo de chaves efêmero por mensagem."""
+
+    def __init__(self, private_key, peer_public_key):
+        self.private_key = private_key
+        self.peer_public_key = peer_public_key
+
+    def encrypt(self, message):
+        return encrypt_with_public_key(self.peer_public_key, message)
+
+    def decrypt(self, encrypted_message):
+        return decrypt_with_private_key(self.private_key, encrypted_message)
+
+class Session_cipher:
+    """Criptografia simétrica autenticada com a chave derivada no handshake.
+
+    O nonce é formado pelo sentido da conexão e por um contador, então cada lado
+    só precisa verificar que os contadores recebidos chegam em sequência.
+    """
+
+    def __init__(self, session_key, initiator):
+        self.box = SecretBox(session_key)
+        self.send_direction = b"\x01" if initiator else b"\x02"
+        self.recv_direction = b"\x02" if initiator else b"\x01"
+        self.send_counter = 0
+        self.recv_counter = 0
+        self.counter_lock = threading.Lock()
+
+    def make_nonce(self, direction, counter):
+        return direction + counter.to_bytes(SecretBox.NONCE_SIZE - 1, 'big')
+
+    def encrypt(self, message):
+        return base64.b64encode(self.encrypt_bytes(message)).decode('utf-8')
+
+    def decrypt(self, encrypted_message):
+        return self.decrypt_bytes(base64.b64decode(encrypted_message)).decode('utf-8')
+
+    def encrypt_bytes(self, message):
+        """Retorna nonce + texto cifrado em bytes, sem base64 (usado pelo envelope binário)."""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+
+        with self.counter_lock:
+            nonce = self.make_nonce(self.send_direction, self.send_counter)
+            self.send_counter += 1
+
+        return bytes(self.box.encrypt(message, nonce))
+
+    def decrypt_bytes(self, encrypted_message):
+        nonce = encrypted_message[:SecretBox.NONCE_SIZE]
+
+        with self.counter_lock:
+            if nonce != self.make_nonce(self.recv_direction, self.recv_counter):
+                raise ValueError("Nonce fora de sequência na sessão")
+            decrypted = self.box.decrypt(encrypted_message)
+            self.recv_counter += 1
 
-def hash_password(password):
+        return decrypted
+
+# Cabeçalho em claro da mensagem de sala: id da chave, id da mensagem e tamanho do nome do remetente
+GROUP_HEADER = struct.Struct(">I8sB")
+GROUP_SIGNATURE_SIZE = 64
+
+class Group_sender_key:
+    """Chave simétrica com que um membro cifra, uma única vez, suas mensagens para a sala.
+
+    Cada membro tem a sua e a distribui pelos canais par a par; a mensagem cifrada leva
+    em claro o id da chave, o id da mensagem e o remetente, para que quem só repassa a
+    mensagem (modo overlay) não precise decifrá-la.
+    """
+
+    def __init__(self, key_id, key=None):
+        self.key_id = key_id
+        self.key = key or random_bytes(SecretBox.KEY_SIZE)
+        self.box = SecretBox(self.key)
+
+    def export_message(self, sender, message_id, signing_key):
+        message = {"type": "group_key", "from": sender, "msg-id": message_id.hex(), "key-id": self.key_id,
+                   "key": base64.b64encode(self.key).decode('utf-8')}
+        message["signature"] = base64.b64encode(signing_key.sign(group_key_payload(message)).signature).decode('utf-8')
+        return message
+
+    @staticmethod
+    def from_message(message, verify_key=None):
+        """Lê um anúncio de chave; com verify_key, recusa (BadSignatureError) o que o remetente não assinou."""
+        if verify_key is not None:
+            verify_key.verify(group_key_payload(message), base64.b64decode(message["signature"]))
+        return Group_sender_key(message["key-id"], base64.b64decode(message["key"]))
+
+    def seal(self, message, sender, message_id):
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        sender = sender.encode('utf-8')
+        return GROUP_HEADER.pack(self.key_id, message_id, len(sender)) + sender + self.box.encrypt(message)
+
+def group_key_payload(message):
+    return f"{message['from']}\n{message['msg-id']}\n{message['key-id']}\n{message['key']}".encode('utf-8')
+
+def sign_group_message(signing_key, sealed_message):
+    # A assinatura vai no fim: o cabeçalho continua legível por quem só repassa a mensagem
+    return sealed_message + signing_key.sign(sealed_message).signature
+
+def verify_group_message(verify_key, signed_message):
+    """Retorna a mensagem cifrada sem a assinatura, ou levanta BadSignatureError."""
+    sealed_message = signed_message[:-GROUP_SIGNATURE_SIZE]
+    verify_key.verify(sealed_message, signed_message[-GROUP_SIGNATURE_SIZE:])
+    return sealed_message
+
+def read_group_header(sealed_message):
+    """Retorna (id da chave, id da mensagem, remetente, início do texto cifrado)."""
+    key_id, message_id, sender_size = GROUP_HEADER.unpack_from(sealed_message)
+    body_start = GROUP_HEADER.size + sender_size
+    return key_id, message_id, sealed_message[GROUP_HEADER.size:body_start].decode('utf-8'), body_start
+
+def open_group_message(sender_keys, sealed_message):
+    key_id, _, _, body_start = read_group_header(sealed_message)
+    if key_id not in sender_keys:
+        raise ValueError(f"Chave de grupo {key_id} desconhecida")
+    return sender_keys[key_id].box.decrypt(sealed_message[body_start:]).decode('utf-8')
+
+class File_chunk_cipher:
+    """Chave de uma transferência de arquivo, enviada na oferta pelo canal já cifrado.
+
+    Cada pedaço é autenticado por si só; o nonce vem do id da transferência e do offset,
+    então um pedaço fora do lugar não é aceito.
+    """
+
+    def __init__(self, key=None):
+        self.key = key or random_bytes(SecretBox.KEY_SIZE)
+        self.box = SecretBox(self.key)
+
+    def make_nonce(self, transfer_id, offset):
+        return transfer_id + offset.to_bytes(8, 'big') + bytes(SecretBox.NONCE_SIZE - len(transfer_id) - 8)
+
+    def seal(self, transfer_id, offset, chunk):
+        return self.box.encrypt(chunk, self.make_nonce(transfer_id, offset)).ciphertext
+
+    def open(self, transfer_id, offset, sealed_chunk):
+        return self.box.decrypt(sealed_chunk, self.make_nonce(transfer_id, offset))
+
+def hash_password(password, opslimit=PASSWORD_OPSLIMIT, memlimit=PASSWORD_MEMLIMIT):
+    """Hash argon2id com salt aleatório no formato $argon2id$..., que já guarda salt e parâmetros."""
+    if isinstance(password, str):
+        password = password.encode('utf-8')
+    return pwhash.argon2id.str(password, opslimit=opslimit, memlimit=memlimit).decode('ascii')
+
+def hash_password_legacy(password):
+    # Formato antigo (SHA-256 sem salt), mantido só para verificar senhas ainda não migradas
     if isinstance(password, str):
         password = password.encode('utf-8')
     
     sha256_hash = hashlib.sha256()
     sha256_hash.update(password)
-    return sha256_hash.hexdigest()
\ No newline at end of file
+    return sha256_hash.hexdigest()
+
+def verify_password(password_hash, password):
+    if isinstance(password, str):
+        password = password.encode('utf-8')
+    if password_hash.startswith("$argon2"):
+        try:
+            return pwhash.verify(password_hash.encode('ascii'), password)
+        except InvalidkeyError:
+            return False
+    return hmac.compare_digest(password_hash, hash_password_legacy(password))
+
+def password_needs_rehash(password_hash, opslimit=PASSWORD_OPSLIMIT, memlimit=PASSWORD_MEMLIMIT):
+    """Hash no formato antigo ou com parâmetros diferentes dos atuais: refazer no próximo login."""
+    if not password_hash.startswith("$argon2id$"):
+        return True
+    parameters = password_hash.split("$")[3] # m=<KiB>,t=<iterações>,p=<paralelismo>
+    return parameters != f"m={memlimit // 1024},t={opslimit},p=1"
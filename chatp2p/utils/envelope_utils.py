@@ -0,0 +1,56 @@
+import json, struct
+from nacl.public import PublicKey
+from utils.framing_utils import FRAME_MESSAGE, FRAME_ENVELOPE
+from utils.encrypt_utils import SESSION_SALT_SIZE
+from utils.compression_utils import Compression_context
+
+# Versão do envelope binário que este cliente entende; 0 significa só o formato legado
+# (JSON cifrado em base64 dentro do frame). Os dois lados usam a menor versão anunciada.
+ENVELOPE_VERSION = 2
+ENVELOPE_COMPRESSION = 2 # A partir desta versão o texto claro começa com o byte de compressão
+
+# Handshake binário: versão, chave pública e salt da sessão em bytes, seguidos
+# (entre peers) do pedido inicial cifrado para a chave pública do destinatário
+HANDSHAKE_HEADER = struct.Struct(f">B{PublicKey.SIZE}s{SESSION_SALT_SIZE}s")
+
+def negotiate_envelope(remote_version):
+    return min(ENVELOPE_VERSION, remote_version or 0)
+
+def new_compression_context(envelope):
+    return Compression_context() if envelope >= ENVELOPE_COMPRESSION else None
+
+def encode_payload(message):
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
+
+def seal_message(cipher, message, envelope, compression=None):
+    """Cifra a mensagem para o canal e retorna (tipo do frame, payload).
+
+    Com um contexto de compressão, o texto claro é comprimido antes de ser cifrado.
+    """
+    if envelope:
+        data = encode_payload(message)
+        if compression is not None:
+            data = compression.compress(data)
+        return FRAME_ENVELOPE, cipher.encrypt_bytes(data)
+    return FRAME_MESSAGE, cipher.encrypt(json.dumps(message)).encode('utf-8')
+
+def open_message(cipher, kind, payload, compression=None):
+    # O formato vem no tipo do frame, então os dois são aceitos em qualquer conexão
+    if kind == FRAME_ENVELOPE:
+        data = cipher.decrypt_bytes(payload)
+        if compression is not None:
+            data = compression.decompress(data)
+        return json.loads(data)
+    return json.loads(cipher.decrypt(payload.decode('utf-8')))
+
+def encode_handshake(version, public_key, session_salt, sealed_request=b""):
+    return HANDSHAKE_HEADER.pack(version, bytes(public_key), session_salt) + sealed_request
+
+def decode_handshake(data):
+    """Retorna (versão, chave pública, salt, pedido cifrado)."""
+    if len(data) < HANDSHAKE_HEADER.size:
+        raise ValueError("Handshake binário incompleto")
+    version, public_key, session_salt = HANDSHAKE_HEADER.unpack_from(data)
+    if not 1 <= version <= ENVELOPE_VERSION:
+        raise ValueError(f"Versão de envelope não suportada: {version}")
+    return version, PublicKey(public_key), session_salt, data[HANDSHAKE_HEADER.size:]
@@ -0,0 +1,87 @@
+import asyncio, struct
+
+# Cada mensagem no socket é precedida por um cabeçalho com o tipo do frame (1 byte)
+# e o tamanho do payload (4 bytes, big-endian)
+FRAME_HEADER = struct.Struct(">BI")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# O primeiro frame de uma conexão (handshake) chega antes de qualquer autenticação
+MAX_HANDSHAKE_FRAME_SIZE = 16 * 1024
+# Frames maiores que isso não são alocados de uma vez: o buffer cresce conforme os dados chegam
+RECV_CHUNK_SIZE = 256 * 1024
+
+FRAME_MESSAGE = 0    # mensagem cifrada com a chave do canal (JSON em base64, formato legado)
+FRAME_GROUP = 1      # mensagem de sala cifrada uma única vez com a chave de grupo do remetente
+FRAME_ENVELOPE = 2   # mensagem cifrada com a chave do canal em envelope binário
+FRAME_HANDSHAKE = 3  # handshake binário: versão, chave pública e salt em bytes
+FRAME_FILE = 4       # pedaço de arquivo cifrado com a chave da transferência
+
+def encode_frame(payload, kind=FRAME_MESSAGE):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError(f"Mensagem excede o tamanho máximo de {MAX_FRAME_SIZE} bytes")
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+def decode_frame_header(header, max_size=MAX_FRAME_SIZE):
+    kind, length = FRAME_HEADER.unpack(header)
+    if length > max_size:
+        raise ValueError(f"Frame de {length} bytes excede o tamanho máximo permitido")
+    return kind, length
+
+def send_frame(sock, payload, kind=FRAME_MESSAGE):
+    sock.sendall(encode_frame(payload, kind))
+
+def recv_exact(sock, size):
+    # Começa com no máximo RECV_CHUNK_SIZE e dobra só quando o buffer enche: um cabeçalho
+    # anunciando um frame enorme não reserva a memória antes de os dados chegarem
+    buffer = bytearray(min(size, RECV_CHUNK_SIZE))
+    received = 0
+    while received < size:
+        if received == len(buffer):
+            buffer.extend(bytes(min(len(buffer), size - received)))
+        with memoryview(buffer) as view, view[received:] as target:
+            n = sock.recv_into(target)
+        if n == 0:
+            break
+        received += n
+    del buffer[received:]
+    return bytes(buffer)
+
+def recv_frame_with_kind(sock, max_size=MAX_FRAME_SIZE):
+    """Lê um frame completo do socket, remontando-o a partir de quantos recv forem necessários.
+
+    Retorna (tipo, payload), com payload b"" se a conexão foi fechada entre dois frames.
+    Use max_size=MAX_HANDSHAKE_FRAME_SIZE para o primeiro frame de uma conexão.
+    """
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if not header:
+        return FRAME_MESSAGE, b""
+    if len(header) < FRAME_HEADER.size:
+        raise ConnectionResetError("Conexão encerrada no meio de um frame")
+
+    kind, length = decode_frame_header(header, max_size)
+    payload = recv_exact(sock, length)
+    if len(payload) < length:
+        raise ConnectionResetError("Conexão encerrada no meio de um frame")
+    return kind, payload
+
+def recv_frame(sock, max_size=MAX_FRAME_SIZE):
+    return recv_frame_with_kind(sock, max_size)[1]
+
+async def read_frame_with_kind(reader, max_size=MAX_FRAME_SIZE):
+    """Equivalente a recv_frame_with_kind para um asyncio.StreamReader."""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return FRAME_MESSAGE, b""
+        raise ConnectionResetError("Conexão encerrada no meio de um frame")
+
+    kind, length = decode_frame_header(header, max_size)
+    try:
+        return kind, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionResetError("Conexão encerrada no meio de um frame")
+
+async def read_frame(reader, max_size=MAX_FRAME_SIZE):
+    return (await read_frame_with_kind(reader, max_size))[1]
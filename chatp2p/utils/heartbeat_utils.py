@@ -0,0 +1,29 @@
+import hashlib, hmac, os, struct
+
+# Datagrama de heartbeat: id da sessão (8 bytes), contador (8 bytes) e MAC (16 bytes).
+# O contador só cresce, então um datagrama capturado não pode ser reenviado depois.
+HEARTBEAT_HEADER = struct.Struct(">8sQ")
+HEARTBEAT_MAC_SIZE = 16
+HEARTBEAT_DATAGRAM_SIZE = HEARTBEAT_HEADER.size + HEARTBEAT_MAC_SIZE
+SESSION_ID_SIZE = 8
+HEARTBEAT_KEY_SIZE = 32
+
+def new_heartbeat_credentials():
+    return os.urandom(SESSION_ID_SIZE), os.urandom(HEARTBEAT_KEY_SIZE)
+
+def heartbeat_mac(key, header):
+    return hashlib.blake2b(header, key=key, digest_size=HEARTBEAT_MAC_SIZE).digest()
+
+def encode_heartbeat(session_id, counter, key):
+    header = HEARTBEAT_HEADER.pack(session_id, counter)
+    return header + heartbeat_mac(key, header)
+
+def decode_heartbeat(datagram):
+    """Separa (id da sessão, contador) do datagrama, sem verificar o MAC."""
+    if len(datagram) != HEARTBEAT_DATAGRAM_SIZE:
+        raise ValueError(f"Datagrama de heartbeat com {len(datagram)} bytes")
+    return HEARTBEAT_HEADER.unpack_from(datagram)
+
+def verify_heartbeat(key, datagram):
+    header = datagram[:HEARTBEAT_HEADER.size]
+    return hmac.compare_digest(heartbeat_mac(key, header), datagram[HEARTBEAT_HEADER.size:])
@@ -0,0 +1,234 @@
+import bisect, json, mmap, os, struct, threading, time
+
+HISTORY_SEGMENT_SIZE = 1024 * 1024 # Bytes de mensagens por segmento antes de abrir o próximo
+HISTORY_MAX_SEGMENTS = 16          # Segmentos mantidos por conversa; os mais antigos são apagados
+
+# Entrada do índice de cada segmento: instante da mensagem (ms) e posição do registro no .log
+INDEX_ENTRY = struct.Struct(">QQ")
+
+class Index_view:
+    """Índice de um segmento visto como sequência de (instante, posição), mapeado em memória."""
+
+    def __init__(self, path):
+        self.map = None
+        self.count = 0
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            self.count = size // INDEX_ENTRY.size
+            if self.count:
+                self.map = mmap.mmap(file.fileno(), self.count * INDEX_ENTRY.size, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        return INDEX_ENTRY.unpack_from(self.map, position * INDEX_ENTRY.size)
+
+    def timestamp(self, position):
+        return self[position][0]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+
+class Timestamps:
+    # Adaptador para bisect procurar pelo instante sem copiar o índice
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, position):
+        return self.index.timestamp(position)
+
+class History_log:
+    """Histórico de uma conversa em segmentos append-only, cada um com um índice de posições.
+
+    Os segmentos se chamam pelo número de sequência da sua primeira mensagem
+    (00000000000000000042.log e .idx). Anexar custa uma escrita no .log e outra no .idx;
+    as leituras mapeiam o índice em memória e leem do .log só os registros pedidos, então
+    "últimas N", rolagem para trás e intervalos de tempo não carregam o arquivo inteiro.
+    Passando de max_segments, o segmento mais antigo é apagado.
+    """
+
+    def __init__(self, directory, segment_size=HISTORY_SEGMENT_SIZE, max_segments=HISTORY_MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log"))
+        if not self.segments:
+            self.segments = [0]
+        self.log_fd = None
+        self.index_fd = None
+        self.open_active_segment()
+
+    def segment_path(self, base, extension):
+        return os.path.join(self.directory, f"{base:020d}{extension}")
+
+    def open_active_segment(self):
+        base = self.segments[-1]
+        self.log_fd = os.open(self.segment_path(base, ".log"), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.index_fd = os.open(self.segment_path(base, ".idx"), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.repair_active_segment()
+        index_size = os.fstat(self.index_fd).st_size
+        self.active_count = index_size // INDEX_ENTRY.size
+        self.log_size = os.fstat(self.log_fd).st_size
+        self.last_timestamp = 0
+        if self.active_count:
+            self.last_timestamp = INDEX_ENTRY.unpack(os.pread(self.index_fd, INDEX_ENTRY.size, index_size - INDEX_ENTRY.size))[0]
+
+    def repair_active_segment(self):
+        # Uma escrita interrompida pode deixar meia entrada no índice ou um registro sem
+        # entrada no .log; os dois são descartados
+        index_size = os.fstat(self.index_fd).st_size
+        count = index_size // INDEX_ENTRY.size
+        log_size = os.fstat(self.log_fd).st_size
+        end = 0
+        while count:
+            _, position = INDEX_ENTRY.unpack(os.pread(self.index_fd, INDEX_ENTRY.size, (count - 1) * INDEX_ENTRY.size))
+            tail = os.pread(self.log_fd, log_size - position, position) if position < log_size else b""
+            if b"\n" in tail:
+                end = position + tail.index(b"\n") + 1
+                break
+            count -= 1
+        os.ftruncate(self.index_fd, count * INDEX_ENTRY.size)
+        os.ftruncate(self.log_fd, end)
+
+    def append(self, record, timestamp=None):
+        """Anexa um registro (dicionário) e retorna seu número de sequência."""
+        line = json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n"
+        with self.lock:
+            if self.log_size and self.log_size + len(line) > self.segment_size:
+                self.rotate()
+            # O índice precisa de instantes em ordem para a busca binária, mesmo se o relógio voltar
+            timestamp_ms = max(int((timestamp or time.time()) * 1000), self.last_timestamp)
+            os.write(self.log_fd, line)
+            os.write(self.index_fd, INDEX_ENTRY.pack(timestamp_ms, self.log_size))
+            self.log_size += len(line)
+            self.last_timestamp = timestamp_ms
+            self.active_count += 1
+            return self.segments[-1] + self.active_count - 1
+
+    def rotate(self):
+        os.close(self.log_fd)
+        os.close(self.index_fd)
+        self.segments.append(self.segments[-1] + self.active_count)
+        while len(self.segments) > self.max_segments:
+            base = self.segments.pop(0)
+            for extension in (".log", ".idx"):
+                try:
+                    os.remove(self.segment_path(base, extension))
+                except FileNotFoundError:
+                    pass
+        self.open_active_segment()
+
+    def next_sequence(self):
+        with self.lock:
+            return self.segments[-1] + self.active_count
+
+    def first_sequence(self):
+        with self.lock:
+            return self.segments[0]
+
+    def last(self, count, before=None):
+        """Retorna até `count` registros anteriores à sequência `before` (padrão: os mais recentes)."""
+        with self.lock:
+            end = self.segments[-1] + self.active_count
+            segments = list(self.segments)
+        end = end if before is None else min(before, end)
+        return self.read(max(end - count, segments[0]), end, segments)
+
+    def read(self, start, end, segments=None):
+        """Registros com sequência em [start, end), cada um com as chaves "seq" e "time"."""
+        if segments is None:
+            with self.lock:
+                segments = list(self.segments)
+        records = []
+        first = max(bisect.bisect_right(segments, start) - 1, 0)
+        for base in segments[first:]:
+            if base >= end:
+                break
+            records.extend(self.read_segment(base, lambda index: (max(start - base, 0), min(end - base, len(index)))))
+        return records
+
+    def between(self, start_time, end_time, limit=None):
+        """Registros com instante em [start_time, end_time), em segundos desde a época."""
+        start_ms, end_ms = int(start_time * 1000), int(end_time * 1000)
+        with self.lock:
+            segments = list(self.segments)
+
+        def bounds(index):
+            timestamps = Timestamps(index)
+            return bisect.bisect_left(timestamps, start_ms), bisect.bisect_left(timestamps, end_ms)
+
+        records = []
+        for position, base in enumerate(segments):
+            if self.segment_start_time(base) >= end_ms:
+                break
+            # Se o próximo segmento já começa antes do intervalo, este é todo anterior a ele
+            if position + 1 < len(segments) and self.segment_start_time(segments[position + 1]) < start_ms:
+                continue
+            records.extend(self.read_segment(base, bounds))
+            if limit is not None and len(records) >= limit:
+                return records[:limit]
+        return records
+
+    def segment_start_time(self, base):
+        try:
+            index = Index_view(self.segment_path(base, ".idx"))
+        except FileNotFoundError:
+            return float("inf")
+        try:
+            return index.timestamp(0) if len(index) else float("inf")
+        finally:
+            index.close()
+
+    def read_segment(self, base, bounds):
+        try:
+            index = Index_view(self.segment_path(base, ".idx"))
+            log_file = open(self.segment_path(base, ".log"), "rb")
+        except FileNotFoundError:
+            return [] # Segmento apagado pela rotação durante a leitura
+        try:
+            first, last = bounds(index)
+            if first >= last:
+                return []
+            log_map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                records = []
+                for position in range(first, last):
+                    timestamp_ms, offset = index[position]
+                    line_end = log_map.find(b"\n", offset)
+                    if line_end < 0:
+                        break # Registro ainda sendo escrito
+                    record = json.loads(log_map[offset:line_end])
+                    record["seq"] = base + position
+                    record["time"] = timestamp_ms / 1000
+                    records.append(record)
+                return records
+            finally:
+                log_map.close()
+        finally:
+            index.close()
+            log_file.close()
+
+    def disk_usage(self):
+        with self.lock:
+            segments = list(self.segments)
+        total = 0
+        for base in segments:
+            for extension in (".log", ".idx"):
+                try:
+                    total += os.path.getsize(self.segment_path(base, extension))
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def close(self):
+        with self.lock:
+            os.close(self.log_fd)
+            os.close(self.index_fd)
@@ -0,0 +1,168 @@
+import json, os, threading, time
+from utils.log_utils import logger
+
+JOURNAL_RETRY_DELAY = 1 # Segundos entre tentativas depois de uma falha de escrita
+
+class Journal:
+    """Persistência por diário de mutações (append-only) com snapshots compactados.
+
+    Cada mutação vira uma linha JSON anexada ao diário, então o custo de escrita é
+    proporcional à mudança. Uma thread de fundo agrupa as linhas pendentes em uma única
+    escrita + fsync (group commit) e, periodicamente, grava o estado completo no arquivo
+    de snapshot e trunca o diário. Na inicialização o snapshot é carregado e o diário
+    reaplicado por cima dele.
+
+    As entradas precisam ser idempotentes: se o processo cair entre gravar o snapshot e
+    truncar o diário, as entradas já incluídas no snapshot são reaplicadas.
+
+    serialize_state roda com state_lock adquirido e deve retornar uma cópia do estado: a
+    conversão para JSON e a escrita do snapshot acontecem depois, fora do lock.
+    """
+
+    def __init__(self, data_file, apply_entry, state_lock, serialize_state, deserialize_state=None,
+                 flush_interval=0.05, compact_every=1000, compact_interval=300):
+        self.data_file = data_file
+        self.journal_file = os.path.splitext(data_file)[0] + ".journal"
+        self.apply_entry = apply_entry
+        self.state_lock = state_lock
+        self.serialize_state = serialize_state
+        self.deserialize_state = deserialize_state
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+
+        self.pending = []
+        self.appended_seq = 0
+        self.durable_seq = 0
+        self.failed_seq = 0 # Maior sequência incluída em uma escrita que falhou
+        self.entries_since_snapshot = 0
+        self.last_compaction = time.time()
+        self.pending_cond = threading.Condition()
+        self.file_lock = threading.Lock()
+        self.journal_fd = None
+
+    def load(self):
+        state = {}
+        if os.path.exists(self.data_file):
+            try:
+                with open(self.data_file, "r") as f:
+                    state = json.load(f)
+            except json.JSONDecodeError:
+                logger.error("Erro ao carregar %s", self.data_file)
+                state = {}
+        if self.deserialize_state:
+            state = self.deserialize_state(state)
+
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Última linha incompleta de uma escrita interrompida
+                        break
+                    self.apply_entry(state, entry)
+                    self.entries_since_snapshot += 1
+        return state
+
+    def start(self):
+        self.journal_fd = os.open(self.journal_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+
+    def append(self, entry):
+        """Enfileira uma mutação e retorna seu número de sequência, sem esperar pelo disco."""
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self.pending_cond:
+            self.pending.append(line)
+            self.appended_seq += 1
+            self.pending_cond.notify_all()
+            return self.appended_seq
+
+    def wait_durable(self, seq, timeout=5):
+        """Bloqueia até a entrada `seq` ter passado pelo fsync; False se o prazo acabar ou a escrita dela falhar."""
+        with self.pending_cond:
+            self.pending_cond.wait_for(lambda: self.durable_seq >= seq or self.failed_seq >= seq, timeout)
+            return self.durable_seq >= seq
+
+    def flush_loop(self):
+        while True:
+            with self.pending_cond:
+                self.pending_cond.wait_for(lambda: self.pending, timeout=self.compact_interval)
+
+            # Espera um pouco para agrupar as mutações de várias requisições no mesmo fsync
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                # Disco cheio, erro de E/S: as linhas voltam para a fila e a escrita é tentada de novo
+                logger.error("Falha ao gravar o diário %s: %s", self.journal_file, e)
+                time.sleep(JOURNAL_RETRY_DELAY)
+                continue
+
+            if (self.entries_since_snapshot >= self.compact_every or
+                    (self.entries_since_snapshot and time.time() - self.last_compaction >= self.compact_interval)):
+                try:
+                    self.compact()
+                except OSError as e:
+                    logger.error("Falha ao compactar %s: %s", self.data_file, e)
+
+    def flush(self):
+        with self.file_lock:
+            with self.pending_cond:
+                lines, self.pending = self.pending, []
+                seq = self.appended_seq
+            if not lines:
+                return
+
+            offset = os.lseek(self.journal_fd, 0, os.SEEK_END)
+            try:
+                os.write(self.journal_fd, "".join(lines).encode("utf-8"))
+                os.fsync(self.journal_fd)
+            except OSError:
+                try:
+                    # Uma linha gravada pela metade no meio do diário esconderia as seguintes na carga
+                    os.ftruncate(self.journal_fd, offset)
+                except OSError:
+                    pass
+                with self.pending_cond:
+                    self.pending[:0] = lines
+                    self.failed_seq = seq
+                    self.pending_cond.notify_all()
+                raise
+            self.entries_since_snapshot += len(lines)
+
+            with self.pending_cond:
+                self.durable_seq = seq
+                self.pending_cond.notify_all()
+
+    def compact(self):
+        """Grava um snapshot do estado atual e descarta o diário que ele já contém."""
+        with self.file_lock:
+            # Copia o estado e marca as entradas pendentes no mesmo instante; as pendentes já
+            # estão refletidas na cópia e não precisam ir para o diário. Só a cópia segura o lock
+            with self.state_lock:
+                state = self.serialize_state()
+                with self.pending_cond:
+                    covered = len(self.pending)
+                    seq = self.appended_seq
+
+            snapshot = json.dumps(state, indent=4)
+            tmp_file = self.data_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.data_file)
+
+            with self.pending_cond:
+                del self.pending[:covered]
+
+            if self.journal_fd is not None:
+                os.ftruncate(self.journal_fd, 0)
+                os.fsync(self.journal_fd)
+            self.entries_since_snapshot = 0
+            self.last_compaction = time.time()
+
+            with self.pending_cond:
+                self.durable_seq = seq
+                self.pending_cond.notify_all()
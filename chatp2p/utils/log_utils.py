@@ -0,0 +1,110 @@
+import itertools, queue, sys, threading, time
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "AVISO", ERROR: "ERRO"}
+LEVELS_BY_NAME = {"debug": DEBUG, "info": INFO, "aviso": WARNING, "erro": ERROR}
+
+class Async_logger:
+    """Log estruturado com escrita em uma thread de fundo.
+
+    Quem loga só enfileira o registro (a formatação acontece na thread de escrita). A fila é
+    limitada: quando está cheia o registro é descartado e contado em `dropped`, em vez de
+    bloquear a requisição. Categorias podem ser amostradas (1 a cada N registros).
+    """
+
+    def __init__(self, level=INFO, max_queue=10000, stream=None, sample_rates=None):
+        self.level = level
+        self.stream = stream or sys.stdout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.sample_rates = dict(sample_rates or {})
+        self.sample_counters = {}
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.start_lock = threading.Lock()
+        self.started = False
+
+    def configure(self, level=None, sample_rates=None):
+        if level is not None:
+            self.level = level
+        if sample_rates is not None:
+            self.sample_rates.update(sample_rates)
+            self.sample_counters.clear()
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message, *args, category=None, **fields):
+        if level < self.level:
+            return
+
+        rate = self.sample_rates.get(category, 1)
+        if rate > 1:
+            counter = self.sample_counters.get(category)
+            if counter is None:
+                counter = self.sample_counters.setdefault(category, itertools.count())
+            if next(counter) % rate:
+                return
+
+        if not self.started:
+            self.start()
+
+        try:
+            self.queue.put_nowait((time.time(), level, message, args, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, message, *args, **kwargs):
+        self.log(DEBUG, message, *args, **kwargs)
+
+    def info(self, message, *args, **kwargs):
+        self.log(INFO, message, *args, **kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self.log(WARNING, message, *args, **kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self.log(ERROR, message, *args, **kwargs)
+
+    def start(self):
+        with self.start_lock:
+            if not self.started:
+                self.started = True
+                threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def format_record(self, record):
+        timestamp, level, message, args, fields = record
+        line = f"[{time.strftime('%H:%M:%S', time.localtime(timestamp))}] [{LEVEL_NAMES[level]}] "
+        line += message % args if args else message
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line + "\n"
+
+    def write_loop(self):
+        while True:
+            records = [self.queue.get()]
+            # Escreve em lote tudo o que já estiver na fila
+            try:
+                while len(records) < 512:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            lines = [self.format_record(record) for record in records]
+            if self.dropped != self.reported_dropped:
+                lines.append(self.format_record((time.time(), WARNING, "%d registros de log descartados (fila cheia)",
+                                                 (self.dropped - self.reported_dropped,), {})))
+                self.reported_dropped = self.dropped
+
+            try:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def flush(self, timeout=2):
+        """Espera a fila esvaziar (usado no encerramento do processo)."""
+        deadline = time.time() + timeout
+        while not self.queue.empty() and time.time() < deadline:
+            time.sleep(0.01)
+
+logger = Async_logger()
@@ -0,0 +1,28 @@
+import os
+from collections import OrderedDict
+
+MESSAGE_ID_SIZE = 8
+SEEN_MESSAGES_MAX = 4096
+
+def new_message_id():
+    return os.urandom(MESSAGE_ID_SIZE)
+
+class Seen_messages:
+    """Ids das últimas mensagens vistas (LRU limitado), para descartar as cópias que chegam por outros caminhos."""
+
+    def __init__(self, max_size=SEEN_MESSAGES_MAX):
+        self.max_size = max_size
+        self.ids = OrderedDict()
+
+    def add(self, message_id):
+        """Registra o id; retorna False se ele já tinha sido visto."""
+        if message_id in self.ids:
+            self.ids.move_to_end(message_id)
+            return False
+        self.ids[message_id] = None
+        if len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
+        return True
+
+    def clear(self):
+        self.ids.clear()
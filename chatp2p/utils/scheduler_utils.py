@@ -0,0 +1,67 @@
+import heapq, itertools, threading, time
+from utils.log_utils import logger
+
+class Expiry_scheduler:
+    """Agenda expirações por prazo (heap ordenado por deadline) em uma única thread.
+
+    Reagendar uma chave é O(log n): a entrada antiga fica no heap e é descartada
+    quando chega ao topo. A thread dorme até o próximo prazo e só executa as
+    chaves que realmente venceram.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.entries = {}  # chave -> (deadline, seq, callback)
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def schedule(self, key, deadline, callback):
+        with self.cond:
+            seq = next(self.counter)
+            self.entries[key] = (deadline, seq, callback)
+            heapq.heappush(self.heap, (deadline, seq, key))
+
+            # Reconstrói o heap se as entradas descartadas passarem a dominar
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                self.heap = [(d, s, k) for k, (d, s, _) in self.entries.items()]
+                heapq.heapify(self.heap)
+
+            if self.heap[0][1] == seq:
+                self.cond.notify()
+
+    def cancel(self, key):
+        with self.cond:
+            self.entries.pop(key, None)
+
+    def pop_due(self, now):
+        due = []
+        while self.heap:
+            deadline, seq, key = self.heap[0]
+            entry = self.entries.get(key)
+            if entry is None or entry[1] != seq:
+                heapq.heappop(self.heap)
+                continue
+            if deadline > now:
+                break
+            heapq.heappop(self.heap)
+            del self.entries[key]
+            due.append((key, entry[2]))
+        return due
+
+    def run(self):
+        while True:
+            with self.cond:
+                due = self.pop_due(time.time())
+                if not due:
+                    timeout = self.heap[0][0] - time.time() if self.heap else None
+                    self.cond.wait(timeout)
+                    continue
+
+            for key, callback in due:
+                try:
+                    callback(key)
+                except Exception as e:
+                    logger.error("Falha ao expirar %s: %s", key, e)
@@ -0,0 +1,35 @@
+import threading, time
+from collections import OrderedDict
+
+class Rate_limiter:
+    """Token bucket por origem (ex.: IP): até `burst` operações seguidas e `rate` por segundo depois disso.
+
+    Só as max_sources origens usadas mais recentemente são lembradas, então a memória não
+    cresce com a quantidade de endereços diferentes. rate <= 0 desativa o limite.
+    """
+
+    def __init__(self, rate, burst, max_sources=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict() # origem -> [tokens, instante da última atualização]
+
+    def allow(self, source):
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.pop(source, None)
+            if bucket is None:
+                bucket = [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets[source] = bucket
+            while len(self.buckets) > self.max_sources:
+                self.buckets.popitem(last=False)
+
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True